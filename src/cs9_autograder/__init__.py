@@ -1,12 +1,17 @@
 from .autograder import Autograder
-from .differential import (d_compare, d_compare_pairs, d_returned, d_method)
-from .importing import (ignore_prints, import_from_file,
+from .differential import (d_compare, d_compare_pairs, d_memory,
+                           d_returned, d_method, d_sequence, d_structure)
+from .importing import (current_grading_context, grading_context,
+                        GradingContext, ignore_prints, import_from_file,
                         imported_modules,
                         module_to_path, path_to_module,
                         prepend_import_path,
                         set_submission_path, student_import,
                         submission_path)
-from .testing import (t_coverage, t_module, TestingReport)
+from .scheduling import ScheduledTestSuite
+from .mutation import t_mutation
+from .testing import (CoveragePolicy, t_coverage, t_module, t_time_budget,
+                      TestingReport)
 
 
 # from the gradescope autograder
@@ -1,12 +1,19 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 import traceback
 import unittest
 from typing import Any, Optional
 
+from .comparison import (DEFAULT_MAX_ITEMS, DEFAULT_NODE_ATTRS,
+                         first_difference, multiset_difference,
+                         numeric_difference, stream_difference,
+                         structure_difference)
 from .formatting import h_rule, quoted_listing
-from .importing import (FAILED_IMPORTS, module_to_path, path_to_module,
-                        submission_path)
+from .importing import (current_grading_context, load_lazy_modules,
+                        module_to_path, path_to_module, submission_path)
 from .testing_report import CoverageReport, TestingReport
-from .testing import run_unit_tests_and_coverage, t_coverage, t_module
+from .testing import (CoveragePolicy, DEFAULT_COVERAGE_POLICY,
+                      run_unit_tests_and_coverage, Solution, t_coverage,
+                      t_module, t_time_budget)
 
 
 class Autograder(unittest.TestCase):
@@ -16,13 +23,34 @@ class Autograder(unittest.TestCase):
     method: Optional[str]
     weight: Optional[int]
     testing_report: Optional[TestingReport]
+    testing_reports: dict[str, TestingReport]
     cov_report = Optional[CoverageReport]
+    background_tests: bool = False
+    coverage_policy: CoveragePolicy = DEFAULT_COVERAGE_POLICY
+    profile: Optional[str | bool] = None
+    profile_dir: Optional[str] = None
+    _tests_future: Optional[Future] = None
 
 
     def __init_subclass__(cls, /, correct: Any = None, student: Any = None,
                           method: Optional[str] = None,
                           weight=None,
+                          background_tests: bool = False,
+                          coverage_policy: CoveragePolicy =
+                                DEFAULT_COVERAGE_POLICY,
+                          profile: Optional[str | bool] = None,
+                          profile_dir: Optional[str] = None,
                           **kwargs):
+        """background_tests: start running the student's unit tests as soon
+        as the class is defined. Only the t_module and t_coverage tests wait
+        for the results, so the other tests run while pytest is running.
+        coverage_policy: when to measure the coverage of the student's tests
+        (see CoveragePolicy).
+        profile: profile the student's side of every d_returned test with
+        'cprofile' (or True) or 'sample', and add the student's hotspots to
+        failure messages.
+        profile_dir: where to save the full profiles. Defaults to
+        profiling.DEFAULT_PROFILE_DIR."""
 
         super().__init_subclass__(**kwargs)
 
@@ -35,29 +63,69 @@ class Autograder(unittest.TestCase):
         cls.weight = weight
 
         cls.testing_report = None
+        cls.testing_reports = {}
         cls.cov_report = None
 
+        cls.background_tests = background_tests
+        cls.coverage_policy = coverage_policy
+        cls._tests_future = None
+
+        cls.profile = profile
+        cls.profile_dir = profile_dir
+
+        if background_tests:
+            cls._start_tests_and_coverage()
+
     @classmethod
     def setUpClass(cls):
+        """The student's unit tests aren't run here, but by the first test
+        which needs them, so they don't run when none of those tests do
+        (e.g. when only some of the tests are run again)."""
         super().setUpClass()
-        cls._run_tests_and_coverage()
+        cls._check_test_modules()
 
     @classmethod
-    def _run_tests_and_coverage(cls):
-        cov_modules = cls._coverage_modules()
+    def _check_test_modules(cls):
+        if cls._coverage_modules() and not cls._test_modules():
+            raise ValueError("Cannot check coverage when there is no "
+                             "test module supplied.")
 
-        test_module = None
-        try:
-            test_module = cls._test_module()
-        except ValueError:  # there is no test module
-            if cov_modules:
-                raise ValueError("Cannot check coverage when there is no"
-                                 "test module spplied.")
+    @classmethod
+    def _start_tests_and_coverage(cls):
+        """Start running the unit tests and coverage in a background thread.
+        Does nothing if they have already been started."""
+        if cls._tests_future:
+            return
+
+        cls._check_test_modules()
+        cov_modules = cls._coverage_modules()
+        test_modules = cls._test_modules()
 
         # only run unit tests if specified in the autograder
-        if test_module:
-            cls.testing_report, cls.cov_report = run_unit_tests_and_coverage(
-                test_module, cov_modules, submission_path())
+        if test_modules:
+            executor = ThreadPoolExecutor(max_workers=1)
+            cls._tests_future = executor.submit(
+                run_unit_tests_and_coverage,
+                test_modules, cov_modules, submission_path(),
+                references=cls._references(),
+                coverage_policy=cls.coverage_policy)
+
+            # the thread will exit on its own once pytest is done
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def _wait_for_tests_and_coverage(cls):
+        """Start the unit tests and coverage, unless they have already been
+        started, then block until they have finished and store their
+        reports."""
+        cls._start_tests_and_coverage()
+        if not cls._tests_future:
+            return
+
+        cls.testing_reports, cls.cov_report = cls._tests_future.result()
+
+        if len(cls.testing_reports) == 1:
+            cls.testing_report, = cls.testing_reports.values()
 
     @classmethod
     def _coverage_modules(cls) -> set[str]:
@@ -71,33 +139,98 @@ class Autograder(unittest.TestCase):
         return cov_modules
 
     @classmethod
-    def _test_module(cls) -> str:
-        """Get module that we want to test the coverage for."""
+    def _test_modules(cls) -> list[str]:
+        """Get the test modules that we want to run, in the order that they
+        were declared."""
 
-        mod = None
+        mods = []
         for attr in vars(cls).values():
-            if isinstance(attr, t_module):
-                if mod:
-                    raise ValueError("Only one t_module is supported in "
-                                     "TestingAutograder")
-                mod = attr.module_name
+            if (isinstance(attr, (t_module, t_time_budget))
+                    and attr.module_name not in mods):
+                mods.append(attr.module_name)
 
-        if not mod:
-            raise ValueError("TestingAutograder must have one t_module.")
+        return mods
 
-        return mod
+    @classmethod
+    def _references(cls) -> dict[str, dict[str, Solution]]:
+        """Get the correct modules to run each test module against, for the
+        test modules that have them."""
+
+        references = {}
+        for attr in vars(cls).values():
+            if isinstance(attr, t_module) and attr.reference:
+                references[attr.module_name] = attr.reference
+
+        return references
+
+    def assertStructurallyEqual(self, first, second, msg=None):
+        """Fail if the two values are not equal.
+
+        Unlike assertEqual, this doesn't diff the whole value. It stops at the
+        first difference and only shows a few items around it, so it stays
+        fast on very large values."""
+        difference = first_difference(first, second)
+        if difference is not None:
+            self.fail(self._formatMessage(msg, str(difference)))
+
+    def assertUnorderedEqual(self, first, second, msg=None):
+        """Fail if the two collections don't have the same items, ignoring
+        order.
+
+        Unlike assertCountEqual, nested lists, dicts and sets are frozen and
+        hashed, so this takes linear time even for unhashable items. Use it
+        with `d_returned(..., assertion=Autograder.assertUnorderedEqual)`."""
+        difference = multiset_difference(first, second)
+        if difference:
+            self.fail(self._formatMessage(msg, str(difference)))
+
+    def assertAllClose(self, first, second, rtol=1e-7, atol=0.0, msg=None):
+        """Fail if any number in second is not close to the matching number
+        in first. Both may be numbers or (nested) sequences of numbers.
+
+        Everything is checked in one pass over contiguous arrays, using numpy
+        when it is installed. To use it with d_returned, pass
+        `assertion=partial(Autograder.assertAllClose, rtol=...)`."""
+        difference = numeric_difference(first, second, rtol=rtol, atol=atol)
+        if difference is not None:
+            self.fail(self._formatMessage(msg, str(difference)))
+
+    def assertStructureEqual(self, first, second, attrs=DEFAULT_NODE_ATTRS,
+                             msg=None):
+        """Fail if two linked structures (linked lists, trees, graphs) differ,
+        comparing them node by node instead of with the nodes' __eq__.
+
+        attrs: the attributes which link the nodes, or a mapping from the
+        correct node's attribute names to the student node's."""
+        difference = structure_difference(first, second, attrs)
+        if difference is not None:
+            self.fail(self._formatMessage(msg, str(difference)))
+
+    def assertStreamEqual(self, first, second, max_items=DEFAULT_MAX_ITEMS,
+                          timeout=None, msg=None):
+        """Fail if two iterables (e.g. generators) produce different items.
+
+        Both are pulled from in lockstep, a chunk at a time, and never turned
+        into lists, so infinite iterators are fine. Comparison stops at the
+        first difference, after max_items items, or after timeout seconds."""
+        difference = stream_difference(first, second, max_items, timeout)
+        if difference is not None:
+            self.fail(self._formatMessage(msg, str(difference)))
 
     def test_student_imports(self):
         """test_student_imports: Checking for failed imports."""
-        if not FAILED_IMPORTS:
+        load_lazy_modules()
+
+        failed_imports = current_grading_context().failed_imports
+        if not failed_imports:
             return
 
-        files = set(x.filename for x in FAILED_IMPORTS)
+        files = set(x.filename for x in failed_imports)
         print('Failed to import the following files: '
               f'[{quoted_listing(files)}].')
         print()
 
-        missing = set(x.filename for x in FAILED_IMPORTS if x.missing)
+        missing = set(x.filename for x in failed_imports if x.missing)
         if missing:
             print('The following files appear to be missing: '
                   f'[{quoted_listing(missing)}]')
@@ -112,7 +245,7 @@ class Autograder(unittest.TestCase):
                   f'[{quoted_listing(exception)}]')
             print()
 
-        for failed in FAILED_IMPORTS:
+        for failed in failed_imports:
             h_rule()
             print(f"While importing '{failed.filename}':")
 
@@ -0,0 +1,189 @@
+import argparse
+import json
+from pathlib import Path
+import sys
+from typing import Optional
+
+from .grading import AutograderModule
+from .incremental import IncrementalState
+from .results_db import ResultsDatabase
+from .server import DEFAULT_JOBS, DEFAULT_SOCKET_PATH, make_server, \
+        request_grade
+from .watch import WatchSession
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='cs9-autograder')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    grade = commands.add_parser(
+            'grade', help='grade a submission and print the results as JSON')
+    grade.add_argument('autograder', type=Path)
+    grade.add_argument('submission', type=Path)
+    grade.add_argument('--state', type=Path, default=None,
+                       help='only rerun the tests affected by what changed '
+                            'since the last time this file was used, and '
+                            'reuse the results of the rest')
+    _add_db_arg(grade)
+    grade.set_defaults(func=_grade)
+
+    grade_batch = commands.add_parser(
+            'grade-batch', help='grade every submission in a directory and '
+                                'print their scores')
+    grade_batch.add_argument('autograder', type=Path)
+    grade_batch.add_argument('submissions', type=Path,
+                             help='a directory with one directory for each '
+                                  'submission')
+    _add_db_arg(grade_batch)
+    grade_batch.set_defaults(func=_grade_batch)
+
+    watch = commands.add_parser(
+            'watch', help='grade a submission again whenever it or the '
+                          'autograder changes')
+    watch.add_argument('autograder', type=Path)
+    watch.add_argument('submission', type=Path)
+    watch.set_defaults(func=_watch)
+
+    serve = commands.add_parser(
+            'serve', help='keep an autograder loaded and grade submissions '
+                          'sent to a socket')
+    serve.add_argument('autograder', type=Path)
+    _add_address_args(serve)
+    serve.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                       help='how many submissions to grade at once '
+                            f'(default: {DEFAULT_JOBS})')
+    _add_db_arg(serve)
+    serve.set_defaults(func=_serve)
+
+    submit = commands.add_parser(
+            'submit', help='grade a submission with a running server and '
+                           'print the results as JSON')
+    submit.add_argument('submission', type=Path)
+    _add_address_args(submit)
+    submit.set_defaults(func=_submit)
+
+    query = commands.add_parser(
+            'query', help='analyse the results recorded with --db')
+    query.add_argument('db', type=Path)
+    query.add_argument('--limit', type=int, default=10)
+    queries = query.add_mutually_exclusive_group(required=True)
+    queries.add_argument('--failing', action='store_true',
+                         help='the tests which fail most often')
+    queries.add_argument('--slow', action='store_true',
+                         help="the submissions whose own tests are slowest")
+    queries.add_argument('--submission',
+                         help="a submission's test results")
+    queries.add_argument('--sql', help='run an SQL query')
+    query.set_defaults(func=_query)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def _add_address_args(parser: argparse.ArgumentParser) -> None:
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--socket', type=Path, default=None,
+                         help=f'(default: {DEFAULT_SOCKET_PATH})')
+    address.add_argument('--port', type=int, default=None,
+                         help='use this port on localhost instead of a Unix '
+                              'socket')
+
+
+def _add_db_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--db', type=Path, default=None,
+                        help='also record the results in this SQLite '
+                             'database')
+
+
+def _grade(args) -> int:
+    state = IncrementalState.load(args.state) if args.state else None
+
+    autograder = AutograderModule(args.autograder)
+    try:
+        results = autograder.grade(args.submission, state)
+    finally:
+        autograder.close()
+
+    if state is not None:
+        state.save(args.state)
+
+    if args.db:
+        with ResultsDatabase(args.db) as results_db:
+            results_db.add(args.submission.resolve().name, results)
+
+    return _print_results(results)
+
+
+def _grade_batch(args) -> int:
+    submissions = sorted(p for p in args.submissions.iterdir()
+                         if p.is_dir() and not p.name.startswith(('.', '_')))
+
+    autograder = AutograderModule(args.autograder)
+    results_db = ResultsDatabase(args.db) if args.db else None
+    try:
+        for submission in submissions:
+            results = autograder.grade(submission)
+            if results_db:
+                results_db.add(submission.name, results)
+
+            print(f"{submission.name}\t{results['score']}"
+                  f"\t{results['max_score']}")
+    finally:
+        autograder.close()
+        if results_db:
+            results_db.close()
+
+    return 0
+
+
+def _watch(args) -> int:
+    try:
+        WatchSession(args.autograder, args.submission).run()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def _serve(args) -> int:
+    results_db = ResultsDatabase(args.db) if args.db else None
+    server = make_server(args.autograder, socket_path=args.socket,
+                         port=args.port, jobs=args.jobs,
+                         results_db=results_db)
+    with server:
+        print(f'Grading submissions on {server.server_address}',
+              file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def _submit(args) -> int:
+    results = request_grade(args.submission, socket_path=args.socket,
+                            port=args.port)
+    return _print_results(results)
+
+
+def _query(args) -> int:
+    with ResultsDatabase(args.db) as results_db:
+        if args.failing:
+            rows = results_db.most_failed_tests(args.limit)
+        elif args.slow:
+            rows = results_db.slowest_student_suites(args.limit)
+        elif args.submission:
+            rows = results_db.submission_results(args.submission)
+        else:
+            rows = results_db.query(args.sql)
+
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+
+    return 0
+
+
+def _print_results(results: dict) -> int:
+    print(json.dumps(results, indent=2))
+    return 1 if 'error' in results else 0
@@ -0,0 +1,668 @@
+"""Compare large return values without building a full diff."""
+from array import array
+from collections import Counter
+from collections.abc import Hashable, Iterable, Mapping, Sequence, Set
+from dataclasses import dataclass
+import itertools
+from numbers import Number
+import reprlib
+import time
+from typing import Any, Optional
+
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None
+
+from .timeouts import run_with_timeout, StudentTimeout
+
+
+# how many items we compare at a time before looking for the exact mismatch
+CHUNK_SIZE = 1024
+
+# how many items (or characters, for strings) of context to show on either
+# side of a mismatch
+CONTEXT = 3
+STRING_CONTEXT = 30
+
+
+# how many items of two iterators we compare by default before we stop
+DEFAULT_MAX_ITEMS = 10_000
+
+# how many items we pull from each iterator at a time
+STREAM_CHUNK_SIZE = 256
+
+
+# sequences whose slices can be compared directly
+_SLICEABLE = (list, tuple, str, bytes)
+
+
+_repr = reprlib.Repr()
+_repr.maxstring = 80
+_repr.maxother = 80
+_repr.maxlist = _repr.maxtuple = _repr.maxdict = _repr.maxset = 8
+_repr.maxlevel = 3
+
+
+def short_repr(obj: Any) -> str:
+    """A repr that never gets longer than a line or two."""
+    return _repr.repr(obj)
+
+
+@dataclass
+class Difference:
+    """The first place where two values differ."""
+    path: str  # e.g. "[3]['key'][1024]"; empty at the top level
+    reason: str
+    expected: Any
+    actual: Any
+
+    # the window of surrounding items, if the difference is inside a sequence
+    expected_context: Optional[str] = None
+    actual_context: Optional[str] = None
+
+    def __str__(self) -> str:
+        where = f'at {self.path}' if self.path else 'at the top level'
+        lines = [f'Values differ {where}: {self.reason}',
+                 f'expected: {short_repr(self.expected)}',
+                 f'actual:   {short_repr(self.actual)}']
+
+        if self.expected_context is not None:
+            lines += [f'expected context: {self.expected_context}',
+                      f'actual context:   {self.actual_context}']
+
+        return '\n'.join(lines)
+
+
+def equal(x: Any, y: Any) -> bool:
+    # unittest uses `==` rather than `!=`, so we do too
+    return bool(x == y)
+
+
+def first_mismatch(x: Sequence, y: Sequence) -> int:
+    """Get the index of the first item where two sequences differ. If one is
+    a prefix of the other, this is the length of the shorter one.
+
+    Chunks are compared with slices so that most of the work happens in C."""
+
+    n = min(len(x), len(y))
+
+    if not (isinstance(x, _SLICEABLE) and isinstance(y, _SLICEABLE)):
+        return next((i for i in range(n) if not equal(x[i], y[i])), n)
+
+    for start in range(0, n, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, n)
+        if not equal(x[start:stop], y[start:stop]):
+            for i in range(start, stop):
+                if not equal(x[i], y[i]):
+                    return i
+
+            # the slices were unequal even though every item was equal
+            return start
+
+    return n
+
+
+def first_difference(expected: Any, actual: Any) -> Optional[Difference]:
+    """Find the first place where expected and actual differ, or None if they
+    are equal.
+
+    The values are walked iteratively, so nesting depth doesn't matter, and
+    equal subtrees are skipped with a single `==`."""
+
+    if equal(expected, actual):
+        return None
+
+    path = ''
+
+    # the items around the last sequence index that we went into
+    context: tuple[Optional[str], Optional[str]] = (None, None)
+
+    while True:
+        if not _same_kind(expected, actual):
+            reason = (f'expected {_type_name(expected)}, '
+                      f'got {_type_name(actual)}')
+            return Difference(path, reason, expected, actual, *context)
+
+        if isinstance(expected, (str, bytes)):
+            i = first_mismatch(expected, actual)
+            return Difference(
+                    path, _sequence_reason(expected, actual, i, 'character'),
+                    _at(expected, i), _at(actual, i),
+                    _string_window(expected, i), _string_window(actual, i))
+
+        if isinstance(expected, Sequence):
+            i = first_mismatch(expected, actual)
+            context = (_sequence_window(expected, i),
+                       _sequence_window(actual, i))
+
+            if i >= min(len(expected), len(actual)):
+                return Difference(
+                        path, _sequence_reason(expected, actual, i, 'item'),
+                        _at(expected, i), _at(actual, i), *context)
+
+            path += f'[{i}]'
+            expected, actual = expected[i], actual[i]
+            continue
+
+        if isinstance(expected, Mapping):
+            missing = [k for k in expected if k not in actual]
+            if missing:
+                return Difference(path, f'missing key {short_repr(missing[0])}',
+                                  expected[missing[0]], None)
+
+            extra = [k for k in actual if k not in expected]
+            if extra:
+                return Difference(path, f'unexpected key {short_repr(extra[0])}',
+                                  None, actual[extra[0]])
+
+            key = next((k for k in expected
+                        if not equal(expected[k], actual[k])), None)
+            if key is None:
+                return Difference(path, 'values differ', expected, actual)
+
+            path += f'[{key!r}]'
+            expected, actual = expected[key], actual[key]
+            context = (None, None)
+            continue
+
+        if isinstance(expected, Set):
+            missing = [x for x in expected if x not in actual]
+            extra = [x for x in actual if x not in expected]
+            return Difference(path,
+                              f'missing {short_repr(missing)}, '
+                              f'unexpected {short_repr(extra)}',
+                              expected, actual)
+
+        return Difference(path, 'values differ', expected, actual, *context)
+
+
+def _same_kind(x: Any, y: Any) -> bool:
+    if type(x) is type(y):
+        return True
+
+    if isinstance(x, Number) and isinstance(y, Number):
+        return True
+
+    # let subclasses (e.g. OrderedDict and dict) be compared item by item
+    for kind in (str, bytes, list, tuple, Mapping, Set):
+        if isinstance(x, kind) and isinstance(y, kind):
+            return True
+
+    return False
+
+
+def _type_name(x: Any) -> str:
+    return f'a value of type `{type(x).__name__}`'
+
+
+def _at(seq: Sequence, i: int) -> Any:
+    return seq[i] if i < len(seq) else None
+
+
+def _sequence_reason(expected: Sequence, actual: Sequence, i: int,
+                     item: str) -> str:
+    if i < min(len(expected), len(actual)):
+        return f'first different {item} at index {i}'
+
+    return (f'expected length {len(expected)}, got length {len(actual)} '
+            f'(first {i} {item}s match)')
+
+
+def _sequence_window(seq: Sequence, i: int) -> str:
+    start = max(0, i - CONTEXT)
+    stop = min(len(seq), i + CONTEXT + 1)
+    items = [short_repr(seq[j]) for j in range(start, stop)]
+
+    if start > 0:
+        items.insert(0, '...')
+    if stop < len(seq):
+        items.append('...')
+
+    return f'[{", ".join(items)}] (items {start} to {stop - 1})'
+
+
+def _string_window(text: str | bytes, i: int) -> str:
+    start = max(0, i - STRING_CONTEXT)
+    stop = min(len(text), i + STRING_CONTEXT + 1)
+    window = repr(text[start:stop])
+
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if stop < len(text) else ''
+    return f'{prefix}{window}{suffix}'
+
+
+class _Frozen:
+    """Tags for frozen containers, so that a frozen list doesn't compare
+    equal to a frozen tuple."""
+    LIST = object()
+    DICT = object()
+    SET = object()
+
+
+def freeze(obj: Any) -> Hashable:
+    """Turn lists, dicts and sets (however deeply nested) into hashable values
+    which are equal exactly when the originals are equal.
+
+    raises TypeError if obj contains something unhashable that we can't
+    freeze."""
+
+    if isinstance(obj, list):
+        return (_Frozen.LIST, tuple(freeze(x) for x in obj))
+
+    if isinstance(obj, tuple):
+        return tuple(freeze(x) for x in obj)
+
+    if isinstance(obj, Mapping):
+        return (_Frozen.DICT, frozenset((k, freeze(v)) for k, v in obj.items()))
+
+    if isinstance(obj, (set, frozenset)):
+        return (_Frozen.SET, frozenset(freeze(x) for x in obj))
+
+    hash(obj)
+    return obj
+
+
+@dataclass
+class MultisetDifference:
+    """The items that have to be added to or removed from a collection to
+    make it equal to another, ignoring order."""
+    missing: list  # expected but not found
+    unexpected: list  # found but not expected
+
+    def __bool__(self) -> bool:
+        return bool(self.missing or self.unexpected)
+
+    def __str__(self) -> str:
+        lines = ['Values differ (ignoring order):']
+        if self.missing:
+            lines.append(f'{len(self.missing)} missing: '
+                         f'{short_repr(self.missing)}')
+        if self.unexpected:
+            lines.append(f'{len(self.unexpected)} unexpected: '
+                         f'{short_repr(self.unexpected)}')
+
+        return '\n'.join(lines)
+
+
+def multiset_difference(expected: Iterable,
+                        actual: Iterable) -> MultisetDifference:
+    """Compare two collections, ignoring order but not repeats.
+
+    Items are frozen and counted, so this takes linear time. Only items that
+    can't be frozen (e.g. objects with __eq__ but no __hash__) fall back to
+    pairwise matching."""
+
+    counts: Counter = Counter()
+    originals: dict[Hashable, list] = {}
+    unhashable_expected = []
+    unhashable_actual = []
+
+    for item in expected:
+        try:
+            key = freeze(item)
+        except TypeError:
+            unhashable_expected.append(item)
+            continue
+
+        counts[key] += 1
+        originals.setdefault(key, []).append(item)
+
+    for item in actual:
+        try:
+            key = freeze(item)
+        except TypeError:
+            unhashable_actual.append(item)
+            continue
+
+        counts[key] -= 1
+        if counts[key] < 0:
+            originals.setdefault(key, []).append(item)
+
+    missing = []
+    unexpected = []
+    for key, count in counts.items():
+        if count > 0:
+            missing += originals[key][:count]
+        elif count < 0:
+            unexpected += originals[key][count:]
+
+    for item in unhashable_actual:
+        for i, other in enumerate(unhashable_expected):
+            if equal(other, item):
+                del unhashable_expected[i]
+                break
+        else:
+            unexpected.append(item)
+
+    missing += unhashable_expected
+
+    return MultisetDifference(missing, unexpected)
+
+
+@dataclass
+class NumericDifference:
+    """The values of two numeric arrays which are not close enough."""
+    reason: str
+    count: int = 0  # how many values are not close
+    total: int = 0
+    worst_index: tuple[int, ...] = ()
+    expected: Any = None
+    actual: Any = None
+
+    def __str__(self) -> str:
+        if not self.count:
+            return self.reason
+
+        where = ''.join(f'[{i}]' for i in self.worst_index)
+        return (f'{self.count} of {self.total} values are not close '
+                f'({self.reason}). The worst is at {where}: '
+                f'expected {self.expected!r}, got {self.actual!r}')
+
+
+def numeric_difference(expected: Any, actual: Any,
+                       rtol: float = 1e-7,
+                       atol: float = 0.0) -> Optional[NumericDifference]:
+    """Compare two numbers, or (nested) sequences of numbers, element-wise.
+
+    A value is close if `abs(actual - expected) <= atol + rtol *
+    abs(expected)`, like numpy.isclose. NaNs are close to each other.
+
+    Returns None if every value is close. Both values are converted to
+    contiguous arrays first: numpy arrays if numpy is installed, otherwise
+    `array('d')`."""
+
+    tolerance = f'rtol={rtol}, atol={atol}'
+
+    try:
+        expected_shape, expected_flat = _numeric_array(expected)
+        actual_shape, actual_flat = _numeric_array(actual)
+    except (TypeError, ValueError) as e:
+        return NumericDifference(f'expected numbers: {e}')
+
+    if expected_shape != actual_shape:
+        return NumericDifference(f'expected shape {expected_shape}, '
+                                 f'got shape {actual_shape}')
+
+    if numpy is not None:
+        return _numpy_difference(expected_flat, actual_flat, expected_shape,
+                                 rtol, atol, tolerance)
+
+    # identical bytes are always close, and memcmp is much faster than
+    # checking each value in Python
+    if expected_flat.tobytes() == actual_flat.tobytes():
+        return None
+
+    count = 0
+    worst = -1
+    worst_error = -float('inf')
+    for i, (x, y) in enumerate(zip(expected_flat, actual_flat)):
+        # this also covers infinities, which would give nan below
+        if x == y or (x != x and y != y):
+            continue
+
+        error = abs(y - x) - (atol + rtol * abs(x))
+        if error <= 0:
+            continue
+
+        count += 1
+        if not error <= worst_error:  # a nan error is the worst
+            worst = i
+            worst_error = error
+
+    if not count:
+        return None
+
+    return NumericDifference(tolerance, count, len(expected_flat),
+                             _unravel(worst, expected_shape),
+                             expected_flat[worst], actual_flat[worst])
+
+
+def _numpy_difference(expected, actual, shape, rtol, atol,
+                      tolerance) -> Optional[NumericDifference]:
+    close = numpy.isclose(actual, expected, rtol=rtol, atol=atol,
+                          equal_nan=True)
+    count = int(close.size - numpy.count_nonzero(close))
+    if not count:
+        return None
+
+    with numpy.errstate(invalid='ignore'):
+        error = (numpy.abs(actual - expected)
+                 - (atol + rtol * numpy.abs(expected)))
+
+    # a nan error is the worst, and close values are never the worst
+    error = numpy.nan_to_num(error, nan=numpy.inf)
+    error[close] = -numpy.inf
+    worst = int(numpy.argmax(error))
+
+    return NumericDifference(tolerance, count, int(close.size),
+                             _unravel(worst, shape),
+                             expected[worst].item(), actual[worst].item())
+
+
+def _numeric_array(obj: Any) -> tuple[tuple[int, ...], Any]:
+    """Convert a number or a rectangular nested sequence of numbers into its
+    shape and a flat, contiguous array of floats.
+
+    raises ValueError if the nested sequences are ragged, or TypeError if they
+    contain something which isn't a number."""
+
+    if numpy is not None:
+        arr = numpy.ascontiguousarray(obj, dtype=float)
+        return arr.shape, arr.reshape(-1)
+
+    shape = []
+    probe = obj
+    while _is_numeric_sequence(probe):
+        shape.append(len(probe))
+        if not probe:
+            break
+        probe = probe[0]
+
+    level = [obj]
+    for size in shape:
+        next_level = []
+        for seq in level:
+            if not _is_numeric_sequence(seq) or len(seq) != size:
+                raise ValueError('the nested sequences have different '
+                                 'lengths')
+            next_level.extend(seq)
+        level = next_level
+
+    return tuple(shape), array('d', level)
+
+
+def _is_numeric_sequence(obj: Any) -> bool:
+    return (isinstance(obj, (Sequence, array))
+            and not isinstance(obj, (str, bytes)))
+
+
+def _unravel(index: int, shape: tuple[int, ...]) -> tuple[int, ...]:
+    """Turn an index into a flat array into a nested index."""
+    nested = []
+    for size in reversed(shape):
+        index, i = divmod(index, size)
+        nested.append(i)
+
+    return tuple(reversed(nested))
+
+
+# the attributes that link the nodes of typical CS9 data structures
+DEFAULT_NODE_ATTRS = ('data', 'next', 'left', 'right')
+
+
+NodeAttrs = Iterable[str] | Mapping[str, str]
+
+
+def structure_difference(expected: Any, actual: Any,
+                         attrs: NodeAttrs = DEFAULT_NODE_ATTRS) \
+                                 -> Optional[Difference]:
+    """Compare two linked structures (linked lists, trees, graphs) node by
+    node, without using the nodes' own __eq__.
+
+    attrs: the attributes to follow. A mapping is from the correct node's
+    attribute names to the student node's attribute names.
+
+    Any object with one of the attributes is a node. The structures are
+    walked with an explicit stack, so a 10^5 node linked list doesn't hit the
+    recursion limit, and nodes are only visited once, so cycles are fine.
+    Returns the first difference in depth-first order, or None."""
+
+    if not isinstance(attrs, Mapping):
+        attrs = {attr: attr for attr in attrs}
+
+    def is_node(obj: Any, names: Iterable[str]) -> bool:
+        return any(hasattr(obj, name) for name in names)
+
+    # a path is a linked list of (parent path, step) so that pushing a node
+    # doesn't copy its parent's path
+    LinkedPath = Optional[tuple[Any, str]]
+
+    # which student node each correct node was matched with, and vice versa
+    matched: dict[int, int] = {}
+    matched_reverse: dict[int, int] = {}
+
+    stack: list[tuple[Any, Any, LinkedPath]] = [(expected, actual, None)]
+    while stack:
+        expected, actual, path = stack.pop()
+
+        expected_is_node = is_node(expected, attrs.keys())
+        actual_is_node = is_node(actual, attrs.values())
+
+        if expected_is_node != actual_is_node:
+            kind = 'a node' if expected_is_node else 'a value'
+            return Difference(_render_path(path), f'expected {kind}',
+                              expected, actual)
+
+        if expected_is_node:
+            if id(expected) in matched or id(actual) in matched_reverse:
+                if (matched.get(id(expected)) != id(actual)
+                        or matched_reverse.get(id(actual)) != id(expected)):
+                    return Difference(_render_path(path),
+                                      'the nodes are linked differently '
+                                      '(a cycle or shared node does not '
+                                      'match)', expected, actual)
+                continue
+
+            matched[id(expected)] = id(actual)
+            matched_reverse[id(actual)] = id(expected)
+
+            # push in reverse so that the first attribute is visited first
+            for expected_attr, actual_attr in reversed(list(attrs.items())):
+                if not hasattr(expected, expected_attr):
+                    continue
+
+                if not hasattr(actual, actual_attr):
+                    return Difference(_render_path(path),
+                                      f'missing attribute `{actual_attr}`',
+                                      expected, actual)
+
+                stack.append((getattr(expected, expected_attr),
+                              getattr(actual, actual_attr),
+                              (path, f'.{expected_attr}')))
+
+        elif (isinstance(expected, (list, tuple))
+                and isinstance(actual, (list, tuple))):
+            if len(expected) != len(actual):
+                return Difference(_render_path(path),
+                                  f'expected length {len(expected)}, '
+                                  f'got length {len(actual)}',
+                                  expected, actual)
+
+            for i in reversed(range(len(expected))):
+                stack.append((expected[i], actual[i], (path, f'[{i}]')))
+
+        elif not equal(expected, actual):
+            return Difference(_render_path(path), 'values differ',
+                              expected, actual)
+
+    return None
+
+
+def _render_path(path) -> str:
+    """Render a linked path, collapsing repeated steps so that the path to
+    the 10,000th node of a linked list stays short."""
+
+    steps = []
+    while path is not None:
+        path, step = path
+        steps.append(step)
+    steps.reverse()
+
+    rendered = []
+    for step, group in itertools.groupby(steps):
+        count = len(list(group))
+        rendered.append(step if count == 1 else f'{step} (x{count})')
+
+    return ''.join(rendered)
+
+
+def stream_difference(expected: Iterable, actual: Iterable,
+                      max_items: Optional[int] = DEFAULT_MAX_ITEMS,
+                      timeout: Optional[float] = None,
+                      chunk_size: int = STREAM_CHUNK_SIZE) \
+                              -> Optional[Difference]:
+    """Compare two iterables (e.g. generators, or infinite iterators) item by
+    item, without ever holding more than a chunk of either.
+
+    max_items: stop after comparing this many items
+    timeout: stop after this many seconds. If the student's iterator is still
+    working on a chunk when time runs out, that is a difference.
+
+    Returns the first difference, or None if the items matched until one of
+    the limits was reached or both iterables ran out."""
+
+    expected = iter(expected)
+    actual = iter(actual)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    compared = 0
+    while max_items is None or compared < max_items:
+        size = chunk_size
+        if max_items is not None:
+            size = min(size, max_items - compared)
+
+        expected_chunk = list(itertools.islice(expected, size))
+
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            try:
+                actual_chunk = run_with_timeout(
+                        lambda: list(itertools.islice(actual, size)),
+                        remaining)
+            except StudentTimeout:
+                return Difference(f'[{compared}:{compared + size}]',
+                                  f'timed out after {timeout:.2f} seconds',
+                                  None, None)
+        else:
+            actual_chunk = list(itertools.islice(actual, size))
+
+        i = first_mismatch(expected_chunk, actual_chunk)
+        if i < min(len(expected_chunk), len(actual_chunk)):
+            difference = first_difference(expected_chunk[i], actual_chunk[i])
+            if difference is None:
+                difference = Difference('', 'values differ',
+                                        expected_chunk[i], actual_chunk[i])
+
+            difference.path = f'[{compared + i}]{difference.path}'
+            return difference
+
+        if len(expected_chunk) != len(actual_chunk):
+            if len(expected_chunk) < len(actual_chunk):
+                reason = (f'expected the items to end after '
+                          f'{compared + i} items')
+            else:
+                reason = f'the items ended after {compared + i} items'
+
+            return Difference(f'[{compared + i}]', reason,
+                              _at(expected_chunk, i), _at(actual_chunk, i))
+
+        if not expected_chunk:
+            return None
+
+        compared += len(expected_chunk)
+
+    return None
@@ -1,24 +1,47 @@
 from collections.abc import Callable, Iterable, Mapping
 import itertools
 from functools import partial
+import time
 from types import MethodType
 from typing import Any, Callable, Optional, Union
 
 
 from .autograder import Autograder
+from .comparison import (DEFAULT_NODE_ATTRS, first_difference, NodeAttrs,
+                         short_repr)
+from .importing import submission_path
+from .memory import format_allocations, format_bytes, measure_memory
+from .profiling import dump_profile, make_profiler
 from .smart_decorator import SmartDecorator, TestItemDecorator
 from .test_item import TestItem
+from .timeouts import (DEFAULT_TIMEOUT_FLOOR, run_with_timeout,
+                       StudentTimeout, time_limit)
 
 
 class d_returned(TestItemDecorator):
     """Run a template function with a correct object and student object and
-    compare the value returned from the template function."""
+    compare the value returned from the template function.
+
+    timeout: fail if the student's side takes longer than this many seconds.
+    timeout_factor: fail if the student's side takes longer than this multiple
+    of the correct side's runtime (but never less than timeout_floor
+    seconds).
+    profile: profile the student's side with 'cprofile' (or True) or
+    'sample', and add the student's hotspots to the failure message.
+    Defaults to the Autograder's profile option.
+    profile_dir: where to save the full profile. Defaults to the Autograder's
+    profile_dir option."""
 
     def init(self,
              correct: Any = None, student: Any = None,
              assertion: Optional[Callable[..., None]] = None,
              normalize: Optional[Callable[[Any], Any]] = None,
              msg: Optional[str] = None,
+             timeout: Optional[float] = None,
+             timeout_factor: Optional[float] = None,
+             timeout_floor: float = DEFAULT_TIMEOUT_FLOOR,
+             profile: Optional[str | bool] = None,
+             profile_dir: Optional[str] = None,
              **kwargs):
 
         # set correct and student for TestItem
@@ -32,20 +55,172 @@ class d_returned(TestItemDecorator):
         self.normalize = normalize
         self.msg = msg
 
+        self.timeout = timeout
+        self.timeout_factor = timeout_factor
+        self.timeout_floor = timeout_floor
+
+        self.profile = profile
+        self.profile_dir = profile_dir
+
     def decorator(self):
         def wrapper(this):
+            # this also loads a lazy student module, so that its top-level
+            # code doesn't run under the time limit
+            self.skip_if_import_failed(this)
+
+            start = time.perf_counter()
             expected = self.decorated(this, self.correct)
-            actual = self.decorated(this, self.student)
+            reference_time = time.perf_counter() - start
+
+            limit = time_limit(reference_time, self.timeout,
+                               self.timeout_factor, self.timeout_floor)
 
-            if self.normalize:
-                expected = self.normalize(expected)
-                actual = self.normalize(actual)
+            profile = self.profile if self.profile is not None \
+                else getattr(this, 'profile', None)
+            profiler = make_profiler(profile, submission_path())
 
-            if self.assertion:
-                self.assertion(this, expected, actual, msg=self.msg)
+            student_call = partial(self.decorated, this, self.student)
+            if profiler:
+                student_call = partial(profiler.run, student_call)
 
+            try:
+                actual = run_with_timeout(student_call, limit)
+            except StudentTimeout as e:
+                timed_out = e
             else:
-                this.assertEqual(expected, actual, msg=self.msg)
+                timed_out = None
+
+            if profiler:
+                dump_profile(profiler, this.id(),
+                             self.profile_dir or getattr(this, 'profile_dir',
+                                                         None))
+
+            try:
+                # fail outside of the except block so that the student's
+                # traceback isn't attached to the failure
+                if timed_out is not None:
+                    this.fail(str(timed_out))
+
+                self.compare(this, expected, actual)
+            except this.failureException as e:
+                hotspots = profiler.hotspots() if profiler else None
+                if not hotspots:
+                    raise
+                failure = e
+            else:
+                return
+
+            this.fail('\n'.join([str(failure), '',
+                                 'Where your code spent the most time:',
+                                 *hotspots]))
+        return wrapper
+
+    def compare(self, this: Autograder, expected: Any, actual: Any):
+        if self.normalize:
+            expected = self.normalize(expected)
+            actual = self.normalize(actual)
+
+        if self.assertion:
+            self.assertion(this, expected, actual, msg=self.msg)
+
+        else:
+            this.assertStructurallyEqual(expected, actual, msg=self.msg)
+
+    def __get__(cls, instance, owner=None):
+        return super().__get__(instance, owner)
+
+
+class d_structure(d_returned):
+    """Like d_returned, but the returned linked structures (linked lists,
+    trees, graphs) are compared node by node with
+    Autograder.assertStructureEqual, instead of with the nodes' __eq__.
+
+    attrs: the attributes which link the nodes, or a mapping from the correct
+    node's attribute names to the student node's."""
+
+    def init(self, *args, attrs: NodeAttrs = DEFAULT_NODE_ATTRS, **kwargs):
+        super().init(*args, **kwargs)
+
+        if not self.assertion:
+            self.assertion = partial(Autograder.assertStructureEqual,
+                                     attrs=attrs)
+
+
+class d_memory(TestItemDecorator):
+    """Run a template function with a correct object and student object under
+    tracemalloc and compare how much memory each used.
+
+    peak_ratio: fail if the student's peak memory use is more than this
+    multiple of the correct implementation's
+    retained_ratio: fail if the memory still in use after the call (including
+    the returned value) is more than this multiple of the correct
+    implementation's
+    slack: bytes allowed on top of the ratios, so that tiny results don't
+    fail over a few bytes
+
+    Either check is skipped if its ratio is None. If the retained check
+    fails, the lines in the submission which allocated the most of the
+    retained memory are reported."""
+
+    def init(self,
+             correct: Any = None, student: Any = None,
+             peak_ratio: Optional[float] = 2.0,
+             retained_ratio: Optional[float] = 2.0,
+             slack: int = 64 * 1024,
+             msg: Optional[str] = None,
+             **kwargs):
+
+        # set correct and student for TestItem
+        # if they were given as positional argument
+        if correct:
+            self._correct = correct
+        if student:
+            self._student = student
+
+        self.peak_ratio = peak_ratio
+        self.retained_ratio = retained_ratio
+        self.slack = slack
+        self.msg = msg
+
+    def decorator(self):
+        def wrapper(this):
+            self.skip_if_import_failed(this)
+
+            _, expected = measure_memory(
+                    partial(self.decorated, this, self.correct))
+
+            path = submission_path()
+            _, actual = measure_memory(
+                    partial(self.decorated, this, self.student),
+                    trace_path=path)
+
+            checks = [('peak', self.peak_ratio, expected.peak, actual.peak),
+                      ('retained', self.retained_ratio,
+                       expected.retained, actual.retained)]
+
+            problems = []
+            failed = set()
+            for name, ratio, expected_size, actual_size in checks:
+                if ratio is None:
+                    continue
+
+                allowed = ratio * expected_size + self.slack
+                if actual_size > allowed:
+                    failed.add(name)
+                    problems.append(
+                            f'Used {format_bytes(actual_size)} of {name} '
+                            f'memory, but only {format_bytes(allowed)} is '
+                            f'allowed.')
+
+            # the allocations are only what was left after the call, which
+            # says nothing about where the peak was
+            if 'retained' in failed and actual.allocations:
+                problems += ['', 'Lines which allocated the most memory '
+                                 'that is still in use:',
+                             format_allocations(actual.allocations, path)]
+
+            if problems:
+                this.fail(this._formatMessage(self.msg, '\n'.join(problems)))
         return wrapper
 
     def __get__(cls, instance, owner=None):
@@ -53,10 +228,14 @@ class d_returned(TestItemDecorator):
 
 
 class d_method:
+    """Construct an object and compare the return value of calling a method on
+    it. Any other keyword arguments are passed on to d_returned."""
+
     def __init__(self, ctor_args: Optional[tuple] = None,
                  ctor_kwargs: Optional[Mapping[str, Any]] = None,
                  m_args: Optional[tuple] = None,
-                 m_kwargs: Optional[Mapping[str, Any]] = None):
+                 m_kwargs: Optional[Mapping[str, Any]] = None,
+                 **kwargs):
 
         self.ctor_args = ctor_args if ctor_args else ()
         self.ctor_kwargs = ctor_kwargs if ctor_kwargs else {}
@@ -64,8 +243,10 @@ class d_method:
         self.m_args = m_args if m_args else ()
         self.m_kwargs = m_kwargs if m_kwargs else {}
 
+        self.returned_kwargs = kwargs
+
     def __get__(self, instance, owner):
-        @d_returned(owner.correct, owner.student)
+        @d_returned(owner.correct, owner.student, **self.returned_kwargs)
         def runner(owner_self, tested_class):
             obj = tested_class(*self.ctor_args, **self.ctor_kwargs)
             tested_method = getattr(obj, owner.method)
@@ -77,13 +258,16 @@ class d_method:
 
 
 class d_compare(TestItem):
-    """Compare two items"""
+    """Compare two items. Any keyword arguments that aren't for TestItem are
+    passed on to d_returned."""
     x_kwargs: dict[str, Any]
     y_kwargs: dict[str, Any]
 
-    def __init__(self, *args, bidirectional=False, **kwargs):
+    def __init__(self, *args, bidirectional=False,
+                 correct=None, student=None, method=None, weight=None,
+                 _outer_test_item=None, **kwargs):
 
-        super().__init__(**kwargs)
+        super().__init__(correct, student, method, weight, _outer_test_item)
 
         if len(args) == 2:
             self.x_args, self.y_args = args
@@ -99,9 +283,10 @@ class d_compare(TestItem):
                              "(x_args, x_kwargs, y_args, y_kwargs).")
 
         self.bidirectional = bidirectional
+        self.returned_kwargs = kwargs
 
     def __call__(self, instance):
-        @d_returned(self.correct, self.student)
+        @d_returned(self.correct, self.student, **self.returned_kwargs)
         def runner(grader_self, tested_class):
             obj_x = tested_class(*self.x_args, **self.x_kwargs)
             obj_y = tested_class(*self.y_args, **self.y_kwargs)
@@ -132,17 +317,22 @@ class d_compare(TestItem):
 
 
 class d_compare_pairs(TestItem):
+    """Compare every pair of objects. Any keyword arguments that aren't for
+    TestItem are passed on to d_compare."""
+
     def __init__(self, ctor_args: list[tuple]
                                   | list[tuple[tuple, dict[str, Any]]],
                  has_kwargs: bool = False,
-                 **kwargs):
+                 correct=None, student=None, method=None, weight=None,
+                 _outer_test_item=None, **kwargs):
 
-        super().__init__(**kwargs)
+        super().__init__(correct, student, method, weight, _outer_test_item)
 
         if not has_kwargs:
             ctor_args = [(x, {}) for x in ctor_args]
 
         self.ctor_args = ctor_args
+        self.compare_kwargs = kwargs
 
     def __get__(self, instance, owner):
         super().__get__(instance, owner)
@@ -152,9 +342,162 @@ class d_compare_pairs(TestItem):
                 lhs_args, lhs_kwargs = lhs
                 rhs_args, rhs_kwargs = rhs
                 compare = d_compare(lhs_args, lhs_kwargs, rhs_args, rhs_kwargs,
-                                    _outer_test_item=self)
+                                    _outer_test_item=self,
+                                    **self.compare_kwargs)
                 compare(instance)
 
         # we have to wrap the runner and pass the instance because our
         # returned function isn't bound as a method by default
         return runner
+
+
+Operation = tuple[str] | tuple[str, tuple] | tuple[str, tuple, dict]
+
+
+# the most operations we show when reporting how to reproduce a difference
+MAX_REPRODUCE_LINES = 40
+
+
+class d_sequence(TestItem):
+    """Construct one correct and one student object, then call a sequence of
+    methods on both. After every call, compare what the call returned (or
+    raised) and, optionally, a projection of each object's state.
+
+    operations: a list or generator of (method, args, kwargs) tuples, where
+    args and kwargs may be left out. It may also be a function which returns
+    one, so that a generator is fresh every time the test runs.
+    state: a function of the object (e.g. `lambda obj: obj.to_list()`) which
+    is compared after every call.
+
+    The test stops at the first difference and reports the calls which
+    reproduce it."""
+
+    def __init__(self, operations: Iterable[Operation]
+                                   | Callable[[], Iterable[Operation]],
+                 ctor_args: Optional[tuple] = None,
+                 ctor_kwargs: Optional[Mapping[str, Any]] = None,
+                 state: Optional[Callable[[Any], Any]] = None,
+                 correct=None, student=None, method=None, weight=None,
+                 _outer_test_item=None):
+
+        super().__init__(correct, student, method, weight, _outer_test_item)
+
+        self.operations = operations
+        self.ctor_args = ctor_args if ctor_args else ()
+        self.ctor_kwargs = ctor_kwargs if ctor_kwargs else {}
+        self.state = state
+
+    def __call__(self, instance):
+        self.skip_if_import_failed(instance)
+
+        operations = self.operations
+        if callable(operations):
+            operations = operations()
+
+        correct_obj = self.correct(*self.ctor_args, **self.ctor_kwargs)
+        student_obj = self.student(*self.ctor_args, **self.ctor_kwargs)
+
+        prefix = []
+        for operation in operations:
+            name, args, kwargs = _unpack_operation(operation)
+            prefix.append((name, args, kwargs))
+
+            expected = _call(correct_obj, name, args, kwargs)
+            actual = _call(student_obj, name, args, kwargs)
+
+            problem = _outcome_difference(expected, actual)
+
+            if problem is None and self.state:
+                difference = first_difference(self.state(correct_obj),
+                                              self.state(student_obj))
+                if difference is not None:
+                    problem = f'the state differs afterwards.\n{difference}'
+
+            if problem is not None:
+                instance.fail(self._report(prefix, problem))
+
+    def _report(self, prefix: list[tuple[str, tuple, dict]],
+                problem: str) -> str:
+        lines = [f'After {len(prefix)} operations, {problem}',
+                 '',
+                 'To reproduce:']
+
+        ctor_args = _format_args(self.ctor_args, self.ctor_kwargs)
+        lines.append(f'obj = {_name(self.student)}({ctor_args})')
+
+        omitted = len(prefix) - MAX_REPRODUCE_LINES
+        if omitted > 0:
+            lines.append(f'# ... {omitted} earlier operations omitted ...')
+            prefix = prefix[omitted:]
+
+        lines += [f'obj.{name}({_format_args(args, kwargs)})'
+                  for name, args, kwargs in prefix]
+
+        return '\n'.join(lines)
+
+    def __get__(self, instance, owner):
+        super().__get__(instance, owner)
+
+        func = partial(self.__call__, instance)
+
+        # hack to fix Gradescope test name
+        func.__doc__ = None
+
+        return func
+
+
+def _unpack_operation(operation: Operation) -> tuple[str, tuple, dict]:
+    if isinstance(operation, str):
+        return operation, (), {}
+
+    name, *rest = operation
+    args = tuple(rest[0]) if len(rest) > 0 else ()
+    kwargs = dict(rest[1]) if len(rest) > 1 else {}
+    return name, args, kwargs
+
+
+def _call(obj: Any, name: str, args: tuple,
+          kwargs: dict) -> tuple[bool, Any]:
+    """Call a method, returning (True, return value) or (False, exception)"""
+    try:
+        return True, getattr(obj, name)(*args, **kwargs)
+    except Exception as e:
+        return False, e
+
+
+def _outcome_difference(expected: tuple[bool, Any],
+                        actual: tuple[bool, Any]) -> Optional[str]:
+    expected_returned, expected_value = expected
+    actual_returned, actual_value = actual
+
+    if expected_returned and actual_returned:
+        difference = first_difference(expected_value, actual_value)
+        if difference is None:
+            return None
+        return f'the last call returned a different value.\n{difference}'
+
+    if expected_returned:
+        return (f'the last call should have returned '
+                f'{short_repr(expected_value)}, but it raised '
+                f'{type(actual_value).__name__}: {actual_value}')
+
+    if not actual_returned and isinstance(actual_value, type(expected_value)):
+        return None
+
+    if actual_returned:
+        got = f'returned {short_repr(actual_value)}'
+    else:
+        got = f'raised {type(actual_value).__name__}'
+
+    return (f'the last call should have raised '
+            f'{type(expected_value).__name__}, but it {got}')
+
+
+def _format_args(args: tuple, kwargs: Mapping[str, Any]) -> str:
+    formatted = [short_repr(x) for x in args]
+    formatted += [f'{k}={short_repr(v)}' for k, v in kwargs.items()]
+    return ', '.join(formatted)
+
+
+def _name(cls: Any) -> str:
+    return getattr(cls, '__name__', 'obj')
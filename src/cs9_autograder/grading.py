@@ -0,0 +1,460 @@
+import ast
+import importlib
+import inspect
+import os.path
+from pathlib import Path
+import sys
+import threading
+import time
+from types import CodeType, ModuleType
+from typing import Any, Optional
+import unittest
+
+from .autograder import Autograder
+from .importing import GradingContext, grading_context
+from .incremental import (DependencyRecorder, file_hash, ImportGraph,
+                          IncrementalState, SCRIPT_PREFIX, ScriptDefinitions,
+                          TestRecord)
+from .mutation import t_mutation
+from .scheduling import flatten_tests, weight_of
+from .testing import (Solution, solution_file, t_coverage, t_module,
+                      t_time_budget)
+
+
+PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+GradingResults = dict[str, Any]
+
+
+class AutograderModule:
+    """An autograder script which is kept loaded to grade many submissions.
+
+    The script is compiled once, and the modules it imports outside of
+    `student_import` (the correct solution, libraries) are imported once and
+    shared by every submission. The script's own top-level code, and so its
+    student imports and test classes, run again for each submission in that
+    submission's grading context.
+
+    If the script or any module next to it changes, it is loaded again, along
+    with the modules which use it, before the next submission is graded."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(os.path.realpath(path))
+        self.directory = str(self.path.parent)
+        self.name = self.path.stem
+
+        # the correct solution is imported from next to the script, as if
+        # the script were run directly
+        if self.directory not in sys.path:
+            sys.path.insert(0, self.directory)
+
+        self._lock = threading.Lock()
+        self._code: Optional[CodeType] = None
+        self._definitions: Optional[ScriptDefinitions] = None
+        self._mtimes: dict[str, int] = {}
+
+        self.reload()
+
+    def reload(self, changed: Optional[set[str]] = None) -> None:
+        """Load the script and the modules it shares between submissions
+        again.
+
+        changed: if given, only load the modules from these files again, and
+        the modules which use them."""
+        with self._lock:
+            for name in self._stale_modules(changed):
+                del sys.modules[name]
+
+            source = self.path.read_text()
+            tree = ast.parse(source, str(self.path))
+            self._code = compile(tree, str(self.path), 'exec')
+            self._definitions = ScriptDefinitions(tree)
+
+            preload_imports(tree)
+
+            files = [str(self.path)]
+            files += [os.path.realpath(sys.modules[name].__file__)
+                      for name in self.local_modules()]
+            self._mtimes = {f: _mtime(f) for f in files}
+
+    def close(self) -> None:
+        """Unload the modules we shared between submissions."""
+        with self._lock:
+            for name in self.local_modules():
+                del sys.modules[name]
+
+            if self.directory in sys.path:
+                sys.path.remove(self.directory)
+
+    def refresh(self) -> bool:
+        """Reload if any of the files we loaded have changed.
+
+        returns whether we reloaded"""
+        changed = {f for f, mtime in self._mtimes.items()
+                   if _mtime(f) != mtime}
+        if not changed:
+            return False
+
+        self.reload(changed)
+        return True
+
+    def _stale_modules(self, changed: Optional[set[str]]) -> set[str]:
+        """The local modules in changed files, and the local modules which
+        refer to them (or to anything from them)."""
+        local = set(self.local_modules())
+        if changed is None:
+            return local
+
+        stale = {name for name in local
+                 if os.path.realpath(sys.modules[name].__file__ or '')
+                 in changed}
+
+        while True:
+            users = {name for name in local - stale
+                     if _refers_to(sys.modules[name], stale)}
+            if not users:
+                return stale
+
+            stale |= users
+
+    def local_modules(self) -> list[str]:
+        """The modules in sys.modules, under their own names, which were
+        loaded from the script's directory (other than this library)."""
+        modules = []
+        for name, module in list(sys.modules.items()):
+            file_name = getattr(module, '__file__', None)
+            if not file_name or getattr(module, '__name__', None) != name:
+                continue
+
+            file_name = os.path.realpath(file_name)
+            if (file_name.startswith(self.directory + os.sep)
+                    and not file_name.startswith(PACKAGE_DIR + os.sep)):
+                modules.append(name)
+
+        return modules
+
+    def load(self) -> ModuleType:
+        """Run the script in a new module, in the current grading context."""
+        module = ModuleType(self.name)
+        module.__file__ = str(self.path)
+
+        exec(self._code, module.__dict__)
+        return module
+
+    def grade(self, submission: Path | str,
+              state: Optional[IncrementalState] = None) -> GradingResults:
+        """Grade a submission directory and return the results.
+
+        state: if given, only run the tests whose definitions or dependencies
+        have changed since it was last updated, and reuse the stored results
+        of the others. It is updated with the tests that ran."""
+        self.refresh()
+
+        start = time.perf_counter()
+        with grading_context(submission) as context:
+            module = self.load()
+            loaded = time.perf_counter()
+
+            suite = load_tests(module)
+            if state is None:
+                result = GradingResult()
+                suite.run(result)
+            else:
+                state.use_submission(submission)
+                result = self._run_incrementally(suite, state, submission,
+                                                 context)
+
+            finished = time.perf_counter()
+
+        results = result.results()
+        results['phases'] = {'load': loaded - start,
+                             'tests': finished - loaded}
+        results.update(student_test_results(module))
+
+        return results
+
+
+    def _run_incrementally(self, suite: unittest.TestSuite,
+                           state: IncrementalState, submission: Path | str,
+                           context: GradingContext) -> 'GradingResult':
+        definitions = self._definitions
+        assert definitions is not None
+
+        hashes: dict[str, Optional[str]] = {}
+        result = _IncrementalResult(self, state, submission, context, hashes)
+
+        to_run = unittest.TestSuite()
+        for test in flatten_tests(suite):
+            definition = definitions.definition(test)
+            reused = state.reusable(test.id(), definition, definitions,
+                                    hashes)
+            if reused is not None:
+                result.reuse(reused)
+            else:
+                result.definitions[test.id()] = definition
+                to_run.addTest(test)
+
+        to_run.run(result)
+        return result
+
+    def dependencies(self, test: unittest.TestCase,
+                     recorder: DependencyRecorder, submission: Path | str,
+                     context: GradingContext,
+                     graph: ImportGraph) -> set[str]:
+        """The files which the outcome of a test that just ran depends on."""
+        submission = os.path.realpath(submission)
+        method_name = getattr(test, '_testMethodName', '')
+        attr = inspect.getattr_static(type(test), method_name, None)
+
+        # pytest may import any of the student's files, and the tests may
+        # also run against correct or buggy versions of them
+        solutions: list[Solution] = []
+        if isinstance(attr, t_module) and attr.reference:
+            solutions += attr.reference.values()
+        elif isinstance(attr, t_mutation):
+            solutions += [attr.solution, *attr.variants]
+
+        if isinstance(attr, (t_module, t_coverage, t_mutation,
+                             t_time_budget)):
+            return ({str(p) for p in Path(submission).rglob('*.py')}
+                    | {os.path.realpath(solution_file(solution))
+                       for solution in solutions})
+
+        # the student modules which the script imports, and the ones which
+        # are missing
+        files = {os.path.join(submission, failed.filename)
+                 for failed in context.failed_imports}
+        for name in context.module_names:
+            module = sys.modules.get(name)
+            spec = (object.__getattribute__(module, '__spec__')
+                    if module is not None else None)
+            if spec is not None and spec.origin:
+                files.add(os.path.realpath(spec.origin))
+
+        if method_name == 'test_student_imports':
+            return files
+
+        # a test may read the student's modules without calling any of their
+        # code (e.g. a constant), which the recorder doesn't see
+        for file_name in list(files):
+            if file_name.startswith(submission + os.sep):
+                files |= graph.closure(file_name)
+
+        for file_name in recorder.files:
+            file_name = os.path.realpath(file_name)
+            if file_name.startswith(submission + os.sep):
+                files |= graph.closure(file_name)
+            elif (file_name.startswith(self.directory + os.sep)
+                  and file_name != str(self.path)
+                  and not file_name.startswith(PACKAGE_DIR + os.sep)):
+                files.add(file_name)
+
+        return files
+
+
+def preload_imports(tree: ast.Module) -> None:
+    """Import the modules which a script imports at the top level, outside
+    of any `with` statement (such as `student_import`).
+
+    Modules which fail to import are skipped, so that the error is reported
+    when the script is run."""
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level \
+                and node.module:
+            names = [node.module]
+        else:
+            continue
+
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass
+
+
+def load_tests(module: ModuleType) -> unittest.TestSuite:
+    """Load the test cases which are defined in a module (but not the ones
+    it imported, such as Autograder itself)."""
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for obj in vars(module).values():
+        if (isinstance(obj, type) and issubclass(obj, unittest.TestCase)
+                and obj.__module__ == module.__name__):
+            suite.addTests(loader.loadTestsFromTestCase(obj))
+
+    return suite
+
+
+def student_test_results(module: ModuleType) -> GradingResults:
+    """Collect the results of the student's own tests (from t_module and
+    t_coverage) which the autograders in a module ran."""
+
+    student_tests: dict[str, list[dict[str, Any]]] = {}
+    coverage: dict[str, Optional[list[int]]] = {}
+
+    for obj in vars(module).values():
+        if not (isinstance(obj, type) and issubclass(obj, Autograder)
+                and obj.__module__ == module.__name__):
+            continue
+
+        for test_module, report in obj.testing_reports.items():
+            student_tests[test_module] = [
+                    {'name': test.node_id, 'phase': phase,
+                     'outcome': outcome, 'duration': test.durations[phase]}
+                    for test in report.tests.values()
+                    for phase, outcome in test.outcomes.items()]
+
+        if obj.cov_report:
+            for cov_module, cov in obj.cov_report.modules.items():
+                coverage[cov_module] = (sorted(cov.missing_lines)
+                                        if cov.imported else None)
+
+    return {'student_tests': student_tests, 'coverage': coverage}
+
+
+class GradingResult(unittest.TestResult):
+    """Collects the outcome of every test, with its weight, for
+    `results()`."""
+
+    def __init__(self):
+        super().__init__()
+
+        # put what the tests print into their failure messages
+        self.buffer = True
+
+        self.tests: list[dict[str, Any]] = []
+        self.reused = 0
+        self._started = 0.0
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+
+    def _add(self, test, status: str, output: str = '') -> None:
+        weight = weight_of(test) or 0
+        self.tests.append({
+            'name': test.id(),
+            'status': status,
+            'score': weight if status == 'passed' else 0,
+            'max_score': weight,
+            'duration': time.perf_counter() - self._started,
+            'output': output})
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._add(test, 'passed')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._add(test, 'failed', self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+
+        # errors in class fixtures are reported against a placeholder
+        if isinstance(test, unittest.TestCase):
+            self._add(test, 'error', self.errors[-1][1])
+        else:
+            self.tests.append({'name': str(test), 'status': 'error',
+                               'score': 0, 'max_score': 0, 'duration': 0.0,
+                               'output': self.errors[-1][1]})
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._add(test, 'skipped', reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._add(test, 'passed')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._add(test, 'failed', 'Unexpected success.')
+
+    def reuse(self, test_result: dict[str, Any]) -> None:
+        """Add the stored result of a test which didn't need to run."""
+        self.tests.append(test_result)
+        self.reused += 1
+
+    def results(self) -> GradingResults:
+        return {'score': sum(t['score'] for t in self.tests),
+                'max_score': sum(t['max_score'] for t in self.tests),
+                'reused': self.reused,
+                'tests': self.tests}
+
+
+class _IncrementalResult(GradingResult):
+    """Records what each test that runs depends on, and stores its result
+    in the incremental state."""
+
+    def __init__(self, autograder: AutograderModule, state: IncrementalState,
+                 submission: Path | str, context: GradingContext,
+                 hashes: dict[str, Optional[str]]):
+        super().__init__()
+
+        self.autograder = autograder
+        self.state = state
+        self.submission = submission
+        self.context = context
+        self.hashes = hashes
+
+        self.graph = ImportGraph(submission)
+        self.recorder = DependencyRecorder()
+
+        # the definition hash of each test that is run
+        self.definitions: dict[str, str] = {}
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.recorder.__enter__()
+
+    def stopTest(self, test):
+        self.recorder.__exit__(None, None, None)
+        super().stopTest(test)
+
+        if (test.id() not in self.definitions or not self.tests
+                or self.tests[-1]['name'] != test.id()):
+            return
+
+        dependencies = {}
+        for file_name in self.autograder.dependencies(
+                test, self.recorder, self.submission, self.context,
+                self.graph):
+            if file_name not in self.hashes:
+                self.hashes[file_name] = file_hash(file_name)
+            dependencies[file_name] = self.hashes[file_name]
+
+        definitions = self.autograder._definitions
+        assert definitions is not None
+        script_lines = self.recorder.lines.get(str(self.autograder.path),
+                                               set())
+        for name in definitions.functions_called(script_lines):
+            dependencies[SCRIPT_PREFIX + name] = \
+                    definitions.function_hash(name)
+
+        self.state.tests[test.id()] = TestRecord(
+                self.definitions[test.id()], dependencies, self.tests[-1])
+
+
+def _refers_to(module: ModuleType, module_names: set[str]) -> bool:
+    for value in vars(module).values():
+        if isinstance(value, ModuleType):
+            # without loading a lazy module
+            name = object.__getattribute__(value, '__name__')
+        else:
+            name = getattr(value, '__module__', None)
+
+        if name in module_names:
+            return True
+
+    return False
+
+
+def _mtime(file_name: str) -> int:
+    try:
+        return os.stat(file_name).st_mtime_ns
+    except OSError:
+        return -1
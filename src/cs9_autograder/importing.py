@@ -1,6 +1,8 @@
-from contextlib import contextmanager, redirect_stdout
-from dataclasses import dataclass
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from enum import auto, Enum
+import importlib.abc
 import importlib.util
 import importlib.machinery
 from modulefinder import ModuleFinder
@@ -8,13 +10,13 @@ import os
 import os.path
 from pathlib import Path
 import sys
-from types import ModuleType
-from typing import cast, Optional
+import traceback
+from types import ModuleType, TracebackType
+from typing import Any, cast, Optional
 import uuid
 import warnings
 
 _DEFAULT_SUBMISSION_PATH = Path('/autograder/submission')
-_SUBMISSION_PATH: Optional[Path] = None
 
 
 @dataclass(frozen=True)
@@ -26,23 +28,96 @@ class FailedImport:
     # if false, the import failed for another reason
     missing: bool
 
+    # the name of the student module which failed, if known
+    module_name: Optional[str] = None
 
-# We need to keep track of failed imports because the call to `import_student`
-# is not usually inised of a TestCase.
-# Autograder will then report the failures when its test methods are run.
-FAILED_IMPORTS: set[FailedImport] = set()
+
+@dataclass
+class ImportFrame:
+    """A directory which student modules are imported from, and the modules
+    which have been imported from it (by their unmangled names)."""
+    path: str
+    mangle: bool = True
+
+    # import the modules lazily (see student_import)
+    lazy: bool = False
+
+    modules: dict[str, ModuleType] = field(default_factory=dict)
+
+
+@dataclass
+class GradingContext:
+    """Everything about the submission that is being graded. Each thread or
+    asyncio task can grade a different submission in its own context (see
+    grading_context)."""
+
+    # overrides the SUBMISSION_PATH environment variable if set
+    submission_path: Optional[Path] = None
+
+    # We need to keep track of failed imports because the call to
+    # `import_student` is not usually inside of a TestCase.
+    # Autograder will then report the failures when its test methods are run.
+    failed_imports: set[FailedImport] = field(default_factory=set)
+
+    # where student modules are imported from, most recently added last.
+    # Only imports in this context search these paths, and the modules found
+    # in them are only visible to this context.
+    imports: list[ImportFrame] = field(default_factory=list)
+
+    # lazily imported student modules which haven't been checked for failures
+    # yet
+    lazy_modules: list[ModuleType] = field(default_factory=list)
+
+    # the mangled names in sys.modules of the student modules imported in
+    # this context, which are dropped when grading_context() exits
+    module_names: list[str] = field(default_factory=list)
+
+
+_DEFAULT_CONTEXT = GradingContext()
+_CONTEXT: ContextVar[GradingContext] = ContextVar('grading_context',
+                                                  default=_DEFAULT_CONTEXT)
+
+# the failed imports of the default context
+FAILED_IMPORTS: set[FailedImport] = _DEFAULT_CONTEXT.failed_imports
+
+def current_grading_context() -> GradingContext:
+    return _CONTEXT.get()
+
+
+@contextmanager
+def grading_context(submission_path: Optional[Path | str] = None):
+    """A context manager which grades a submission in a fresh GradingContext.
+
+    Threads and asyncio tasks each see the context that they entered (new
+    threads start in the default context, so use contextvars.copy_context()
+    to hand a context to a thread)."""
+
+    context = GradingContext(
+            Path(submission_path) if submission_path is not None else None)
+
+    token = _CONTEXT.set(context)
+    try:
+        yield context
+    finally:
+        _CONTEXT.reset(token)
+
+        # nothing else can import them by these names, so don't let them
+        # pile up in a long-running process
+        for name in context.module_names:
+            sys.modules.pop(name, None)
 
 
 def submission_path() -> Path:
     """Returns the student submission path.
 
     The student submission path will be searched for in the following way:
-    - Use the _SUBMISSION_PATH global variable if it is not none
+    - Use the current grading context's submission path if it is not none
     - Use the SUBMISSION_PATH OS environment variable if it is set
     - Otherwise, use the default submission path `/autograder/submission`
     """
-    if _SUBMISSION_PATH:
-        return _SUBMISSION_PATH
+    context_path = current_grading_context().submission_path
+    if context_path:
+        return context_path
 
     try:
         return Path(os.environ['SUBMISSION_PATH'])
@@ -53,24 +128,35 @@ def submission_path() -> Path:
 
 
 def set_submission_path(submission_path: Path | str) -> None:
-    global _SUBMISSION_PATH
-    _SUBMISSION_PATH = Path(submission_path)
+    """Set the submission path of the current grading context."""
+    current_grading_context().submission_path = Path(submission_path)
 
 
 class student_import:
-    """A context manager to student imports."""
+    """A context manager to student imports.
+
+    lazy: don't run a student module's top-level code until one of its
+    attributes is first used. If the module is missing or its top-level code
+    raises an exception, the import doesn't fail. Instead, the module's
+    attributes are placeholders which raise an ImportError when they are
+    used, and the tests which use them are skipped.
+
+    Failed imports are recorded in the grading context either way, for
+    Autograder.test_student_imports to report."""
 
     def __init__(self, import_path: Optional[Path | str] = None,
-                 mangle: bool = True):
+                 mangle: bool = True, lazy: bool = False):
 
         if import_path is None:
             import_path = submission_path()
 
         self.import_path = import_path
         self.mangle = mangle
+        self.lazy = lazy
 
         self.inner_context_managers = [
-                prepend_import_path(self.import_path, mangle=self.mangle),
+                prepend_import_path(self.import_path, mangle=self.mangle,
+                                    lazy=self.lazy),
                 ignore_prints()
                 ]
 
@@ -82,6 +168,10 @@ class student_import:
         for ctxt in reversed(self.inner_context_managers):
             ctxt.__exit__(exc_type, exc_value, traceback)
 
+        if isinstance(exc_value, Exception):
+            current_grading_context().failed_imports.add(
+                    _failed_import(exc_value, self.import_path))
+
         if isinstance(exc_value, ModuleNotFoundError):
             mod_name = exc_value.name
             print(f'Could not import module `{mod_name}`. '
@@ -90,28 +180,381 @@ class student_import:
                   file=sys.stderr)
 
 
+def _failed_import(err: Exception, import_path: Path | str) -> FailedImport:
+    """Work out which student module an exception from an import came from."""
+
+    if isinstance(err, ModuleNotFoundError) and err.name:
+        module_name = err.name.partition('.')[0]
+        return FailedImport(f'{module_name}.py', err, missing=True,
+                            module_name=module_name)
+
+    # the innermost top-level code in the submission which was running
+    import_path = os.path.realpath(import_path)
+    module_file = None
+    for frame, _ in traceback.walk_tb(err.__traceback__):
+        file_name = os.path.realpath(frame.f_code.co_filename)
+        if (frame.f_code.co_name == '<module>'
+                and file_name.startswith(import_path + os.sep)):
+            module_file = Path(file_name)
+
+    if module_file is None:
+        return FailedImport(str(import_path), err, missing=False)
+
+    return FailedImport(module_file.name, err, missing=False,
+                        module_name=module_file.stem)
+
+
+def failed_import_for(obj: Any) -> Optional[FailedImport]:
+    """Find the failed import, if any, of the student module which obj (a
+    module, or a function or class from one) comes from.
+
+    This loads obj's module if it was imported lazily."""
+
+    if isinstance(obj, ModuleType):  # loads a lazy module
+        module_name = obj.__name__
+    else:
+        module_name = getattr(obj, '__module__', None)
+
+    if module_name is None:
+        return None
+
+    for failed in current_grading_context().failed_imports:
+        if failed.module_name == module_name:
+            return failed
+
+    return None
+
+
+def load_lazy_modules() -> None:
+    """Run the top-level code of every lazily imported student module which
+    hasn't been used yet, so that its failures are recorded."""
+
+    lazy_modules = current_grading_context().lazy_modules
+    while lazy_modules:
+        lazy_modules.pop().__name__
+
+
+class _LazyStudentLoader(importlib.util.LazyLoader):
+    def __init__(self, loader: importlib.abc.Loader, context: GradingContext):
+        super().__init__(loader)
+        self.context = context
+
+    def exec_module(self, module: ModuleType) -> None:
+        super().exec_module(module)
+        self.context.lazy_modules.append(module)
+
+
+class _StudentLoader(importlib.abc.Loader):
+    """Run a lazily loaded student module the way student_import would have:
+    with the submission on the import path and prints ignored."""
+
+    def __init__(self, loader: importlib.abc.Loader, import_path: str,
+                 context: GradingContext):
+        self.loader = loader
+        self.import_path = import_path
+
+        # the module may be loaded from another context
+        self.context = context
+
+        self.error: Optional[BaseException] = None
+
+    def __getattr__(self, name):
+        # get_source(), get_filename(), etc. for tracebacks and inspect
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType) -> None:
+        try:
+            with prepend_import_path(self.import_path), ignore_prints():
+                self.loader.exec_module(module)  # type: ignore
+        except (Exception, SystemExit) as e:
+            self.error = e.with_traceback(
+                    _student_traceback(e.__traceback__, self.import_path))
+        else:
+            return
+
+        origin = Path(cast(str, module.__spec__.origin))
+        self.context.failed_imports.add(
+                FailedImport(origin.name, self.error, missing=False,
+                             module_name=module.__name__))
+
+        module.__class__ = _FailedStudentModule
+
+
+def _student_traceback(tb: Optional[TracebackType],
+                       import_path: str) -> Optional[TracebackType]:
+    """Drop the importing machinery from the start of a traceback, so that
+    it starts in the student's code."""
+    student_tb = tb
+    while (student_tb is not None
+           and not os.path.realpath(student_tb.tb_frame.f_code.co_filename)
+           .startswith(import_path + os.sep)):
+        student_tb = student_tb.tb_next
+
+    return student_tb if student_tb is not None else tb
+
+
+class _MissingStudentLoader(importlib.abc.Loader):
+    def __init__(self, frame: ImportFrame, name: str,
+                 error: ModuleNotFoundError):
+        self.frame = frame
+        self.name = name
+        self.error = error
+
+    def create_module(self, spec):
+        module = ModuleType(self.name)
+        self.frame.modules[self.name] = module
+        return module
+
+    def exec_module(self, module: ModuleType) -> None:
+        module.__class__ = _FailedStudentModule
+
+
+class _FailedStudentModule(ModuleType):
+    """A student module which is missing or whose top-level code raised an
+    exception."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        return FailedStudentAttribute(self.__name__, name,
+                                      self.__spec__.loader.error)
+
+
+class FailedStudentAttribute:
+    """Stands in for an attribute of a student module which failed to import.
+    Using it raises an ImportError."""
+
+    def __init__(self, module_name: str, name: str, error: BaseException):
+        # so that failed_import_for() can find the module
+        self.__module__ = module_name
+        self.__name__ = name
+        self.error = error
+
+    def __call__(self, *args, **kwargs):
+        raise _import_error(self.__module__, self.error) from self.error
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        raise _import_error(self.__module__, self.error) from self.error
+
+    def __repr__(self):
+        return f'<failed import {self.__module__}.{self.__name__}>'
+
+
+def _import_error(module_name: str, error: BaseException) -> ImportError:
+    if isinstance(error, ModuleNotFoundError) and error.name == module_name:
+        return ImportError(f'Could not import `{module_name}` because it is '
+                           'missing.', name=module_name)
+
+    return ImportError(f'Could not import `{module_name}` because its '
+                       f'top-level code raised {type(error).__name__}: '
+                       f'{error}', name=module_name)
+
+
 @contextmanager
-def prepend_import_path(import_path: Path | str, mangle: bool = True):
-    original_modules = set(sys.modules)
+def prepend_import_path(import_path: Path | str, mangle: bool = True,
+                        lazy: bool = False):
+    """Import modules from import_path inside of this context manager.
+
+    The path is added to the current grading context rather than sys.path,
+    so imports in other threads and tasks don't see it.
+
+    mangle: keep the modules out of sys.modules under their own names, so
+    that another module with the same name (e.g. the correct solution, or
+    another submission) can be imported later.
+    lazy: see student_import"""
 
     import_path = str(import_path)
     import_path = os.path.realpath(import_path, strict=True)
+
+    frame = ImportFrame(import_path, mangle=mangle, lazy=lazy)
+    imports = current_grading_context().imports
+
+    imports.append(frame)
     try:
-        sys.path.insert(1, import_path)
         yield None
     finally:
-        if sys.path[1] == import_path:
-            del sys.path[1]
+        if imports and imports[-1] is frame:
+            imports.pop()
         else:
-            warnings.warn(f'Did not delete `{import_path}` from sys.path '
-                          'because it was no longer at index 1.',
+            warnings.warn(f'Did not delete `{import_path}` from the '
+                          'import paths because it was no longer last.',
                           RuntimeWarning)
 
         if mangle:
-            # assume all new items in sys.modules should get mangled
-            new_modules = set(sys.modules) - original_modules
-            for mod in new_modules:
-                mangle_module(mod)
+            # packages have to be in sys.modules under their own names while
+            # their submodules are imported, so mangle them now
+            for name, module in frame.modules.items():
+                if sys.modules.get(name) is module:
+                    _mangle_package(name)
+
+
+def _mangle_package(package: str) -> None:
+    suffix = uuid.uuid1().hex
+    submodules = [name for name in sys.modules
+                  if name == package or name.startswith(package + '.')]
+    for name in submodules:
+        mangle_module(name, suffix)
+        current_grading_context().module_names.append(f'__{name}_{suffix}__')
+
+
+class _ContextPathFinder(importlib.abc.MetaPathFinder):
+    """Find top-level modules in the current grading context's import
+    frames.
+
+    Unless the frame says not to mangle them, modules are put in sys.modules
+    under a unique name, rather than their own, and kept in the frame
+    instead. That way, two contexts can import different modules with the
+    same name at the same time."""
+
+    def find_spec(self, fullname, path=None, target=None):
+        # submodules of a student package are found through the package
+        if path is not None:
+            return None
+
+        imports = current_grading_context().imports
+        if not imports:
+            return None
+
+        for frame in reversed(imports):
+            if fullname in frame.modules:
+                module = frame.modules[fullname]
+
+                # don't use getattr, which would load a lazy module
+                spec = object.__getattribute__(module, '__spec__')
+                return importlib.machinery.ModuleSpec(
+                        spec.name, _ImportedLoader(module))
+
+        for frame in reversed(imports):
+            spec = importlib.machinery.PathFinder.find_spec(fullname,
+                                                            [frame.path])
+            if spec is not None:
+                return self._frame_spec(spec, frame)
+
+        top_frame = imports[-1]
+        if top_frame.lazy and not self._found_elsewhere(fullname):
+            return self._missing_spec(fullname, top_frame)
+
+        return None
+
+    def _frame_spec(self, spec: importlib.machinery.ModuleSpec,
+                    frame: ImportFrame) -> importlib.machinery.ModuleSpec:
+        fullname = spec.name
+        is_package = spec.submodule_search_locations is not None
+
+        if frame.mangle and not is_package:
+            spec.name = _mangled_name(fullname)
+            current_grading_context().module_names.append(spec.name)
+
+        loader = _FrameLoader(spec.loader, frame, fullname)
+
+        # only plain .py files can be loaded lazily
+        if (frame.lazy and not is_package
+                and isinstance(spec.loader,
+                               importlib.machinery.SourceFileLoader)):
+            context = current_grading_context()
+            spec.loader = _LazyStudentLoader(
+                    _StudentLoader(loader, frame.path, context), context)
+        else:
+            spec.loader = loader
+
+        return spec
+
+    def _missing_spec(self, fullname: str, frame: ImportFrame) \
+            -> importlib.machinery.ModuleSpec:
+        error = ModuleNotFoundError(f'No module named {fullname!r}',
+                                    name=fullname)
+        current_grading_context().failed_imports.add(
+                FailedImport(f'{fullname}.py', error, missing=True,
+                             module_name=fullname))
+
+        name = fullname
+        if frame.mangle:
+            name = _mangled_name(fullname)
+            current_grading_context().module_names.append(name)
+
+        return importlib.machinery.ModuleSpec(
+                name, _MissingStudentLoader(frame, fullname, error))
+
+    def _found_elsewhere(self, fullname: str) -> bool:
+        for finder in sys.meta_path:
+            if (isinstance(finder, _ContextPathFinder)
+                    or not hasattr(finder, 'find_spec')):
+                continue
+
+            if finder.find_spec(fullname, None) is not None:
+                return True
+
+        return False
+
+
+class _FrameLoader(importlib.abc.Loader):
+    """Create a module under its own name (whatever its name in sys.modules)
+    and remember it in the frame."""
+
+    def __init__(self, loader: importlib.abc.Loader, frame: ImportFrame,
+                 name: str):
+        self.loader = loader
+        self.frame = frame
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        module = ModuleType(self.name)
+        self.frame.modules[self.name] = module
+        return module
+
+    def exec_module(self, module: ModuleType) -> None:
+        try:
+            self.loader.exec_module(module)  # type: ignore
+        except BaseException:
+            # like a failed import, don't keep the broken module. (A lazy
+            # module is kept, so that it is still a placeholder.)
+            if (not self.frame.lazy
+                    and self.frame.modules.get(self.name) is module):
+                del self.frame.modules[self.name]
+            raise
+
+
+class _ImportedLoader(importlib.abc.Loader):
+    """Import a module again which is already in the frame."""
+
+    def __init__(self, module: ModuleType):
+        self.module = module
+
+    def create_module(self, spec):
+        return self.module
+
+    def exec_module(self, module: ModuleType) -> None:
+        pass
+
+
+def _mangled_name(module: str) -> str:
+    return f'__{module}_{uuid.uuid1().hex}__'
+
+
+def _install_context_path_finder() -> None:
+    """Search the grading context's import frames just before sys.path."""
+    if any(isinstance(finder, _ContextPathFinder) for finder in sys.meta_path):
+        return
+
+    try:
+        index = sys.meta_path.index(importlib.machinery.PathFinder)
+    except ValueError:
+        index = len(sys.meta_path)
+
+    sys.meta_path.insert(index, _ContextPathFinder())
+
+
+_install_context_path_finder()
 
 
 def mangle_module(module: str, suffix: Optional[str] = None):
@@ -122,10 +565,7 @@ def mangle_module(module: str, suffix: Optional[str] = None):
 
     see: https://stackoverflow.com/a/76316559"""
 
-    if not suffix:
-        suffix = uuid.uuid1().hex
-
-    mangled = f'__{module}_{suffix}__'
+    mangled = f'__{module}_{suffix}__' if suffix else _mangled_name(module)
     sys.modules[mangled] = sys.modules[module]
     del sys.modules[module]
 
@@ -151,23 +591,52 @@ def import_from_file(path: Path | str, module_name: str) -> ModuleType:
 
 
 
+# whether ignore_prints is on in the current thread or asyncio task
+_IGNORE_PRINTS: ContextVar[bool] = ContextVar('ignore_prints', default=False)
+
+
+class _ContextStdout:
+    """Wraps stdout, and throws away what is written to it in contexts where
+    ignore_prints is on.
+
+    Replacing sys.stdout itself for each ignore_prints would affect every
+    thread, and two threads which enter and exit it in turn would leave the
+    other's replacement behind."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        if _IGNORE_PRINTS.get():
+            return len(text)
+
+        return self.stream.write(text)
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
 class ignore_prints:
     """A context manager that prevents print statements from outputting to stdout
-    """
 
-    def __init__(self):
-        self.dev_null = open(os.devnull, 'w')
-        self.redirect_stdout = redirect_stdout(self.dev_null)
+    Only prints in the current thread or asyncio task (and in the threads
+    which it hands its context to) are ignored."""
 
     def __enter__(self):
-        self.dev_null.__enter__()
-        self.redirect_stdout.__enter__()
+        # installed once, and left in place, since it only ignores prints
+        # in contexts that asked for it
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+
+        self._token = _IGNORE_PRINTS.set(True)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        redirect_exit = self.redirect_stdout.__exit__(exc_type, exc_value, traceback)
-        dev_null_exit = self.dev_null.__exit__(exc_type, exc_value, traceback)
-        return redirect_exit or dev_null_exit
+        _IGNORE_PRINTS.reset(self._token)
 
 
 def imported_modules(module_name: str, search_path: Path | str) -> set[str]:
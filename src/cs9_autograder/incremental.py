@@ -0,0 +1,255 @@
+import ast
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import os.path
+from pathlib import Path
+import sys
+import threading
+from types import FrameType
+from typing import Any, Optional
+
+from .importing import imported_modules, module_to_path
+
+
+# dependencies on the autograder script's own top-level functions are stored
+# under this prefix, rather than on the whole file
+SCRIPT_PREFIX = 'script:'
+
+
+def file_hash(path: Path | str) -> Optional[str]:
+    """The SHA-256 of a file's contents, or None if it doesn't exist."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+class DependencyRecorder:
+    """Records which files have code that is called, in any thread, while
+    it is recording.
+
+    This uses a profile function, which only sees calls (not every line), so
+    it is much cheaper than coverage. Profiling the student's code with
+    cProfile replaces it, so don't use both at once."""
+
+    def __init__(self):
+        self.files: set[str] = set()
+
+        # the first lines of the code objects which were called, by file
+        self.lines: dict[str, set[int]] = {}
+
+    def _profile(self, frame: FrameType, event: str, arg: Any) -> None:
+        if event == 'call':
+            code = frame.f_code
+            self.files.add(code.co_filename)
+            self.lines.setdefault(code.co_filename, set()).add(
+                    code.co_firstlineno)
+
+    def __enter__(self) -> 'DependencyRecorder':
+        self.files.clear()
+        self.lines.clear()
+
+        # timeouts run the student's code in watchdog threads
+        threading.setprofile(self._profile)
+        sys.setprofile(self._profile)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.setprofile(None)
+        threading.setprofile(None)  # type: ignore
+
+
+class ScriptDefinitions:
+    """Hashes the parts of an autograder script which define each test, so
+    that a test is only rerun when its own definition changes."""
+
+    def __init__(self, tree: ast.Module):
+        self.tree = tree
+
+        classes = (ast.ClassDef,)
+        functions = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+        # everything at the top level other than classes and functions
+        # (imports, constants, student imports) may affect any test
+        self.module_hash = _hash(*(
+                ast.dump(node) for node in self.tree.body
+                if not isinstance(node, classes + functions)))
+
+        self.classes = {node.name: node for node in self.tree.body
+                        if isinstance(node, classes)}
+        self.functions = {node.name: node for node in self.tree.body
+                          if isinstance(node, functions)}
+
+    def definition(self, test) -> str:
+        """Hash the definition of a test method: the top-level statements,
+        and the header and member of the class which define it."""
+        method_name = getattr(test, '_testMethodName', '')
+
+        parts = [self.module_hash]
+        for cls in type(test).__mro__:
+            node = self.classes.get(cls.__name__)
+            if node is None:
+                continue
+
+            member = _class_member(node, method_name)
+            if member is not None:
+                header = ast.ClassDef(node.name, node.bases, node.keywords,
+                                      [], node.decorator_list)
+                parts += [ast.dump(header), ast.dump(member)]
+                break
+
+        else:  # defined outside the script, e.g. test_student_imports
+            parts.append(type(test).__qualname__)
+            parts.append(method_name)
+
+        return _hash(*parts)
+
+    def functions_called(self, lines: set[int]) -> list[str]:
+        """The top-level functions of the script whose code starts at or
+        contains one of lines."""
+        called = []
+        for name, node in self.functions.items():
+            end = node.end_lineno or node.lineno
+            if any(node.lineno <= line <= end for line in lines):
+                called.append(name)
+
+        return called
+
+    def function_hash(self, name: str) -> Optional[str]:
+        node = self.functions.get(name)
+        return _hash(ast.dump(node)) if node is not None else None
+
+
+def _class_member(node: ast.ClassDef, name: str) -> Optional[ast.stmt]:
+    for statement in node.body:
+        if (isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and statement.name == name):
+            return statement
+
+        if isinstance(statement, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == name
+                for target in statement.targets):
+            return statement
+
+    return None
+
+
+@dataclass
+class TestRecord:
+    """What a test's outcome depended on the last time it ran."""
+    definition: str
+
+    # file name (or SCRIPT_PREFIX + function name) to its hash
+    dependencies: dict[str, Optional[str]]
+
+    result: dict[str, Any]
+
+    __test__ = False  # tell pytest to ignore this class during test discovery
+
+
+@dataclass
+class IncrementalState:
+    """The outcome of every test from the last time a submission was graded,
+    and what each one depended on.
+
+    A test's stored outcome is reused as long as its definition and the
+    hashes of its dependencies haven't changed."""
+
+    tests: dict[str, TestRecord] = field(default_factory=dict)
+
+    # the real path of the submission which the outcomes are for
+    submission: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: Path | str) -> 'IncrementalState':
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+
+        return cls({test_id: TestRecord(**record)
+                    for test_id, record in data['tests'].items()},
+                   data.get('submission'))
+
+    def save(self, path: Path | str) -> None:
+        with open(path, 'w') as f:
+            json.dump({'submission': self.submission,
+                       'tests': {test_id: asdict(record) for test_id, record
+                                 in self.tests.items()}},
+                      f, indent=2, sort_keys=True)
+
+    def use_submission(self, submission: Path | str) -> None:
+        """Discard the stored outcomes if they are for another submission,
+        whose files may differ in ways that the dependencies don't show."""
+        submission = os.path.realpath(submission)
+        if submission != self.submission:
+            self.tests.clear()
+            self.submission = submission
+
+    def reusable(self, test_id: str, definition: str,
+                 definitions: ScriptDefinitions,
+                 hashes: dict[str, Optional[str]]) \
+            -> Optional[dict[str, Any]]:
+        """The stored result of a test, if it is still up to date.
+
+        hashes: a cache of file hashes, shared between tests"""
+        record = self.tests.get(test_id)
+        if record is None or record.definition != definition:
+            return None
+
+        for dependency, expected in record.dependencies.items():
+            if dependency.startswith(SCRIPT_PREFIX):
+                actual = definitions.function_hash(
+                        dependency[len(SCRIPT_PREFIX):])
+            else:
+                if dependency not in hashes:
+                    hashes[dependency] = file_hash(dependency)
+                actual = hashes[dependency]
+
+            if actual != expected:
+                return None
+
+        return record.result
+
+
+class ImportGraph:
+    """Finds the submission's modules which a submission module imports,
+    directly or not. Results are cached."""
+
+    def __init__(self, submission: Path | str):
+        self.submission = os.path.realpath(submission)
+        self._cache: dict[str, set[str]] = {}
+
+    def closure(self, file_name: str) -> set[str]:
+        if file_name not in self._cache:
+            self._cache[file_name] = self._find(file_name)
+
+        return self._cache[file_name]
+
+    def _find(self, file_name: str) -> set[str]:
+        module_name = Path(file_name).stem
+        try:
+            names = imported_modules(module_name, self.submission)
+        except Exception:  # e.g. a syntax error
+            return {file_name}
+
+        files = {file_name}
+        for name in names:
+            try:
+                files.add(str(module_to_path(name, self.submission)))
+            except ModuleNotFoundError:
+                pass
+
+        return files
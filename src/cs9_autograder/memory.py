@@ -0,0 +1,91 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+import gc
+import os.path
+from pathlib import Path
+import tracemalloc
+from typing import Any, Optional
+
+
+@dataclass
+class MemoryUsage:
+    """How much memory a call allocated, in bytes."""
+    peak: int  # the most memory in use at once during the call
+    retained: int  # memory still in use after the call, including its result
+
+    # memory allocated during the call which is still in use after it, by
+    # line, if it was requested. tracemalloc can't tell us what was in use at
+    # the peak, so these only explain the retained memory.
+    allocations: Optional[list[tracemalloc.StatisticDiff]] = None
+
+
+def measure_memory(func: Callable[[], Any],
+                   trace_path: Optional[Path | str] = None) \
+                           -> tuple[Any, MemoryUsage]:
+    """Call func under tracemalloc and measure its memory usage.
+
+    trace_path: if given, also record which lines in files under this path
+    allocated the memory that the call retained.
+
+    returns the result of func and its memory usage"""
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    try:
+        gc.collect()
+
+        filters = []
+        if trace_path is not None:
+            pattern = os.path.join(os.path.realpath(trace_path), '*')
+            filters = [tracemalloc.Filter(True, pattern)]
+            before_snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        result = func()
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        allocations = None
+        if trace_path is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+            allocations = [stat for stat
+                           in snapshot.compare_to(before_snapshot, 'lineno')
+                           if stat.size_diff > 0]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    usage = MemoryUsage(peak=max(peak - before, 0),
+                        retained=max(current - before, 0),
+                        allocations=allocations)
+    return result, usage
+
+
+def format_allocations(allocations: list[tracemalloc.StatisticDiff],
+                       root: Path | str, limit: int = 5) -> str:
+    """Describe the lines which allocated the most memory."""
+
+    root = os.path.realpath(root)
+
+    lines = []
+    for stat in allocations[:limit]:
+        frame = stat.traceback[0]
+        file_name = os.path.relpath(frame.filename, root)
+        lines.append(f'{file_name}, line {frame.lineno}: '
+                     f'{format_bytes(stat.size_diff)} in '
+                     f'{stat.count_diff} blocks')
+
+    return '\n'.join(lines)
+
+
+def format_bytes(size: float) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
@@ -0,0 +1,439 @@
+import ast
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import subprocess
+from tempfile import TemporaryDirectory
+import time
+from typing import Any, Optional
+
+import coverage
+
+from .importing import module_to_path, submission_path
+from .testing import (CAPTURE_ARGS, import_overlay, OVERLAY_ARGS,
+                      overlay_env, run_captured, Solution, solution_file)
+from .testing_report import TestingReport
+
+
+# the fraction of mutants that the student's tests must kill
+MUTATION_THRESHOLD = 0.8
+
+# at most this many generated mutants are run, spread evenly over the module
+MAX_MUTANTS = 50
+
+# a mutant whose tests take this many times longer than they did on the
+# correct module is assumed to loop forever, and counts as killed
+TIMEOUT_FACTOR = 10
+MIN_TIMEOUT = 5.0
+
+
+_OPERATORS: dict[type, type] = {
+    ast.Add: ast.Sub,
+    ast.Sub: ast.Add,
+    ast.Mult: ast.FloorDiv,
+    ast.Div: ast.Mult,
+    ast.FloorDiv: ast.Mult,
+    ast.Mod: ast.FloorDiv,
+    ast.Lt: ast.LtE,
+    ast.LtE: ast.Lt,
+    ast.Gt: ast.GtE,
+    ast.GtE: ast.Gt,
+    ast.Eq: ast.NotEq,
+    ast.NotEq: ast.Eq,
+    ast.In: ast.NotIn,
+    ast.NotIn: ast.In,
+    ast.Is: ast.IsNot,
+    ast.IsNot: ast.Is,
+    ast.And: ast.Or,
+    ast.Or: ast.And,
+}
+
+_SYMBOLS: dict[type, str] = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+    ast.FloorDiv: '//', ast.Mod: '%', ast.Lt: '<', ast.LtE: '<=',
+    ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!=',
+    ast.In: 'in', ast.NotIn: 'not in', ast.Is: 'is', ast.IsNot: 'is not',
+    ast.And: 'and', ast.Or: 'or',
+}
+
+_BLOCKS = ('body', 'orelse', 'finalbody')
+
+
+class t_mutation:
+    """A class descriptor which generates a test of how many bugs the
+    student's test module catches.
+
+    Passing tests don't show that they check anything, so the student's tests
+    are run against buggy versions of the correct module (see
+    run_mutation_tests), and they pass if they fail against at least
+    `threshold` of them."""
+    def __init__(self, test_module: str, module_name: str,
+                 solution: Solution,
+                 variants: Iterable[Path | str] = (),
+                 generate: bool = True,
+                 threshold: float = MUTATION_THRESHOLD,
+                 max_mutants: Optional[int] = MAX_MUTANTS):
+        self.test_module = test_module
+        self.module_name = module_name
+        self.solution = solution
+        self.variants = list(variants)
+        self.generate = generate
+        self.threshold = threshold
+        self.max_mutants = max_mutants
+
+    def __get__(self, instance, owner):
+        def mutation_runner():
+            report = run_mutation_tests(
+                    self.test_module, self.module_name, self.solution,
+                    submission_path(), self.variants, self.generate,
+                    self.max_mutants)
+
+            if not report.baseline.success:
+                instance.fail(
+                        f'Your tests in `{self.test_module}` fail on a '
+                        f'correct `{self.module_name}`: '
+                        f'{sorted(report.baseline.failed_tests)}')
+
+            print(f'Your tests caught {len(report.killed)} of '
+                  f'{len(report.results)} bugs ({report.score:.0%}). '
+                  f'{self.threshold:.0%} is needed.')
+
+            if report.score < self.threshold:
+                print()
+                print('These bugs were not caught:')
+                for mutant in report.survived:
+                    print(f'  {mutant.description}')
+
+                instance.fail()
+
+        return mutation_runner
+
+
+@dataclass
+class Mutant:
+    """A buggy version of a module."""
+    description: str
+
+    # the line of the correct module that was changed, or None if the tests
+    # which cover it aren't known, so that every test must run
+    line: Optional[int]
+
+    source: str
+
+
+@dataclass
+class _MutationPoint:
+    """A change to one field of an AST node, which can be undone."""
+    node: ast.AST
+    field: str
+    index: Optional[int]
+    replacement: Any
+    description: str
+    line: int
+
+    def _swap(self, value: Any) -> Any:
+        if self.index is None:
+            old = getattr(self.node, self.field)
+            setattr(self.node, self.field, value)
+        else:
+            values = getattr(self.node, self.field)
+            old = values[self.index]
+            values[self.index] = value
+
+        return old
+
+    def mutant(self, tree: ast.Module) -> Mutant:
+        original = self._swap(self.replacement)
+        try:
+            source = ast.unparse(tree)
+        finally:
+            self._swap(original)
+
+        return Mutant(self.description, self.line, source)
+
+
+class _MutationPoints(ast.NodeVisitor):
+    """Finds every place in the module's functions that can be mutated."""
+
+    def __init__(self):
+        self.points: list[_MutationPoint] = []
+        self._functions: list[str] = []
+
+        # coverage records lines by the statement they are part of
+        self._statement: Optional[ast.stmt] = None
+
+    def _add(self, node: ast.AST, field: str, index: Optional[int],
+             replacement: Any, change: str) -> None:
+        assert self._statement is not None
+        line = self._statement.lineno
+        self.points.append(_MutationPoint(
+                node, field, index, replacement,
+                f'line {line} (in `{self._functions[-1]}`): {change}', line))
+
+    def _replace_operator(self, node: ast.AST, field: str,
+                          index: Optional[int], op: ast.AST) -> None:
+        new = _OPERATORS.get(type(op))
+        if new is not None:
+            self._add(node, field, index, new(),
+                      f'`{_SYMBOLS[type(op)]}` replaced with '
+                      f'`{_SYMBOLS[new]}`')
+
+    def visit_FunctionDef(self, node: ast.FunctionDef | ast.AsyncFunctionDef):
+        self._functions.append(node.name)
+        self._drop_statements(node)
+        self.generic_visit(node)
+        self._functions.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit(self, node: ast.AST) -> None:
+        if not isinstance(node, ast.stmt):
+            return super().visit(node)
+
+        outer = self._statement
+        self._statement = node
+        try:
+            if self._functions and not isinstance(
+                    node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self._drop_statements(node)
+            super().visit(node)
+        finally:
+            self._statement = outer
+
+    def _drop_statements(self, node: ast.stmt) -> None:
+        for field in _BLOCKS:
+            statements = getattr(node, field, None)
+            if not isinstance(statements, list):
+                continue
+
+            for i, statement in enumerate(statements):
+                if isinstance(statement, (ast.Pass, ast.FunctionDef,
+                                          ast.AsyncFunctionDef, ast.ClassDef)):
+                    continue
+
+                if (isinstance(statement, ast.Expr)
+                        and isinstance(statement.value, ast.Constant)):
+                    continue  # a docstring
+
+                outer = self._statement
+                self._statement = statement
+                self._add(node, field, i, ast.Pass(), 'statement removed')
+                self._statement = outer
+
+    def visit_BinOp(self, node: ast.BinOp) -> None:
+        if self._functions:
+            self._replace_operator(node, 'op', None, node.op)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> None:
+        if self._functions:
+            self._replace_operator(node, 'op', None, node.op)
+        self.generic_visit(node)
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> None:
+        if self._functions:
+            self._replace_operator(node, 'op', None, node.op)
+        self.generic_visit(node)
+
+    def visit_Compare(self, node: ast.Compare) -> None:
+        if self._functions:
+            for i, op in enumerate(node.ops):
+                self._replace_operator(node, 'ops', i, op)
+        self.generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant) -> None:
+        value = node.value
+        if (self._functions and isinstance(value, int)
+                and not isinstance(value, bool)):
+            for new in (value + 1, value - 1):
+                self._add(node, 'value', None, new,
+                          f'`{value}` replaced with `{new}`')
+
+
+def generate_mutants(source: str,
+                     max_mutants: Optional[int] = MAX_MUTANTS) \
+                             -> list[Mutant]:
+    """Make buggy versions of a module by swapping an operator, changing an
+    integer by one, or removing a statement, inside its functions.
+
+    If there would be more than max_mutants, they are picked evenly from
+    throughout the module."""
+    tree = ast.parse(source)
+    finder = _MutationPoints()
+    finder.visit(tree)
+
+    points = finder.points
+    if max_mutants is not None and len(points) > max_mutants:
+        points = [points[i * len(points) // max_mutants]
+                  for i in range(max_mutants)]
+
+    return [point.mutant(tree) for point in points]
+
+
+@dataclass
+class MutantResult:
+    mutant: Mutant
+    killed: bool
+
+    # the student's tests which were run against the mutant
+    tests: list[str]
+
+
+@dataclass
+class MutationReport:
+    # the student's tests, run against the correct module
+    baseline: TestingReport
+
+    results: list[MutantResult]
+
+    @property
+    def killed(self) -> list[Mutant]:
+        return [result.mutant for result in self.results if result.killed]
+
+    @property
+    def survived(self) -> list[Mutant]:
+        return [result.mutant for result in self.results
+                if not result.killed]
+
+    @property
+    def score(self) -> float:
+        """The fraction of mutants killed."""
+        if not self.results:
+            return 1.0
+
+        return len(self.killed) / len(self.results)
+
+
+def run_mutation_tests(test_module: str, module_name: str,
+                       solution: Solution,
+                       search_path: Path | str,
+                       variants: Iterable[Path | str] = (),
+                       generate: bool = True,
+                       max_mutants: Optional[int] = MAX_MUTANTS,
+                       max_workers: Optional[int] = None) -> MutationReport:
+    """Run the student's test module against buggy versions of the correct
+    module, to see how many of them the tests catch.
+
+    The tests import the buggy version instead of the student's module
+    module_name. First they run against the correct module, measuring which
+    of them cover each line. Then the mutants run concurrently in their own
+    pytest processes (at most `max_workers` at a time, which defaults to the
+    number of cores), and each mutant only runs the tests which cover the
+    line it changed. A mutant that no test covers survives without running.
+    Mutants are not run at all if the tests fail against the correct module.
+
+    solution: the correct module, or the path of its file
+    variants: the paths of buggy versions of the module, written by the
+    instructor. Every test runs against each of them.
+    generate: also generate mutants with generate_mutants()"""
+
+    solution = solution_file(solution)
+
+    mutants = [Mutant(f'`{Path(variant).name}`', None,
+                      Path(variant).read_text()) for variant in variants]
+    if generate:
+        mutants += generate_mutants(Path(solution).read_text(), max_mutants)
+
+    search_path = Path(search_path).resolve()
+    test_file = module_to_path(test_module, search_path)
+
+    baseline, covering, elapsed = _run_baseline(test_file, module_name,
+                                                solution, search_path)
+    if not baseline.success:
+        return MutationReport(baseline, [])
+
+    timeout = max(MIN_TIMEOUT, TIMEOUT_FACTOR * elapsed)
+
+    def run(mutant: Mutant) -> MutantResult:
+        if mutant.line is None:
+            tests = [str(test_file)]
+        else:
+            tests = sorted(covering.get(mutant.line, ()))
+            if not tests:
+                return MutantResult(mutant, killed=False, tests=[])
+
+        killed = _kills(tests, module_name, mutant.source, search_path,
+                        timeout)
+        return MutantResult(mutant, killed, tests)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(mutants)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, mutants))
+
+    return MutationReport(baseline, results)
+
+
+def _pytest_args(cwd: Path, args: list[str]) -> list[str]:
+    return ['pytest', '-p', 'no:cacheprovider', *OVERLAY_ARGS,
+            f'--rootdir={cwd}', *args]
+
+
+def _run_baseline(test_file: Path, module_name: str, solution: Path | str,
+                  search_path: Path) \
+                          -> tuple[TestingReport, dict[int, set[str]], float]:
+    """Run the tests against the correct module.
+
+    returns the testing report, the tests which cover each line of the
+    module, and how long the tests took"""
+
+    with (import_overlay({module_name: solution}) as overlay,
+          TemporaryDirectory() as tmp_dir):
+        module_file = overlay / f'{module_name}.py'
+
+        log_path = Path(tmp_dir) / 'report.jsonl'
+        data_path = Path(tmp_dir) / '.coverage'
+
+        args = _pytest_args(search_path, [
+                f'--report-log={log_path}', *CAPTURE_ARGS,
+                f'--cov={module_name}', '--cov-context=test', '--cov-report=',
+                str(test_file)])
+        env = dict(overlay_env(overlay), COVERAGE_FILE=str(data_path))
+
+        start = time.perf_counter()
+        stdout = run_captured(args, search_path, env)
+        elapsed = time.perf_counter() - start
+
+        with open(log_path) as log_file:
+            report = TestingReport.from_log(stdout, log_file)
+
+        covering: dict[int, set[str]] = {}
+        if data_path.exists():
+            data = coverage.CoverageData(str(data_path))
+            data.read()
+            for file_name in data.measured_files():
+                if os.path.samefile(file_name, module_file):
+                    for line, contexts in data.contexts_by_lineno(
+                            file_name).items():
+                        covering[line] = _test_ids(contexts)
+
+    return report, covering, elapsed
+
+
+def _test_ids(contexts: Iterable[str]) -> set[str]:
+    """Test contexts look like `test_file.py::test_name|run`. Code that runs
+    while the tests are collected has the empty context."""
+    return {context.rpartition('|')[0] for context in contexts if context}
+
+
+def _kills(tests: list[str], module_name: str, source: str,
+           search_path: Path, timeout: float) -> bool:
+    """Whether any of the tests fails against a mutant."""
+    with TemporaryDirectory() as overlay:
+        (Path(overlay) / f'{module_name}.py').write_text(source)
+
+        try:
+            result = subprocess.run(
+                    _pytest_args(search_path, ['-x', '-q', *tests]),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    cwd=search_path, env=overlay_env(overlay),
+                    timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return True
+
+    # 5: no tests were collected
+    return result.returncode not in (0, 5)
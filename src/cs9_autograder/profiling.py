@@ -0,0 +1,169 @@
+from collections import Counter
+from collections.abc import Callable
+import cProfile
+import os.path
+from pathlib import Path
+import pstats
+import sys
+import tempfile
+import threading
+from typing import Any, Optional
+
+
+DEFAULT_PROFILE_DIR = Path(tempfile.gettempdir()) / 'cs9_autograder_profiles'
+
+# how many hotspots to show the student
+DEFAULT_HOTSPOTS = 5
+
+# seconds between samples for the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+
+def _is_under(file_name: str, root: str) -> bool:
+    return os.path.realpath(file_name).startswith(root + os.sep)
+
+
+class CProfiler:
+    """Profile every function call with cProfile. Precise, but slows the
+    student's code down."""
+
+    suffix = '.prof'
+
+    def __init__(self, root: Path | str):
+        self.root = os.path.realpath(root)
+        self.profile = cProfile.Profile()
+
+    def run(self, func: Callable[[], Any]) -> Any:
+        """Call func with profiling enabled in the calling thread."""
+        self.profile.enable()
+        try:
+            return func()
+        finally:
+            self.profile.disable()
+
+    def hotspots(self, limit: int = DEFAULT_HOTSPOTS) -> list[str]:
+        """The functions under root which took the most time themselves."""
+        try:
+            stats = pstats.Stats(self.profile).stats  # type: ignore
+        except TypeError:  # nothing was profiled
+            return []
+
+        under_root = [(key, value) for key, value in stats.items()
+                      if _is_under(key[0], self.root)]
+        under_root.sort(key=lambda item: item[1][2], reverse=True)
+
+        lines = []
+        for (file_name, line_no, func_name), value in under_root[:limit]:
+            _, calls, total_time, cumulative_time, _ = value
+            file_name = os.path.relpath(file_name, self.root)
+            lines.append(f'{file_name}, line {line_no}, in {func_name}: '
+                         f'{calls} calls, {total_time:.3f}s '
+                         f'({cumulative_time:.3f}s including calls)')
+
+        return lines
+
+    def dump(self, path: Path | str) -> None:
+        self.profile.dump_stats(path)
+
+
+class SamplingProfiler:
+    """Sample the student's stack from another thread. Much lower overhead
+    than cProfile, so better for long runs, but only approximate."""
+
+    suffix = '.txt'
+
+    def __init__(self, root: Path | str, interval: float = SAMPLE_INTERVAL):
+        self.root = os.path.realpath(root)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.total = 0
+
+        # set when the student's code finishes, or when we stop waiting for
+        # it because it timed out
+        self._stop = threading.Event()
+
+    def run(self, func: Callable[[], Any]) -> Any:
+        """Call func while sampling the calling thread."""
+        target = threading.get_ident()
+
+        def sample():
+            while not self._stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                self.total += 1
+
+                # count the innermost frame that is in the student's code
+                while frame is not None:
+                    code = frame.f_code
+                    if _is_under(code.co_filename, self.root):
+                        self.samples[(code.co_filename, frame.f_lineno,
+                                      code.co_name)] += 1
+                        break
+                    frame = frame.f_back
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            return func()
+        finally:
+            self._stop.set()
+            sampler.join()
+
+    def hotspots(self, limit: int = DEFAULT_HOTSPOTS) -> list[str]:
+        """The lines under root which were running in the most samples."""
+        self._stop.set()
+
+        lines = []
+        for (file_name, line_no, func_name), count \
+                in self.samples.most_common(limit):
+            file_name = os.path.relpath(file_name, self.root)
+            percent = 100 * count / self.total
+            lines.append(f'{file_name}, line {line_no}, in {func_name}: '
+                         f'{percent:.0f}% of samples')
+
+        return lines
+
+    def dump(self, path: Path | str) -> None:
+        self._stop.set()
+
+        with open(path, 'w') as f:
+            print(f'{self.total} samples', file=f)
+            for (file_name, line_no, func_name), count \
+                    in self.samples.most_common():
+                print(f'{count}\t{file_name}:{line_no}\t{func_name}', file=f)
+
+
+PROFILERS = {'cprofile': CProfiler, 'sample': SamplingProfiler}
+
+
+Profiler = CProfiler | SamplingProfiler
+
+
+def make_profiler(kind: Optional[str | bool],
+                  root: Path | str) -> Optional[Profiler]:
+    """Make a profiler from a `profile` option.
+
+    kind: 'cprofile' (or True) or 'sample'. Returns None if kind is falsy."""
+
+    if not kind:
+        return None
+
+    if kind is True:
+        kind = 'cprofile'
+
+    try:
+        return PROFILERS[kind](root)
+    except KeyError:
+        raise ValueError(f'Unknown profiler `{kind}`. Expected one of '
+                         f'{list(PROFILERS)}.')
+
+
+def dump_profile(profiler: Profiler, name: str,
+                 profile_dir: Optional[Path | str] = None) -> Path:
+    """Save the full profile for instructors. Returns the file's path."""
+
+    profile_dir = Path(profile_dir or DEFAULT_PROFILE_DIR)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+
+    path = profile_dir / f'{name}{profiler.suffix}'
+    profiler.dump(path)
+    return path
@@ -0,0 +1,199 @@
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from .grading import GradingResults
+
+
+# how many submissions are buffered before they are written in one
+# transaction
+DEFAULT_BATCH_SIZE = 100
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    graded_at REAL NOT NULL,
+    score REAL NOT NULL,
+    max_score REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS test_results (
+    submission_id INTEGER NOT NULL
+        REFERENCES submissions(id) ON DELETE CASCADE,
+    test_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    score REAL NOT NULL,
+    max_score REAL NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS test_results_test_id
+    ON test_results(test_id, status);
+CREATE INDEX IF NOT EXISTS test_results_submission
+    ON test_results(submission_id);
+
+CREATE TABLE IF NOT EXISTS student_tests (
+    submission_id INTEGER NOT NULL
+        REFERENCES submissions(id) ON DELETE CASCADE,
+    module TEXT NOT NULL,
+    test_id TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS student_tests_test_id
+    ON student_tests(test_id);
+CREATE INDEX IF NOT EXISTS student_tests_submission
+    ON student_tests(submission_id);
+
+CREATE TABLE IF NOT EXISTS coverage_missing (
+    submission_id INTEGER NOT NULL
+        REFERENCES submissions(id) ON DELETE CASCADE,
+    module TEXT NOT NULL,
+    line INTEGER
+);
+CREATE INDEX IF NOT EXISTS coverage_missing_submission
+    ON coverage_missing(submission_id);
+
+CREATE TABLE IF NOT EXISTS phase_timings (
+    submission_id INTEGER NOT NULL
+        REFERENCES submissions(id) ON DELETE CASCADE,
+    phase TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phase_timings_submission
+    ON phase_timings(submission_id);
+"""
+
+
+class ResultsDatabase:
+    """Keeps grading results in a SQLite database so that they can be
+    analysed later without grading again.
+
+    Submissions are buffered and written batch_size at a time, each batch in
+    one transaction. Call flush() (or close()) to write the rest. Grading a
+    submission with the same name again replaces its results.
+
+    The database is in WAL mode, so it can be queried while it is being
+    written to."""
+
+    def __init__(self, path: Path | str,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = Path(path)
+        self.batch_size = batch_size
+
+        # a server records results from its handler threads
+        self._connection = sqlite3.connect(self.path,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, float, GradingResults]] = []
+
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('PRAGMA foreign_keys=ON')
+            self._connection.executescript(_SCHEMA)
+
+    def __enter__(self) -> 'ResultsDatabase':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, name: str, results: GradingResults) -> None:
+        """Record the results of grading a submission."""
+        with self._lock:
+            self._pending.append((name, time.time(), results))
+            if len(self._pending) >= self.batch_size:
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+    def _write(self) -> None:
+        if not self._pending:
+            return
+
+        with self._connection:  # one transaction
+            for name, graded_at, results in self._pending:
+                self._insert(name, graded_at, results)
+
+        self._pending.clear()
+
+    def _insert(self, name: str, graded_at: float,
+                results: GradingResults) -> None:
+        connection = self._connection
+        connection.execute('DELETE FROM submissions WHERE name = ?', (name,))
+
+        cursor = connection.execute(
+                'INSERT INTO submissions (name, graded_at, score, max_score) '
+                'VALUES (?, ?, ?, ?)',
+                (name, graded_at, results.get('score', 0),
+                 results.get('max_score', 0)))
+        submission_id = cursor.lastrowid
+
+        connection.executemany(
+                'INSERT INTO test_results VALUES (?, ?, ?, ?, ?, ?)',
+                [(submission_id, test['name'], test['status'], test['score'],
+                  test['max_score'], test.get('duration', 0.0))
+                 for test in results.get('tests', [])])
+
+        connection.executemany(
+                'INSERT INTO student_tests VALUES (?, ?, ?, ?, ?, ?)',
+                [(submission_id, module, test['name'], test['phase'],
+                  test['outcome'], test['duration'])
+                 for module, tests in results.get('student_tests', {}).items()
+                 for test in tests])
+
+        # a module that wasn't imported at all is one row with no line
+        connection.executemany(
+                'INSERT INTO coverage_missing VALUES (?, ?, ?)',
+                [(submission_id, module, line)
+                 for module, lines in results.get('coverage', {}).items()
+                 for line in (lines if lines is not None else [None])])
+
+        connection.executemany(
+                'INSERT INTO phase_timings VALUES (?, ?, ?)',
+                [(submission_id, phase, duration)
+                 for phase, duration in results.get('phases', {}).items()])
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        self.flush()
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def most_failed_tests(self, limit: int = 10) -> list[tuple[Any, ...]]:
+        """(test id, times it didn't pass, times it was run), most often
+        failed first."""
+        return self.query(
+                "SELECT test_id, SUM(status != 'passed') AS failed, "
+                'COUNT(*) FROM test_results GROUP BY test_id '
+                'ORDER BY failed DESC, test_id LIMIT ?', (limit,))
+
+    def slowest_student_suites(self, limit: int = 10) \
+            -> list[tuple[Any, ...]]:
+        """(submission, total duration of its own tests in seconds), slowest
+        first."""
+        return self.query(
+                'SELECT submissions.name, SUM(student_tests.duration) AS total '
+                'FROM student_tests JOIN submissions '
+                'ON submissions.id = student_tests.submission_id '
+                'GROUP BY submissions.id ORDER BY total DESC LIMIT ?',
+                (limit,))
+
+    def submission_results(self, name: str) -> list[tuple[Any, ...]]:
+        """(test id, status, score, max score, duration) of a submission."""
+        return self.query(
+                'SELECT test_id, status, test_results.score, '
+                'test_results.max_score, duration '
+                'FROM test_results JOIN submissions '
+                'ON submissions.id = test_results.submission_id '
+                'WHERE submissions.name = ? ORDER BY test_id', (name,))
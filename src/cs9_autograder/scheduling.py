@@ -0,0 +1,249 @@
+from collections.abc import Iterable, Iterator
+import inspect
+import json
+from pathlib import Path
+import time
+from typing import Optional
+import unittest
+
+from .test_item import TestItem
+
+
+OUT_OF_TIME = 'skipped: out of time'
+
+# runtime that we assume for tests that have never been run before
+DEFAULT_RUNTIME = 1.0
+
+# runtimes are clamped to this so that instant tests don't divide by zero
+MIN_RUNTIME = 1e-3
+
+
+RuntimeStats = dict[str, float]
+
+
+class ScheduledTestSuite(unittest.TestSuite):
+    """A test suite which runs the most points per second first and skips
+    any test that won't fit in the time budget.
+
+    Tests are ordered by their `@weight` divided by their historical runtime.
+    Tests of the same class are kept together so that `setUpClass` only runs
+    once per class.
+
+    budget: the total number of seconds the tests may take. If None, tests are
+    only reordered and never skipped.
+    stats_path: a JSON file with the historical runtime of each test, and of
+    each class's fixtures. It is updated with the new runtimes after every
+    run."""
+
+    def __init__(self, tests: Iterable = (),
+                 budget: Optional[float] = None,
+                 stats_path: Optional[Path | str] = None,
+                 default_runtime: float = DEFAULT_RUNTIME):
+
+        super().__init__(flatten_tests(tests))
+
+        self.budget = budget
+        self.stats_path = Path(stats_path) if stats_path else None
+        self.default_runtime = default_runtime
+
+    def run(self, result: unittest.TestResult,
+            debug: bool = False) -> unittest.TestResult:
+        """Run the tests in scheduled order, timing each test and checking
+        the budget as we go.
+
+        A test's runtime is only the time between its startTest and stopTest,
+        so class fixtures aren't charged to whichever test runs first.
+        Instead, the time spent before the first test of a class is recorded
+        as the class's setup time."""
+
+        stats = self.load_stats()
+        timing = _TimingResult(result)
+
+        def scheduled() -> Iterator:
+            start = time.perf_counter()
+            set_up_classes = set()
+
+            for test in self.schedule(stats):
+                estimate = stats.get(test.id(), self.default_runtime)
+
+                setup_key = class_setup_id(test)
+                first_in_class = setup_key not in set_up_classes
+                if first_in_class:
+                    estimate += stats.get(setup_key, 0.0)
+
+                elapsed = time.perf_counter() - start
+                if self.budget is not None and elapsed + estimate > self.budget:
+                    yield _OutOfTime(test)
+                    continue
+
+                set_up_classes.add(setup_key)
+                timing.started = timing.stopped = None
+                before = time.perf_counter()
+
+                # TestSuite.run() sets up the class and runs the test before
+                # it asks for the next one
+                yield test
+
+                if timing.started is None or timing.stopped is None:
+                    continue  # the class fixtures failed
+
+                stats[test.id()] = timing.stopped - timing.started
+                if first_in_class:
+                    stats[setup_key] = timing.started - before
+
+        try:
+            _ScheduledRun(scheduled()).run(timing, debug)  # type: ignore
+        finally:
+            self.save_stats(stats)
+
+        return result
+
+    def schedule(self, stats: RuntimeStats) -> list:
+        """Order the tests by points per second, keeping classes together."""
+
+        def runtime(test) -> float:
+            return max(stats.get(test.id(), self.default_runtime),
+                       MIN_RUNTIME)
+
+        by_class: dict[type, list] = {}
+        for test in self._tests:
+            by_class.setdefault(type(test), []).append(test)
+
+        def test_key(test):
+            weight = weight_of(test)
+            return (-weight / runtime(test), -weight)
+
+        def class_key(tests):
+            weight = sum(weight_of(t) for t in tests)
+            setup = stats.get(class_setup_id(tests[0]), 0.0)
+            return -weight / (sum(runtime(t) for t in tests) + setup)
+
+        ordered = []
+        for tests in sorted(by_class.values(), key=class_key):
+            ordered += sorted(tests, key=test_key)
+
+        return ordered
+
+    def load_stats(self) -> RuntimeStats:
+        if not self.stats_path or not self.stats_path.exists():
+            return {}
+
+        with open(self.stats_path) as f:
+            return json.load(f)
+
+    def save_stats(self, stats: RuntimeStats) -> None:
+        if not self.stats_path:
+            return
+
+        with open(self.stats_path, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+
+
+class _ScheduledRun(unittest.TestSuite):
+    """Runs tests from an iterator, which may depend on the previous test
+    having finished."""
+
+    def __init__(self, tests: Iterator):
+        super().__init__()
+        self._scheduled = tests
+
+        # TestSuite replaces finished tests with None when _cleanup is set,
+        # which doesn't work with a generator.
+        self._cleanup = False
+
+    def __iter__(self) -> Iterator:
+        return self._scheduled
+
+
+class _TimingResult:
+    """Passes everything through to a TestResult, but notes when the current
+    test starts and stops."""
+
+    def __init__(self, result: unittest.TestResult):
+        object.__setattr__(self, '_result', result)
+        object.__setattr__(self, 'started', None)
+        object.__setattr__(self, 'stopped', None)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __setattr__(self, name, value):
+        if name in ('started', 'stopped'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._result, name, value)
+
+    def startTest(self, test):
+        self.started = time.perf_counter()
+        self._result.startTest(test)
+
+    def stopTest(self, test):
+        self._result.stopTest(test)
+        self.stopped = time.perf_counter()
+
+
+class _OutOfTime:
+    """Stands in for a test that doesn't fit in the time budget.
+
+    It is iterable so that TestSuite treats it as a suite and doesn't run the
+    class fixtures of the skipped test."""
+
+    def __init__(self, test: unittest.TestCase):
+        self.test = test
+
+    def __iter__(self):
+        return iter(())
+
+    def countTestCases(self) -> int:
+        return 1
+
+    def __call__(self, result: unittest.TestResult):
+        result.startTest(self.test)
+        result.addSkip(self.test, OUT_OF_TIME)
+        result.stopTest(self.test)
+
+
+def class_setup_id(test: unittest.TestCase) -> str:
+    """The key of a test's class fixtures in the runtime stats."""
+    cls = type(test)
+    return f'{cls.__module__}.{cls.__qualname__}.setUpClass'
+
+
+def flatten_tests(tests: Iterable) -> list:
+    """Flatten nested test suites into a list of test cases."""
+    flat = []
+    for test in tests:
+        if isinstance(test, unittest.TestSuite):
+            flat += flatten_tests(test)
+        else:
+            flat.append(test)
+
+    return flat
+
+
+def weight_of(test: unittest.TestCase) -> float:
+    """Get the weight of a test case, or 0 if it doesn't have one.
+
+    The weight is read from the `__weight__` attribute set by `@weight`,
+    then from the `weight` of a TestItem."""
+
+    method_name = getattr(test, '_testMethodName', None)
+    if not method_name:
+        return 0
+
+    attrs = [inspect.getattr_static(type(test), method_name, None),
+             getattr(test, method_name, None)]
+
+    for attr in attrs:
+        weight = getattr(attr, '__weight__', None)
+        if weight is not None:
+            return weight
+
+    for attr in attrs:
+        if isinstance(attr, TestItem):
+            try:
+                return attr.weight
+            except AttributeError:
+                pass
+
+    return 0
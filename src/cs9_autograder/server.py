@@ -0,0 +1,161 @@
+import json
+import os
+from pathlib import Path
+import socket
+import socketserver
+import tempfile
+import threading
+from typing import Any, Optional
+
+from .grading import AutograderModule, GradingResults
+from .results_db import ResultsDatabase
+
+
+DEFAULT_SOCKET_PATH = Path(tempfile.gettempdir()) / 'cs9_autograder.sock'
+
+# tests which print share the process's stdout, so by default, grade one
+# submission at a time
+DEFAULT_JOBS = 1
+
+
+class _GradingHandler(socketserver.StreamRequestHandler):
+    """Handles one connection. Each request is a line of JSON,
+    `{"submission": "<directory>"}`, and each response is a line of JSON
+    with the results, or `{"error": "<message>"}`."""
+
+    server: '_GradingServer'
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                submission = request['submission']
+            except (ValueError, KeyError, TypeError):
+                response: dict[str, Any] = {
+                        'error': 'Expected {"submission": "<directory>"}.'}
+            else:
+                response = self.server.grade(submission)
+
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class _GradingServer:
+    """Grades submissions for connections, no more than `jobs` at a time,
+    and records their results in results_db if it is set."""
+
+    autograder: AutograderModule
+    jobs: threading.BoundedSemaphore
+    results_db: Optional[ResultsDatabase] = None
+
+    def grade(self, submission: str) -> dict[str, Any]:
+        if not os.path.isdir(submission):
+            return {'error': f'`{submission}` is not a directory.'}
+
+        with self.jobs:
+            try:
+                results = self.autograder.grade(submission)
+            except Exception as e:
+                return {'error': f'{type(e).__name__}: {e}'}
+
+        # a server may run for a long time and be killed, so write every
+        # submission's results as soon as it is graded
+        if self.results_db is not None:
+            self.results_db.add(Path(submission).name, results)
+            self.results_db.flush()
+
+        return results
+
+    def close_grading(self) -> None:
+        self.autograder.close()
+        if self.results_db is not None:
+            self.results_db.close()
+
+
+class UnixGradingServer(_GradingServer,
+                        socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, autograder: AutograderModule, socket_path: Path | str,
+                 jobs: int = DEFAULT_JOBS):
+        self.autograder = autograder
+        self.jobs = threading.BoundedSemaphore(jobs)
+
+        # a server that was killed leaves its socket behind
+        socket_path = Path(socket_path)
+        if socket_path.is_socket():
+            socket_path.unlink()
+
+        super().__init__(str(socket_path), _GradingHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.close_grading()
+        Path(self.server_address).unlink(missing_ok=True)  # type: ignore
+
+
+class TCPGradingServer(_GradingServer, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, autograder: AutograderModule, port: int,
+                 jobs: int = DEFAULT_JOBS):
+        self.autograder = autograder
+        self.jobs = threading.BoundedSemaphore(jobs)
+
+        # only this machine can submit
+        super().__init__(('127.0.0.1', port), _GradingHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.close_grading()
+
+
+def make_server(autograder: Path | str | AutograderModule,
+                socket_path: Optional[Path | str] = None,
+                port: Optional[int] = None,
+                jobs: int = DEFAULT_JOBS,
+                results_db: Optional[ResultsDatabase] = None) \
+                        -> socketserver.BaseServer:
+    """Load an autograder and make a server which grades submissions with
+    it, on a Unix socket or, if port is given, on localhost.
+
+    results_db: where to record the results of every submission, by the name
+    of its directory. Each submission's results are written as soon as it is
+    graded, so they can be queried while the server runs. The server closes
+    it.
+
+    Call serve_forever() on the result to start grading."""
+
+    if not isinstance(autograder, AutograderModule):
+        autograder = AutograderModule(autograder)
+
+    server: _GradingServer
+    if port is not None:
+        server = TCPGradingServer(autograder, port, jobs)
+    else:
+        if socket_path is None:
+            socket_path = DEFAULT_SOCKET_PATH
+
+        server = UnixGradingServer(autograder, socket_path, jobs)
+
+    server.results_db = results_db
+    return server  # type: ignore
+
+
+def request_grade(submission: Path | str,
+                  socket_path: Optional[Path | str] = None,
+                  port: Optional[int] = None) -> GradingResults:
+    """Ask a running server to grade a submission directory."""
+
+    if port is not None:
+        sock = socket.create_connection(('127.0.0.1', port))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(socket_path or DEFAULT_SOCKET_PATH))
+
+    request = {'submission': os.path.realpath(submission)}
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode() + b'\n')
+        f.flush()
+        return json.loads(f.readline())
@@ -1,3 +1,6 @@
+from .importing import failed_import_for
+
+
 class TestItem:
     """An item inside of the autograder"""
     __test__ = False  # tell pytest this isn't a real unit test.
@@ -46,6 +49,19 @@ class TestItem:
                              f'self.instance is {self.instance}; '
                              f'self.owner is {self.owner}.')
 
+    def skip_if_import_failed(self, test_case) -> None:
+        """Skip the test if the student module that it uses failed to
+        import, before any of its code runs."""
+        try:
+            student = self.student
+        except AttributeError:
+            return
+
+        failed = failed_import_for(student)
+        if failed:
+            test_case.skipTest(f'`{failed.filename}` could not be imported. '
+                               'See test_student_imports for details.')
+
     def __set_name__(self, owner, name):
         self.owner = owner
 
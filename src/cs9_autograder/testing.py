@@ -1,19 +1,33 @@
 from __future__ import annotations
 
-from collections.abc import Iterable
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-import json
+from enum import Enum
 import os
 from pathlib import Path
+import shutil
 import subprocess
-from tempfile import NamedTemporaryFile
-from typing import Any, cast, Optional, TextIO
+from tempfile import TemporaryDirectory
+from types import ModuleType
+from typing import Any, Optional
 
 from .formatting import h_rule
 from .importing import submission_path, module_to_path, path_to_module
-from .testing_report import (CoverageReport, RawCoverageReport,
-                             RawTestingReport,
-                             TestingReport)
+from .testing_report import CoverageReport, TestingReport
+
+
+# a correct module, or the path of its file
+Solution = ModuleType | Path | str
+
+
+def solution_file(solution: Solution) -> Path | str:
+    if isinstance(solution, ModuleType):
+        return solution.__file__ or ''
+
+    return solution
 
 
 class t_coverage:
@@ -23,7 +37,16 @@ class t_coverage:
 
     def __get__(self, instance, owner):
         def coverage_runner():
+            owner._wait_for_tests_and_coverage()
             cov = owner.cov_report.modules[self.module_name]
+
+            if (not cov.imported
+                    and owner.coverage_policy == CoveragePolicy.IF_PASSED
+                    and not all(report.success for report
+                                in owner.testing_reports.values())):
+                instance.fail('Coverage is only measured once your tests '
+                              'pass.')
+
             instance.assertTrue(cov.imported)
             instance.assertFalse(cov.missing_lines)
 
@@ -31,85 +54,342 @@ class t_coverage:
 
 
 class t_module:
-    def __init__(self, module_name: str):
+    def __init__(self, module_name: str,
+                 reference: Optional[Mapping[str, Solution]] = None):
+        """reference: the correct version of each student module that the
+        tests import, e.g. `{'lab01': lab01_solution}`. The tests are also
+        run against these, at the same time, and fail if any of them fails
+        there, since then it expects the wrong behaviour."""
         self.module_name = module_name
+        self.reference = dict(reference) if reference else None
 
     def __get__(self, instance, owner):
         def test_runner():
-            instance.assertTrue(owner.testing_report.success)
+            owner._wait_for_tests_and_coverage()
+            report = owner.testing_reports[self.module_name]
+
+            if report.reference and report.reference.failed_tests:
+                print('These tests fail on a correct implementation, so '
+                      'they expect the wrong behaviour:')
+                for test in sorted(report.reference.failed_tests):
+                    print(f'  {test}')
+                instance.fail()
+
+            instance.assertTrue(report.success)
 
         return test_runner
 
 
-def run_unit_tests_and_coverage(test_module: str,
-                                cov_modules: Optional[Iterable[str]],
-                                search_path: Path | str) -> \
-                                        Tuple[TestingReport,
-                                              Optional[CoverageReport]]:
+# how many of the slowest tests to show when a test module is over its budget
+SLOWEST_TESTS = 5
+
+
+class t_time_budget:
+    """A class descriptor which generates a test that the student's tests in
+    a test module don't take longer than budget seconds in total.
+
+    warn: only print a warning (with the slowest tests) instead of failing"""
+    def __init__(self, module_name: str, budget: float, warn: bool = False):
+        self.module_name = module_name
+        self.budget = budget
+        self.warn = warn
+
+    def __get__(self, instance, owner):
+        def time_budget_runner():
+            owner._wait_for_tests_and_coverage()
+            report = owner.testing_reports[self.module_name]
+            if report.duration <= self.budget:
+                return
+
+            print(f'Your tests in `{self.module_name}` took '
+                  f'{report.duration:.2f}s, but they should take at most '
+                  f'{self.budget:.2f}s. The slowest ones were:')
+            for test in report.slowest(SLOWEST_TESTS):
+                print(f'  {test.node_id}: {test.duration:.2f}s')
+
+            if not self.warn:
+                instance.fail()
+
+        return time_budget_runner
+
+
+class CoveragePolicy(Enum):
+    """When to measure the coverage of the student's tests, which slows them
+    down."""
+
+    # in the only run of each test module
+    ALWAYS = 'always'
+
+    # run each test module without coverage, and again with coverage only if
+    # it passed. A test module that fails counts as covering nothing.
+    IF_PASSED = 'if_passed'
+
+    # run each test module with and without coverage at the same time, so
+    # that its pass/fail result is ready as soon as possible
+    PARALLEL = 'parallel'
+
+
+# most students' tests pass, so running them twice would cost more than the
+# coverage saves on the ones that fail
+DEFAULT_COVERAGE_POLICY = CoveragePolicy.ALWAYS
+
+
+def run_unit_tests_and_coverage(
+        test_modules: Iterable[str], cov_modules: Optional[Iterable[str]],
+        search_path: Path | str, max_workers: Optional[int] = None,
+        references: Optional[Mapping[str, Mapping[str, Solution]]] = None,
+        coverage_policy: CoveragePolicy = DEFAULT_COVERAGE_POLICY,
+        keep_raw: bool = False) \
+                -> tuple[dict[str, TestingReport], Optional[CoverageReport]]:
+    """Run every test module in its own pytest process.
+
+    The pytest processes run concurrently (at most `max_workers` at a time,
+    which defaults to the number of cores). Coverage is measured as
+    coverage_policy says, and merged, so a line only counts as missing if no
+    test module executed it.
+
+    references: for some of the test modules, the correct version of each
+    student module that they import. Those test modules are also run against
+    the correct versions (without coverage), concurrently with the other
+    runs, and the report is stored in their testing report's `reference`.
+    keep_raw: keep every record of pytest's logs in the testing reports'
+    raw_report
+
+    returns a testing report for each test module and the merged coverage
+    report"""
+
+    test_modules = list(test_modules)
+    cov_modules = set(cov_modules) if cov_modules else set()
+    references = references or {}
+
+    if not cov_modules:
+        coverage_policy = CoveragePolicy.ALWAYS
+
+    jobs = len(test_modules) + len(references)
+    if coverage_policy == CoveragePolicy.PARALLEL:
+        jobs += len(test_modules)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, jobs))
 
-    file_name = module_to_path(test_module, search_path)
-    stdout, raw_report, raw_cov = run_pytest(file_name,
-                                             cov_modules=cov_modules)
+    def run_once(test_module: str, measure: bool) \
+            -> tuple[TestingReport, CoverageReport]:
+        file_name = module_to_path(test_module, search_path)
+        testing_report, cov_report = run_pytest(
+                file_name, cov_modules=cov_modules if measure else None,
+                cwd=search_path, keep_raw=keep_raw)
 
-    testing_report = TestingReport.from_raw(stdout, raw_report)
+        if cov_report is None:  # nothing is imported when nothing is measured
+            cov_report = CoverageReport.build_report(cov_modules, None,
+                                                     search_path)
 
-    cov_report = CoverageReport.build_report(
-            cov_modules, raw_cov, search_path)
+        return testing_report, cov_report
 
-    return testing_report, cov_report
+    def run(test_module: str) -> tuple[TestingReport, CoverageReport]:
+        if coverage_policy == CoveragePolicy.ALWAYS:
+            return run_once(test_module, measure=True)
+
+        testing_report, cov_report = run_once(test_module, measure=False)
+        if (coverage_policy == CoveragePolicy.IF_PASSED
+                and testing_report.success):
+            _, cov_report = run_once(test_module, measure=True)
+
+        return testing_report, cov_report
+
+    def run_reference(test_module: str) -> TestingReport:
+        file_name = module_to_path(test_module, search_path)
+        with import_overlay(references[test_module]) as overlay:
+            testing_report, _ = run_pytest(file_name, cwd=search_path,
+                                           overlay=overlay, keep_raw=keep_raw)
+
+        return testing_report
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # start the reference and parallel coverage runs first, so that they
+        # run alongside the others instead of after them
+        reference_futures = {mod: executor.submit(run_reference, mod)
+                             for mod in test_modules if mod in references}
+
+        cov_futures = []
+        if coverage_policy == CoveragePolicy.PARALLEL:
+            cov_futures = [executor.submit(run_once, mod, True)
+                           for mod in test_modules]
+
+        results = list(executor.map(run, test_modules))
+
+    testing_reports = {mod: testing_report
+                       for mod, (testing_report, _) in zip(test_modules,
+                                                           results)}
+    for mod, future in reference_futures.items():
+        testing_reports[mod].reference = future.result()
+
+    if cov_futures:
+        results = [future.result() for future in cov_futures]
+
+    cov_report = CoverageReport.merge(cov_report for _, cov_report in results)
+
+    return testing_reports, cov_report
+
+
+@contextmanager
+def import_overlay(modules: Mapping[str, Solution]) -> Iterator[Path]:
+    """A temporary directory with a copy of each module's file, under the
+    given module name. Pass it as run_pytest's overlay to have the tests
+    import those modules instead of the student's."""
+    with TemporaryDirectory() as overlay:
+        for name, solution in modules.items():
+            shutil.copyfile(solution_file(solution),
+                            Path(overlay) / f'{name}.py')
+
+        yield Path(overlay)
+
+
+def overlay_env(overlay: Path | str) -> dict[str, str]:
+    """The environment for a pytest process which imports the modules in
+    overlay instead of the submission's.
+
+    pytest must also get OVERLAY_ARGS, or it puts the test file's directory
+    in front of the overlay."""
+    python_path = os.pathsep.join(
+            filter(None, [str(overlay), os.environ.get('PYTHONPATH')]))
+
+    # different versions of a module can have the same name, size and mtime,
+    # so don't let them reuse each other's bytecode
+    return dict(os.environ, PYTHONPATH=python_path,
+                PYTHONDONTWRITEBYTECODE='1')
+
+
+# the submission's directory is still searched (after the overlay), so the
+# tests can import the student's other modules
+OVERLAY_ARGS = ['--import-mode=append']
+
+
+# how much of the start and of the end of pytest's output is kept
+OUTPUT_LIMIT = 64 * 1024
+
+# how much of pytest's output is read at a time
+OUTPUT_CHUNK_SIZE = 8192
+
+# the tests' output goes straight to pytest's (limited) stdout. Captured, it
+# would also be in the report log's record of each failed test, whole.
+CAPTURE_ARGS = ['--capture=no']
+
+
+class OutputBuffer:
+    """Keeps the first and last `limit` characters of the text written to
+    it, so that a test which prints forever doesn't use up the memory."""
+
+    def __init__(self, limit: int = OUTPUT_LIMIT):
+        self.limit = limit
+        self.skipped = 0
+        self._head: list[str] = []
+        self._head_size = 0
+        self._tail: deque[str] = deque()
+        self._tail_size = 0
+
+    def write(self, text: str) -> None:
+        if self._head_size < self.limit:
+            head = text[:self.limit - self._head_size]
+            self._head.append(head)
+            self._head_size += len(head)
+            text = text[len(head):]
+
+        if not text:
+            return
+
+        self._tail.append(text)
+        self._tail_size += len(text)
+
+        while self._tail_size - len(self._tail[0]) >= self.limit:
+            dropped = self._tail.popleft()
+            self._tail_size -= len(dropped)
+            self.skipped += len(dropped)
+
+        excess = self._tail_size - self.limit
+        if excess > 0:
+            self._tail[0] = self._tail[0][excess:]
+            self._tail_size -= excess
+            self.skipped += excess
+
+    def getvalue(self) -> str:
+        skipped = (f'\n[... {self.skipped} characters skipped ...]\n'
+                   if self.skipped else '')
+        return ''.join(self._head) + skipped + ''.join(self._tail)
+
+
+def run_captured(args: list[str], cwd: Path | str,
+                 env: Optional[dict[str, str]] = None) -> str:
+    """Run a command and return the start and end of its stdout (see
+    OutputBuffer). It gets no stdin, and its stderr is thrown away."""
+    output = OutputBuffer()
+    with subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, text=True,
+                          errors='replace', cwd=cwd, env=env) as process:
+        assert process.stdout is not None
+        while chunk := process.stdout.read(OUTPUT_CHUNK_SIZE):
+            output.write(chunk)
+
+    return output.getvalue()
 
 
 def run_pytest(test_file: Path | str,
-               cov_modules: Optional[Iterable[str]] = None)\
-                       -> tuple[str, RawTestingReport,
-                                Optional[RawCoverageReport]]:
+               cov_modules: Optional[Iterable[str]] = None,
+               cwd: Optional[Path | str] = None,
+               overlay: Optional[Path | str] = None,
+               keep_raw: bool = False)\
+                       -> tuple[TestingReport, Optional[CoverageReport]]:
 
     """Run pytest
-    Note that the raw coverage report MAY still be none even if you have
-    supplied modules to test
 
-    returns captured stdout, raw log, and raw covrage report"""
+    Every run gets its own coverage data file and no pytest cache, so several
+    runs can safely share the same working directory at the same time.
+    Coverage is read straight from the data file, instead of from a report
+    that pytest-cov renders.
+
+    overlay: a directory (see import_overlay) whose modules are imported
+    instead of the submission's
+    keep_raw: also keep every record of pytest's log in the testing report's
+    raw_report. Otherwise, only what the report needs is kept.
 
-    with NamedTemporaryFile(mode='w+', delete_on_close=False) as log_file:
-        with NamedTemporaryFile(mode='w+', delete_on_close=False) as cov_report_file:
+    returns the testing report, and the coverage report if cov_modules were
+    given"""
 
-            args = ['pytest', f'--report-log={log_file.name}']
+    if cwd is None:
+        cwd = submission_path()
 
-            if cov_modules:
-                cov_mod_args = [f'--cov={m}' for m in cov_modules]
-                args += cov_mod_args
+    with TemporaryDirectory() as tmp_dir:
+        log_path = Path(tmp_dir) / 'report.jsonl'
+        data_path = Path(tmp_dir) / '.coverage'
 
-                args.append(f'--cov-report=json:{cov_report_file.name}')
+        args = ['pytest', f'--report-log={log_path}', '-p', 'no:cacheprovider',
+                *CAPTURE_ARGS]
 
-            args.append(str(test_file))
+        if cov_modules:
+            cov_mod_args = [f'--cov={m}' for m in cov_modules]
+            args += cov_mod_args
 
-            result = subprocess.run(
-                    args, capture_output=True, text=True,
-                    cwd=submission_path())
+            # only write the data file
+            args.append('--cov-report=')
 
-            # the cast is just here to please mypy
-            raw_report = parse_jsonl(cast(TextIO, log_file))
+        env = overlay_env(overlay) if overlay else dict(os.environ)
+        if overlay:
+            args += OVERLAY_ARGS
 
-            raw_cov = None
-            if cov_modules and not is_file_empty(cast(TextIO, cov_report_file)):
-                raw_cov = json.load(cov_report_file)
+        args.append(str(test_file))
 
-            return result.stdout, raw_report, raw_cov
+        env['COVERAGE_FILE'] = str(data_path)
 
+        stdout = run_captured(args, cwd, env)
 
-def parse_jsonl(f: TextIO) -> list:
-    """Parse a jsonl file into a list of Python objects"""
-    data = []
-    for line in f:
-        data.append(json.loads(line))
+        with open(log_path) as log_file:
+            testing_report = TestingReport.from_log(stdout, log_file,
+                                                    keep_raw=keep_raw)
 
-    return data
+        cov_report = None
+        if cov_modules:
+            cov_report = CoverageReport.from_data(cov_modules, data_path, cwd)
 
+        return testing_report, cov_report
 
-def is_file_empty(f: TextIO) -> bool:
-    """Check if a file has a size of 0."""
-    f.seek(0, os.SEEK_END)
-    if not f.tell():
-        return True
-    f.seek(0)
-    return False
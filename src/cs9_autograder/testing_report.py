@@ -1,8 +1,13 @@
 from collections.abc import Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import functools
+import json
+import os
 from pathlib import Path
 from typing import Optional, TextIO
 
+import coverage
+
 from .importing import path_to_module
 
 
@@ -12,50 +17,135 @@ RawTestingReport = list[dict]
 RawCoverageReport = dict
 
 
+# the files which configure coverage for a project, as pytest-cov finds them
+# (it also reads setup.cfg, tox.ini and pyproject.toml, which aren't
+# supported here)
+COVERAGE_CONFIG_FILES = ('.coveragerc', '.coveragerc.toml')
+
+
+def coverage_config_file(search_path: Path | str) -> Optional[Path]:
+    """The file which configures coverage in a directory, if any."""
+    for name in COVERAGE_CONFIG_FILES:
+        path = Path(search_path) / name
+        if path.is_file():
+            return path
+
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _missing_lines(file_name: str, mtime_ns: int, size: int,
+                   config_file: Optional[str], config_mtime_ns: int,
+                   executed: frozenset[int]) -> frozenset[int]:
+    """Analyze a file as coverage does. The versions of the file and the
+    configuration are part of the key, so a changed file is analyzed
+    again."""
+    cov = coverage.Coverage(data_file=None,
+                            config_file=config_file or False)
+    cov.get_data().add_lines({file_name: executed})
+    _, _, _, missing, _ = cov.analysis2(file_name)
+    return frozenset(missing)
+
+
+@dataclass(slots=True)
+class TestOutcome:
+    """How one of the student's tests went, by phase (setup, call and
+    teardown)."""
+    node_id: str
+    outcomes: dict[str, str] = field(default_factory=dict)
+    durations: dict[str, float] = field(default_factory=dict)
+
+    __test__ = False  # tell pytest to ignore this class during test discovery
+
+    @property
+    def outcome(self) -> str:
+        """'failed' if any phase failed, otherwise 'skipped' if any phase was
+        skipped, otherwise 'passed'."""
+        outcomes = self.outcomes.values()
+        for outcome in ('failed', 'skipped'):
+            if outcome in outcomes:
+                return outcome
+
+        return 'passed'
+
+    @property
+    def duration(self) -> float:
+        """The total time of every phase, in seconds."""
+        return sum(self.durations.values())
+
+
 @dataclass
 class TestingReport:
     success: bool  # whether the test suite was successful
     pretty: str  # the text returned to the console
     failed_tests: set[str]  # a list of failed tests
-    raw_report: list[dict]  # the JSON log file
+
+    # the JSON log file, if it was kept
+    raw_report: Optional[list[dict]] = None
+
+    # every test, by node id, in the order they ran
+    tests: dict[str, TestOutcome] = field(default_factory=dict)
+
+    # the same tests, run against the correct implementation (see t_module)
+    reference: Optional["TestingReport"] = None
 
     __test__ = False  # tell pytest to ignore this class during test discovery
 
     @classmethod
     def from_raw(cls, captured_stdout: str, raw_report: list[dict]) -> "TestingReport":
-        success = cls.read_success(raw_report)
-        pretty = captured_stdout
-        failed_tests = cls.read_failed_tests(raw_report)
+        report = cls.from_records(captured_stdout, raw_report)
+        report.raw_report = raw_report
+        return report
+
+    @classmethod
+    def from_log(cls, captured_stdout: str, log_file: TextIO,
+                 keep_raw: bool = False) -> "TestingReport":
+        """Read pytest's JSON log a line at a time, only keeping what the
+        report needs, unless keep_raw."""
+        records = map(json.loads, log_file)
+        if not keep_raw:
+            return cls.from_records(captured_stdout, records)
+
+        return cls.from_raw(captured_stdout, list(records))
+
+    @classmethod
+    def from_records(cls, captured_stdout: str,
+                     records: Iterable[dict]) -> "TestingReport":
+        success = None
+        failed_tests = set()
+        tests: dict[str, TestOutcome] = {}
+
+        for record in records:
+            if success is None and 'exitstatus' in record:
+                success = record['exitstatus'] == 0
 
-        return cls(success, pretty, failed_tests, raw_report)
+            node_id = record.get('nodeid')
+            if node_id and record.get('outcome') == 'failed':
+                failed_tests.add(node_id)
 
-    @staticmethod
-    def read_success(log: list[dict]) -> bool:
-        for line in log:
-            try:
-                return line['exitstatus'] == 0
-            except KeyError:
-                pass
+            if record.get('$report_type') == 'TestReport':
+                test = tests.get(node_id)
+                if test is None:
+                    test = tests[node_id] = TestOutcome(node_id)
 
-        raise ValueError("Cannot find exitstatus in pytest log.")
+                test.outcomes[record['when']] = record['outcome']
+                test.durations[record['when']] = record['duration']
 
-    @staticmethod
-    def read_failed_tests(log: list[dict]) -> set[str]:
-        failed = set()
-        for line in log:
-            try:
-                node_id = line['nodeid']
-                outcome = line['outcome']
-            except KeyError:
-                continue
+        if success is None:
+            raise ValueError("Cannot find exitstatus in pytest log.")
 
-            if not node_id:
-                continue
+        return cls(success, captured_stdout, failed_tests, tests=tests)
 
-            if outcome == 'failed':
-                failed.add(node_id)
+    @property
+    def duration(self) -> float:
+        """The total time of every test, in seconds. This doesn't include
+        starting pytest and collecting the tests."""
+        return sum(test.duration for test in self.tests.values())
 
-        return failed
+    def slowest(self, n: int) -> list[TestOutcome]:
+        """The n tests which took the longest, slowest first."""
+        return sorted(self.tests.values(), key=lambda test: test.duration,
+                      reverse=True)[:n]
 
 
 @dataclass
@@ -101,3 +191,65 @@ class CoverageReport:
             modules[mod] = ModuleCoverage(imported=False, missing_lines=None)
 
         return cls(modules)
+
+    @classmethod
+    def from_data(cls, cov_modules: Iterable[str],
+                  data_file: Path | str,
+                  search_path: Path | str) -> "CoverageReport":
+        """Build a report from coverage's data file, including modules
+        listed but not imported, without rendering a report.
+
+        search_path: root path of the modules, which is also where the
+        tests ran, so its coverage configuration applies. The analysis of
+        each version of a file is cached."""
+
+        search_path = Path(search_path).resolve()
+        cov_modules = set(cov_modules)
+        modules = {}
+
+        config_file = coverage_config_file(search_path)
+        config_mtime_ns = (config_file.stat().st_mtime_ns
+                           if config_file is not None else 0)
+
+        if os.path.exists(data_file):
+            data = coverage.CoverageData(str(data_file))
+            data.read()
+
+            for file_name in data.measured_files():
+                mod_name = path_to_module(file_name, search_path)
+                stat = os.stat(file_name)
+                missing_lines = _missing_lines(
+                        file_name, stat.st_mtime_ns, stat.st_size,
+                        str(config_file) if config_file else None,
+                        config_mtime_ns,
+                        frozenset(data.lines(file_name) or ()))
+
+                modules[mod_name] = ModuleCoverage(
+                        imported=True, missing_lines=set(missing_lines))
+
+        for mod in cov_modules - modules.keys():
+            modules[mod] = ModuleCoverage(imported=False, missing_lines=None)
+
+        return cls(modules)
+
+    @classmethod
+    def merge(cls, reports: Iterable["CoverageReport"]) -> "CoverageReport":
+        """Merge the coverage reports of several test runs.
+
+        A module is imported if any run imported it, and a line is only
+        missing if it was missing in every run that imported the module."""
+
+        modules: dict[str, ModuleCoverage] = {}
+        for report in reports:
+            for mod_name, cov in report.modules.items():
+                merged = modules.get(mod_name)
+
+                if merged is None or not merged.imported:
+                    modules[mod_name] = cov
+
+                elif cov.imported:
+                    missing_lines = merged.missing_lines & cov.missing_lines
+                    modules[mod_name] = ModuleCoverage(
+                            imported=True, missing_lines=missing_lines)
+
+        return cls(modules)
@@ -0,0 +1,160 @@
+from collections.abc import Callable
+import contextvars
+import ctypes
+import signal
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+
+# the smallest time limit we give the student when the time limit is based on
+# the runtime of the correct implementation
+DEFAULT_TIMEOUT_FLOOR = 0.5
+
+# how long we keep trying to stop a timed out watchdog thread before we give
+# up on it, and how often we try
+INTERRUPT_PERIOD = 2.0
+INTERRUPT_INTERVAL = 0.01
+
+
+class StudentTimeout(BaseException):
+    """Raised when the student's code runs past its time limit.
+
+    This is a BaseException so that a student's `except Exception:` doesn't
+    swallow it."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        if timeout is None:  # raised asynchronously in a watchdog thread
+            super().__init__('Timed out.')
+        else:
+            super().__init__(f'Timed out after {timeout:.2f} seconds.')
+
+        self.timeout = timeout
+
+
+def time_limit(reference_time: float,
+               timeout: Optional[float] = None,
+               timeout_factor: Optional[float] = None,
+               timeout_floor: float = DEFAULT_TIMEOUT_FLOOR) -> Optional[float]:
+    """Work out how long the student gets.
+
+    reference_time: how long the correct implementation took on the same
+    inputs
+    timeout: a fixed time limit in seconds
+    timeout_factor: give the student this multiple of reference_time, but no
+    less than timeout_floor
+
+    If both timeout and timeout_factor are given, the smaller limit wins.
+    Returns None if there is no time limit."""
+
+    limits = []
+    if timeout is not None:
+        limits.append(timeout)
+
+    if timeout_factor is not None:
+        limits.append(max(timeout_floor, timeout_factor * reference_time))
+
+    return min(limits) if limits else None
+
+
+def run_with_timeout(func: Callable[[], Any],
+                     timeout: Optional[float]) -> Any:
+    """Call func and return its result, raising StudentTimeout if it runs for
+    longer than timeout seconds.
+
+    In the main thread, SIGALRM interrupts func where it is. Anywhere else,
+    func runs in a watchdog thread. If it runs too long, StudentTimeout is
+    raised asynchronously in the thread, between two bytecodes, until the
+    thread stops.
+
+    Limitation: an asynchronous exception can't interrupt a single long call
+    into C (e.g. `time.sleep(1000)` or `sum(range(10**12))`). The thread is
+    then abandoned after INTERRUPT_PERIOD seconds and keeps running in the
+    background, and until it gets back to Python code, the exception that is
+    still pending in it makes every other thread a little slower. func isn't
+    run in a subprocess, because its result and its side effects on the
+    objects it was given (which may be student classes that can't be
+    pickled) have to stay in this process."""
+
+    if timeout is None:
+        return func()
+
+    if (hasattr(signal, 'setitimer')
+            and threading.current_thread() is threading.main_thread()):
+        return _run_with_alarm(func, timeout)
+
+    return _run_in_thread(func, timeout)
+
+
+def _run_with_alarm(func: Callable[[], Any], timeout: float) -> Any:
+    def handler(signum, frame):
+        raise StudentTimeout(timeout)
+
+    start = time.monotonic()
+    old_handler = signal.signal(signal.SIGALRM, handler)
+    old_delay, _ = signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        return func()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+        # put back any alarm that was already running
+        if old_delay:
+            remaining = old_delay - (time.monotonic() - start)
+            signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-3))
+
+
+def _run_in_thread(func: Callable[[], Any], timeout: float) -> Any:
+    result: dict[str, Any] = {}
+
+    # the thread may redirect them (e.g. the student's code, or the first
+    # ignore_prints, which wraps stdout) and never get to put them back
+    stdout, stderr = sys.stdout, sys.stderr
+
+    def target():
+        try:
+            result['value'] = func()
+        except BaseException as e:
+            result['error'] = e
+
+    # a daemon thread won't keep the grader alive if the student never stops.
+    # It runs in a copy of our context so that it sees our grading context.
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+
+    if thread.is_alive():
+        sys.stdout, sys.stderr = stdout, stderr
+        _interrupt_in_background(thread)
+        raise StudentTimeout(timeout)
+
+    if 'error' in result:
+        raise result['error']
+
+    return result['value']
+
+
+def _interrupt_in_background(thread: threading.Thread) -> None:
+    """Keep raising StudentTimeout in thread until it stops, in case the
+    student catches it, without making the caller wait."""
+
+    def interrupt():
+        deadline = time.monotonic() + INTERRUPT_PERIOD
+        while thread.is_alive() and time.monotonic() < deadline:
+            _raise_in_thread(thread, StudentTimeout)
+            thread.join(INTERRUPT_INTERVAL)
+
+    threading.Thread(target=interrupt, daemon=True).start()
+
+
+def _raise_in_thread(thread: threading.Thread,
+                     exception: type[BaseException]) -> None:
+    if thread.ident is None:
+        return
+
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident),
+                                               ctypes.py_object(exception))
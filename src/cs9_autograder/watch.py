@@ -0,0 +1,213 @@
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import time
+from typing import Optional, TextIO
+
+from .grading import AutograderModule, GradingResults
+from .incremental import IncrementalState
+
+
+# how often PollingWatcher checks the files
+POLL_INTERVAL = 0.2
+
+# after the first change, how long to wait for more before grading, since
+# editors often write a file in several steps
+DEBOUNCE = 0.05
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE \
+        | _IN_DELETE
+
+_EVENT = struct.Struct('iIII')
+
+
+def _watched(name: str) -> bool:
+    return name.endswith('.py')
+
+
+def _directories(roots: list[Path]) -> list[Path]:
+    """The roots and every directory under them, except caches and hidden
+    directories."""
+    directories = []
+    for root in roots:
+        for directory, subdirectories, _ in os.walk(root):
+            subdirectories[:] = [d for d in subdirectories
+                                 if not d.startswith(('.', '__'))]
+            directories.append(Path(directory))
+
+    return directories
+
+
+class PollingWatcher:
+    """Notices changes to .py files by checking their mtimes."""
+
+    def __init__(self, roots: list[Path], interval: float = POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self._mtimes = self._scan()
+
+    def _scan(self) -> dict[str, int]:
+        mtimes = {}
+        for directory in _directories(self.roots):
+            for entry in os.scandir(directory):
+                if _watched(entry.name) and entry.is_file():
+                    mtimes[entry.path] = entry.stat().st_mtime_ns
+
+        return mtimes
+
+    def wait(self, timeout: Optional[float] = None) -> set[str]:
+        """Block until some files change, and return their names, or return
+        an empty set after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtimes = self._scan()
+            changed = {f for f in mtimes.keys() | self._mtimes.keys()
+                       if mtimes.get(f) != self._mtimes.get(f)}
+            self._mtimes = mtimes
+
+            if changed:
+                return changed
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Notices changes to .py files with Linux's inotify, without polling."""
+
+    def __init__(self, roots: list[Path]):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self._directories: dict[int, str] = {}
+        for directory in _directories(roots):
+            wd = self._libc.inotify_add_watch(
+                    self._fd, os.fsencode(directory), _IN_MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(),
+                              f'Cannot watch `{directory}`')
+            self._directories[wd] = str(directory)
+
+    def _read(self) -> set[str]:
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+
+                if _watched(name) and wd in self._directories:
+                    changed.add(os.path.join(self._directories[wd], name))
+
+    def wait(self, timeout: Optional[float] = None) -> set[str]:
+        """Block until some files change, and return their names, or return
+        an empty set after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (None if deadline is None
+                         else max(deadline - time.monotonic(), 0))
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return set()
+
+            changed = self._read()
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+Watcher = PollingWatcher | InotifyWatcher
+
+
+def make_watcher(roots: list[Path]) -> Watcher:
+    """Use inotify if we can, otherwise poll."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):  # no inotify in libc
+            pass
+
+    return PollingWatcher(roots)
+
+
+class WatchSession:
+    """Grades a submission again whenever it or the autograder changes.
+
+    The autograder stays loaded, only the modules which changed are
+    reloaded, and only the tests which the change affects are run again."""
+
+    def __init__(self, autograder: Path | str, submission: Path | str,
+                 out: TextIO = sys.stdout):
+        self.autograder = AutograderModule(autograder)
+        self.submission = Path(submission)
+        self.state = IncrementalState()
+        self.out = out
+
+    def grade(self) -> GradingResults:
+        start = time.perf_counter()
+        results = self.autograder.grade(self.submission, self.state)
+        elapsed = time.perf_counter() - start
+
+        print(format_results(results, elapsed), file=self.out, flush=True)
+        return results
+
+    def run(self, watcher: Optional[Watcher] = None) -> None:
+        """Grade, then grade again after every change, until interrupted."""
+        if watcher is None:
+            watcher = make_watcher([self.autograder.path.parent,
+                                    self.submission])
+
+        try:
+            self.grade()
+            while True:
+                changed = watcher.wait()
+                while changed:
+                    changed = watcher.wait(DEBOUNCE)
+
+                self.grade()
+        finally:
+            watcher.close()
+            self.autograder.close()
+
+
+def format_results(results: GradingResults, elapsed: float) -> str:
+    lines = []
+    for test in results['tests']:
+        lines.append(f"{test['status'].upper():8}{test['name']}")
+        if test['status'] in ('failed', 'error'):
+            lines.append(test['output'].rstrip())
+
+    lines.append(f"Score: {results['score']}/{results['max_score']} "
+                 f"({len(results['tests']) - results['reused']} tests run "
+                 f"in {elapsed:.2f}s)")
+    return '\n'.join(lines)
@@ -0,0 +1,5 @@
+from unfinished import first
+
+
+def test_first():
+    assert first() == 1
@@ -0,0 +1,18 @@
+from cs9_autograder import Autograder, d_returned, student_import, weight
+
+import lab_solution
+
+with student_import(lazy=True):
+    import lab
+
+
+class Grader(Autograder):
+    @weight(2)
+    @d_returned(lab_solution.double, lab.double)
+    def test_double(self, fn):
+        return fn(21)
+
+    @weight(1)
+    @d_returned(lab_solution.double, lab.double)
+    def test_double_zero(self, fn):
+        return fn(0)
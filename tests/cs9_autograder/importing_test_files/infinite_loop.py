@@ -0,0 +1,4 @@
+while True:
+    pass
+
+VALUE = 1
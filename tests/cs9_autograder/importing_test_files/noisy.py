@@ -0,0 +1,6 @@
+from working import hello_world
+
+for i in range(10):
+    print('leftover debugging print', i)
+
+VALUE = hello_world()
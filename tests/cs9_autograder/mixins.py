@@ -47,7 +47,7 @@ SubmissionPathConfig = tuple[Optional[Path], Optional[str]]
 
 def get_submission_path_config() -> SubmissionPathConfig:
     """Save the student submission path so we can restore it later."""
-    global_path = importing._SUBMISSION_PATH
+    global_path = importing.current_grading_context().submission_path
     try:
         env_path = os.environ['SUBMISSION_PATH']
     except KeyError:
@@ -58,7 +58,7 @@ def get_submission_path_config() -> SubmissionPathConfig:
 
 def restore_submission_path_config(config: SubmissionPathConfig):
     global_path, env_path = config
-    importing._SUBMISSION_PATH = global_path
+    importing.current_grading_context().submission_path = global_path
 
     if env_path is None:
         try:
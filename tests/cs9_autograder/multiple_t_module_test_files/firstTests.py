@@ -0,0 +1,4 @@
+from two_functions import first
+
+def test_first():
+    assert first() == 1
@@ -0,0 +1,4 @@
+from two_functions import second
+
+def test_second():
+    assert second() == 2
@@ -0,0 +1,7 @@
+from two_functions import first, second
+
+def test_first():
+    assert first() == 1
+
+def test_second():
+    assert second() == 3
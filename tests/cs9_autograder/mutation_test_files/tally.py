@@ -0,0 +1,6 @@
+def total(items):
+    return sum(items)
+
+
+def count_above(items, limit):
+    return len([item for item in items if item > limit])
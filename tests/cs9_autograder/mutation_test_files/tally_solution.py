@@ -0,0 +1,13 @@
+def total(items):
+    result = 0
+    for item in items:
+        result += item
+    return result
+
+
+def count_above(items, limit):
+    count = 0
+    for item in items:
+        if item > limit:
+            count += 1
+    return count
@@ -0,0 +1,11 @@
+from tally import count_above, total
+
+
+def test_total():
+    assert total([1, 2, 3]) == 6
+    assert total([]) == 0
+
+
+def test_count_above():
+    assert count_above([1, 5, 3, 7], 3) == 2
+    assert count_above([], 3) == 0
@@ -0,0 +1,9 @@
+from tally import count_above, total
+
+
+def test_total():
+    total([1, 2, 3])
+
+
+def test_count_above():
+    assert count_above([1, 5, 3, 7], 3) >= 0
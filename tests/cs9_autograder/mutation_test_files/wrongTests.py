@@ -0,0 +1,5 @@
+from tally import total
+
+
+def test_total():
+    assert total([1, 2, 3]) == 7
@@ -0,0 +1,5 @@
+def test_loud():
+    for i in range(100_000):
+        print(f'line {i}')
+
+    assert False
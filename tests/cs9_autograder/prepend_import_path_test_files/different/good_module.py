@@ -1,2 +1,5 @@
 def good_function():
     return True
+
+
+NAME = 'different'
@@ -0,0 +1,6 @@
+def rectangle(width, height):
+    return width * height
+
+
+def triangle(base, height):
+    return base * height
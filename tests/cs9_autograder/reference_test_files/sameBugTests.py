@@ -0,0 +1,9 @@
+from area import rectangle, triangle
+
+
+def test_rectangle():
+    assert rectangle(2, 3) == 6
+
+
+def test_triangle():
+    assert triangle(2, 3) == 6
@@ -0,0 +1,417 @@
+"""Test the comparison of return values"""
+from functools import partial
+import itertools
+import math
+import time
+import unittest
+from unittest import TestCase
+
+from cs9_autograder import Autograder, d_method, d_returned, d_structure
+from cs9_autograder import comparison
+from cs9_autograder.comparison import (first_difference, multiset_difference,
+                                       numeric_difference, stream_difference,
+                                       structure_difference)
+
+from .mixins import TestTester
+
+
+class TestFirstDifference(TestCase):
+    def test_equal(self):
+        self.assertIsNone(first_difference([1, {'a': (2, 3)}],
+                                           [1, {'a': (2, 3)}]))
+
+    def test_nested_path(self):
+        expected = [0, 1, 2, {'key': [0, list(range(2000))]}]
+        actual = [0, 1, 2, {'key': [0, list(range(2000))]}]
+        actual[3]['key'][1][1024] = -1
+
+        diff = first_difference(expected, actual)
+        self.assertEqual("[3]['key'][1][1024]", diff.path)
+        self.assertEqual(1024, diff.expected)
+        self.assertEqual(-1, diff.actual)
+
+    def test_length(self):
+        diff = first_difference([1, 2], [1, 2, 3])
+        self.assertEqual('', diff.path)
+        self.assertIn('length', diff.reason)
+
+    def test_missing_key(self):
+        diff = first_difference({'a': 1, 'b': 2}, {'a': 1})
+        self.assertIn("'b'", diff.reason)
+
+    def test_type(self):
+        diff = first_difference([(1, 2)], [[1, 2]])
+        self.assertEqual('[0]', diff.path)
+        self.assertIn('tuple', diff.reason)
+
+    def test_numbers_of_different_types(self):
+        self.assertIsNone(first_difference([1.0], [1]))
+
+    def test_string_window(self):
+        expected = 'a' * 100_000 + 'b' + 'a' * 100_000
+        actual = 'a' * 200_001
+
+        diff = first_difference(expected, actual)
+        self.assertIn('100000', diff.reason)
+        self.assertLess(len(str(diff)), 500)
+
+
+class TestAssertStructurallyEqual(TestTester, TestCase):
+    def test_d_returned_large_failure(self):
+        size = 100_000
+
+        def correct_func():
+            return [[i, str(i)] for i in range(size)]
+
+        def student_func():
+            values = correct_func()
+            values[size // 2][1] = 'wrong'
+            return values
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func)
+            def test_0(self, fn):
+                return fn()
+
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(Grader).run(result)
+
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+        self.assertIn(f'[{size // 2}][1]', message)
+        self.assertLess(len(message), 2000)
+
+    def test_msg(self):
+        class Grader(Autograder):
+            def test_0(self):
+                self.assertStructurallyEqual([1], [2], msg='my message')
+
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(Grader).run(result)
+
+        self.assertIn('my message', result.failures[0][1])
+
+
+class TestMultisetDifference(TestCase):
+    def test_equal(self):
+        self.assertFalse(multiset_difference([[1], {'a': [2]}, 3],
+                                             [3, {'a': [2]}, [1]]))
+
+    def test_repeats(self):
+        difference = multiset_difference([1, 1, 2], [1, 2, 2])
+        self.assertEqual([1], difference.missing)
+        self.assertEqual([2], difference.unexpected)
+
+    def test_list_is_not_tuple(self):
+        difference = multiset_difference([[1, 2]], [(1, 2)])
+        self.assertEqual([[1, 2]], difference.missing)
+        self.assertEqual([(1, 2)], difference.unexpected)
+
+    def test_unorderable(self):
+        """sorted() can't handle these, but we can."""
+        expected = [None, 'a', 1, [2], {'x': {3}}]
+        actual = [{'x': {3}}, [2], 1, 'a', None]
+        self.assertFalse(multiset_difference(expected, actual))
+
+    def test_unhashable_objects(self):
+        class Point:
+            def __init__(self, x):
+                self.x = x
+
+            def __eq__(self, other):
+                return self.x == other.x
+
+        difference = multiset_difference([Point(1), Point(2)],
+                                         [Point(2), Point(3)])
+        self.assertEqual([1], [p.x for p in difference.missing])
+        self.assertEqual([3], [p.x for p in difference.unexpected])
+
+
+class TestAssertUnorderedEqual(TestTester, TestCase):
+    def test_d_returned_unordered(self):
+        def correct_func():
+            return [[i] for i in range(1000)]
+
+        def student_func():
+            return [[i] for i in reversed(range(1000))]
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        assertion=Autograder.assertUnorderedEqual)
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_method_unordered_failing(self):
+        class Correct:
+            def items(self):
+                return [{'a': 1}, {'b': 2}]
+
+        class Student:
+            def items(self):
+                return [{'b': 2}, {'b': 2}]
+
+        class Grader(Autograder, correct=Correct, student=Student,
+                     method='items'):
+            test_0 = d_method(assertion=Autograder.assertUnorderedEqual)
+
+        self.assertTestCaseFailure(Grader)
+
+
+class TestNumericDifference(TestCase):
+    def test_close(self):
+        expected = [[1.0, 2.0], [3.0, 4.0]]
+        actual = [[1.0, 2.0 + 1e-9], [3.0, 4.0]]
+        self.assertIsNone(numeric_difference(expected, actual))
+
+    def test_exactly_equal(self):
+        values = [float(i) for i in range(10_000)]
+        self.assertIsNone(numeric_difference(values, list(values)))
+
+    def test_worst_index(self):
+        expected = [[1.0, 2.0], [3.0, 4.0]]
+        actual = [[1.1, 2.0], [3.0, 5.0]]
+
+        difference = numeric_difference(expected, actual, rtol=1e-3)
+        self.assertEqual(2, difference.count)
+        self.assertEqual(4, difference.total)
+        self.assertEqual((1, 1), difference.worst_index)
+        self.assertEqual(5.0, difference.actual)
+
+    def test_atol(self):
+        self.assertIsNone(numeric_difference([0.0], [1e-9], atol=1e-8))
+        self.assertIsNotNone(numeric_difference([0.0], [1e-7], atol=1e-8))
+
+    def test_nan_and_inf(self):
+        self.assertIsNone(numeric_difference([math.nan, math.inf],
+                                             [math.nan, math.inf]))
+        self.assertIsNotNone(numeric_difference([1.0], [math.nan]))
+
+    def test_shape(self):
+        difference = numeric_difference([[1.0, 2.0]], [[1.0], [2.0]])
+        self.assertIn('shape', str(difference))
+
+    def test_not_numbers(self):
+        self.assertIsNotNone(numeric_difference([1.0], ['a']))
+
+
+class TestNumericDifferenceWithoutNumpy(TestNumericDifference):
+    def setUp(self):
+        super().setUp()
+        self.numpy = comparison.numpy
+        comparison.numpy = None
+
+    def tearDown(self):
+        super().tearDown()
+        comparison.numpy = self.numpy
+
+
+class TestAssertAllClose(TestTester, TestCase):
+    def test_d_returned_all_close(self):
+        def correct_func():
+            return [i / 10 for i in range(1000)]
+
+        def student_func():
+            return [i * 0.1 for i in range(1000)]
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        assertion=Autograder.assertAllClose)
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_returned_all_close_failing(self):
+        def correct_func():
+            return [1.0, 2.0, 3.0]
+
+        def student_func():
+            return [1.0, 2.01, 3.0]
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        assertion=partial(Autograder.assertAllClose,
+                                          rtol=1e-3))
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseFailure(Grader)
+
+
+class Node:
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+
+class StudentNode:
+    def __init__(self, data, next_node=None):
+        self.value = data
+        self.next_node = next_node
+
+    def __eq__(self, other):
+        return True  # a wrong __eq__ shouldn't fool the comparison
+
+
+class TreeNode:
+    def __init__(self, data, left=None, right=None):
+        self.data = data
+        self.left = left
+        self.right = right
+
+
+def linked_list(values, node_class=Node):
+    head = None
+    for value in reversed(values):
+        head = node_class(value, head)
+    return head
+
+
+class TestStructureDifference(TestCase):
+    def test_long_linked_list(self):
+        values = list(range(20_000))
+        self.assertIsNone(structure_difference(linked_list(values),
+                                               linked_list(values)))
+
+    def test_long_linked_list_difference(self):
+        values = list(range(20_000))
+        wrong = list(values)
+        wrong[-1] = -1
+
+        difference = structure_difference(linked_list(values),
+                                          linked_list(wrong))
+        self.assertEqual('.next (x19999).data', difference.path)
+        self.assertEqual(-1, difference.actual)
+
+    def test_attribute_mapping(self):
+        attrs = {'data': 'value', 'next': 'next_node'}
+        expected = linked_list([1, 2, 3])
+
+        self.assertIsNone(structure_difference(
+                expected, linked_list([1, 2, 3], StudentNode), attrs))
+        self.assertIsNotNone(structure_difference(
+                expected, linked_list([1, 2], StudentNode), attrs))
+
+    def test_cycle(self):
+        expected = linked_list([1, 2])
+        expected.next.next = expected
+
+        actual = linked_list([1, 2])
+        actual.next.next = actual
+        self.assertIsNone(structure_difference(expected, actual))
+
+        actual.next.next = actual.next
+        self.assertIsNotNone(structure_difference(expected, actual))
+
+    def test_tree(self):
+        expected = TreeNode(2, TreeNode(1), TreeNode(3))
+        actual = TreeNode(2, TreeNode(1), TreeNode(4))
+
+        difference = structure_difference(expected, actual)
+        self.assertEqual('.right.data', difference.path)
+
+
+class TestDStructure(TestTester, TestCase):
+    def test_d_structure(self):
+        class Grader(Autograder,
+                     correct=lambda: linked_list([1, 2, 3]),
+                     student=lambda: linked_list([1, 2, 3])):
+            @d_structure
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_structure_failing(self):
+        def correct_func():
+            return linked_list([1, 2, 3])
+
+        def student_func():
+            return linked_list([1, 3, 2], StudentNode)
+
+        class Grader(Autograder):
+            @d_structure(correct_func, student_func,
+                         attrs={'data': 'value', 'next': 'next_node'})
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseFailure(Grader)
+
+
+class TestStreamDifference(TestCase):
+    def test_equal(self):
+        self.assertIsNone(stream_difference(iter(range(1000)), range(1000)))
+
+    def test_infinite(self):
+        self.assertIsNone(stream_difference(itertools.count(),
+                                            itertools.count(),
+                                            max_items=5000))
+
+    def test_mismatch(self):
+        def actual():
+            for i in itertools.count():
+                yield [i] if i != 700 else [-1]
+
+        difference = stream_difference(([i] for i in itertools.count()),
+                                       actual())
+        self.assertEqual('[700][0]', difference.path)
+
+    def test_ends_early(self):
+        difference = stream_difference(range(10), range(9))
+        self.assertEqual('[9]', difference.path)
+        self.assertIn('ended after 9', difference.reason)
+
+    def test_ends_late(self):
+        difference = stream_difference(range(9), range(10))
+        self.assertIn('end after 9', difference.reason)
+
+    def test_timeout(self):
+        def slow():
+            yield 0
+            while True:
+                time.sleep(0.01)
+
+        start = time.perf_counter()
+        difference = stream_difference(itertools.count(), slow(),
+                                       timeout=0.2)
+        self.assertIn('timed out', difference.reason)
+        self.assertLess(time.perf_counter() - start, 5)
+
+
+class TestAssertStreamEqual(TestTester, TestCase):
+    def test_d_returned_generator(self):
+        def correct_func():
+            return (i * i for i in itertools.count())
+
+        def student_func():
+            i = 0
+            while True:
+                yield i ** 2
+                i += 1
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        assertion=Autograder.assertStreamEqual)
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_returned_generator_failing(self):
+        def correct_func():
+            return iter(range(100))
+
+        def student_func():
+            return iter(range(99))
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        assertion=Autograder.assertStreamEqual)
+            def test_0(self, fn):
+                return fn()
+
+        self.assertTestCaseFailure(Grader)
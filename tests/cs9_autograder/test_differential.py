@@ -1,11 +1,18 @@
 """Test the differential testing"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
+import time
 from unittest import TestCase
 import unittest
 
 from cs9_autograder import (d_compare, d_compare_pairs, d_returned, d_method,
-                            Autograder)
+                            d_sequence, Autograder, importing,
+                            set_submission_path, student_import)
 
-from .mixins import TestTester
+from cs9_autograder.timeouts import run_with_timeout, StudentTimeout
+
+from .mixins import SubmissionPathRestorer, TestTester
 
 
 class TestDifferential(TestTester, TestCase):
@@ -92,6 +99,145 @@ class TestDifferential(TestTester, TestCase):
         self.assertTestCaseFailure(Grader)
 
 
+class TestTimeout(TestTester, TestCase):
+    def test_timeout_infinite_loop(self):
+        def correct_func():
+            return True
+
+        def student_func():
+            while True:
+                pass
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func, timeout=0.2)
+            def test(self, fn):
+                return fn()
+
+        start = time.perf_counter()
+        self.assertTestCaseFailure(Grader)
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_timeout_swallowed_exception(self):
+        """The student shouldn't be able to catch the timeout."""
+        def correct_func():
+            return True
+
+        def student_func():
+            while True:
+                try:
+                    time.sleep(0.01)
+                except Exception:
+                    pass
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func, timeout=0.2)
+            def test(self, fn):
+                return fn()
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_timeout_factor(self):
+        def correct_func():
+            time.sleep(0.01)
+            return True
+
+        def student_func():
+            time.sleep(1)
+            return True
+
+        class Grader(Autograder):
+            @d_returned(correct_func, student_func,
+                        timeout_factor=5, timeout_floor=0.1)
+            def test(self, fn):
+                return fn()
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_timeout_factor_passing(self):
+        def correct_func():
+            time.sleep(0.01)
+            return True
+
+        class Grader(Autograder):
+            @d_returned(correct_func, correct_func, timeout_factor=5)
+            def test(self, fn):
+                return fn()
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_method_timeout(self):
+        class Correct:
+            def my_method(self):
+                return 3
+
+        class Student:
+            def my_method(self):
+                while True:
+                    pass
+
+        class Grader(Autograder,
+                     correct=Correct, student=Student,
+                     method='my_method'):
+
+            test = d_method(timeout=0.2)
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_d_compare_timeout(self):
+        class Correct:
+            def __init__(self, value):
+                self.value = value
+
+            def __lt__(self, other):
+                return self.value < other.value
+
+        class Student(Correct):
+            def __lt__(self, other):
+                while True:
+                    pass
+
+        class Grader(Autograder, correct=Correct, student=Student,
+                     method='__lt__'):
+
+            test_0 = d_compare((1,), (2,), timeout=0.2)
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_run_with_timeout_in_thread(self):
+        def spin():
+            while True:
+                time.sleep(0.01)
+
+        def run():
+            with self.assertRaises(StudentTimeout):
+                run_with_timeout(spin, 0.1)
+
+            return run_with_timeout(lambda: 3, 1)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(3, executor.submit(run).result())
+
+    def test_run_with_timeout_in_thread_stops_the_thread(self):
+        """The timed out student code doesn't keep running."""
+        stopped = threading.Event()
+
+        def spin():
+            try:
+                while True:
+                    try:
+                        pass
+                    except BaseException:  # even this gets interrupted
+                        pass
+            finally:
+                stopped.set()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(StudentTimeout):
+                executor.submit(run_with_timeout, spin, 0.1).result()
+
+        self.assertTrue(stopped.wait(timeout=2))
+
+
 class TestDifferentialMethod(TestTester, TestCase):
     def test_d_method(self):
         class Correct:
@@ -334,3 +480,173 @@ class TestDComparePairs(TestTester, TestCase):
                                      has_kwargs=True)
 
         self.assertTestCaseNoFailure(Grader)
+
+
+class Stack:
+    def __init__(self, items=()):
+        self.items = list(items)
+
+    def push(self, item):
+        self.items.append(item)
+
+    def pop(self):
+        return self.items.pop()
+
+    def size(self):
+        return len(self.items)
+
+
+class BuggyStack(Stack):
+    """Forgets every item after the 500th."""
+    def push(self, item):
+        if len(self.items) < 500:
+            self.items.append(item)
+
+
+def stack_operations():
+    for i in range(1000):
+        yield ('push', (i,))
+        yield ('size',)
+
+
+class TestDSequence(TestTester, TestCase):
+    def test_d_sequence_passing(self):
+        class Grader(Autograder, correct=Stack, student=Stack):
+            test_0 = d_sequence(stack_operations,
+                                state=lambda stack: stack.items)
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_sequence_failing(self):
+        class Grader(Autograder, correct=Stack, student=BuggyStack):
+            test_0 = d_sequence(stack_operations)
+
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(Grader).run(result)
+
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+
+        # the 501st push is ignored, which shows up in the size after it
+        self.assertIn('After 1002 operations', message)
+        self.assertIn('obj = BuggyStack()', message)
+        self.assertIn('obj.push(500)', message)
+        self.assertIn('obj.size()', message)
+
+    def test_d_sequence_exceptions(self):
+        """Both raising the same exception is a match."""
+        class Grader(Autograder, correct=Stack, student=Stack):
+            test_0 = d_sequence([('push', (1,)), ('pop',), ('pop',)])
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_sequence_missing_exception(self):
+        class LenientStack(Stack):
+            def pop(self):
+                return self.items.pop() if self.items else None
+
+        class Grader(Autograder, correct=Stack, student=LenientStack):
+            test_0 = d_sequence([('pop',)])
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_d_sequence_state(self):
+        class ReversedStack(Stack):
+            def push(self, item):
+                self.items.insert(0, item)
+
+            def pop(self):
+                return self.items.pop(0)
+
+        operations = [('push', (1,)), ('push', (2,)), ('pop',)]
+
+        class Grader(Autograder, correct=Stack, student=ReversedStack):
+            test_0 = d_sequence(operations)
+            test_1 = d_sequence(operations[:2],
+                                state=lambda stack: stack.items)
+
+        self.assertTestCaseFailure(Grader, 1)
+
+    def test_d_sequence_ctor_args(self):
+        class Grader(Autograder, correct=Stack, student=Stack):
+            test_0 = d_sequence([('pop',), ('size',)], ctor_args=([1, 2],))
+
+        self.assertTestCaseNoFailure(Grader)
+
+
+def slow_correct(*args):
+    time.sleep(1)
+    return Stack
+
+
+class TestFailFast(SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        set_submission_path(script_dir / 'importing_test_files')
+
+        with student_import(lazy=True):
+            import value_error, non_existant, working
+
+        self.value_error = value_error
+        self.non_existant = non_existant
+        self.working = working
+
+    def tearDown(self):
+        super().tearDown()
+        importing.FAILED_IMPORTS.clear()
+
+    def run_grader(self, grader):
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+
+        start = time.perf_counter()
+        loader.loadTestsFromTestCase(grader).run(result)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        return result
+
+    def test_skip_exception(self):
+        class Grader(Autograder):
+            @d_returned(slow_correct, self.value_error.some_function)
+            def test_0(self, fn):
+                return fn()
+
+        result = self.run_grader(Grader)
+
+        (_, reason), = result.skipped
+        self.assertIn('value_error.py', reason)
+        self.assertIn('test_student_imports', reason)
+        self.assertEqual(1, len(result.failures))  # test_student_imports
+
+    def test_skip_missing_class(self):
+        class Grader(Autograder, correct=Stack,
+                     student=self.non_existant.Stack, method='size'):
+            test_0 = d_method()
+            test_1 = d_compare((), (), method='__eq__')
+            test_2 = d_sequence([('size',)])
+
+        result = self.run_grader(Grader)
+        self.assertEqual(3, len(result.skipped))
+
+    def test_skip_lazy_module(self):
+        """The test only finds out that the module is broken when it checks"""
+        class Grader(Autograder):
+            @d_returned(slow_correct, self.value_error)
+            def test_0(self, module):
+                return module.some_function()
+
+        result = self.run_grader(Grader)
+        self.assertEqual(1, len(result.skipped))
+
+    def test_no_skip(self):
+        class Grader(Autograder):
+            @d_returned(self.working.hello_world, self.working.hello_world)
+            def test_0(self, fn):
+                return fn()
+
+        result = self.run_grader(Grader)
+        self.assertFalse(result.skipped)
+        self.assertEqual(1, len(result.failures))  # test_student_imports
@@ -0,0 +1,338 @@
+"""Test grading submissions with a loaded autograder"""
+from contextlib import redirect_stdout
+from io import StringIO
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+
+from cs9_autograder.cli import main
+from cs9_autograder.grading import AutograderModule
+from cs9_autograder.incremental import IncrementalState
+from cs9_autograder.server import make_server, request_grade
+
+
+HERE = Path(__file__).resolve().parent
+TEST_FILES = HERE / 'grading_test_files'
+
+
+def statuses(results):
+    return {test['name'].rpartition('.')[2]: test['status']
+            for test in results['tests']}
+
+
+class TestAutograderModule(TestCase):
+    def setUp(self):
+        self.autograder = AutograderModule(TEST_FILES / 'lab_autograder.py')
+        self.addCleanup(self.autograder.close)
+
+    def test_grade(self):
+        results = self.autograder.grade(TEST_FILES / 'good')
+
+        self.assertEqual(3, results['score'])
+        self.assertEqual(3, results['max_score'])
+        self.assertEqual({'test_double': 'passed',
+                          'test_double_zero': 'passed',
+                          'test_student_imports': 'passed'},
+                         statuses(results))
+
+    def test_grade_several(self):
+        """Each submission gets its own student modules."""
+        bad = self.autograder.grade(TEST_FILES / 'bad')
+        good = self.autograder.grade(TEST_FILES / 'good')
+
+        # 0 * 0 == 0 + 0
+        self.assertEqual(1, bad['score'])
+        self.assertEqual('failed', statuses(bad)['test_double'])
+        self.assertEqual(3, good['score'])
+
+    def test_missing_module(self):
+        with tempfile.TemporaryDirectory() as submission:
+            results = self.autograder.grade(submission)
+
+        self.assertEqual(0, results['score'])
+        self.assertEqual('failed', statuses(results)['test_student_imports'])
+        self.assertEqual('skipped', statuses(results)['test_double'])
+
+
+class TestHotReload(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp_dir.name)
+
+        # the solution has a name of its own so that it doesn't clash with
+        # lab_solution in sys.modules
+        (self.directory / 'reload_solution.py').write_text(
+                'def double(x):\n    return 2 * x\n')
+        autograder = (TEST_FILES / 'lab_autograder.py').read_text()
+        (self.directory / 'reload_autograder.py').write_text(
+                autograder.replace('lab_solution', 'reload_solution'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def touch(self, file_name, text):
+        path = self.directory / file_name
+        mtime = path.stat().st_mtime_ns if path.exists() else 0
+        path.write_text(text)
+        os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+    def load(self):
+        autograder = AutograderModule(self.directory / 'reload_autograder.py')
+        self.addCleanup(autograder.close)
+        return autograder
+
+    def test_reload_solution(self):
+        autograder = self.load()
+        self.assertEqual(3, autograder.grade(TEST_FILES / 'good')['score'])
+        self.assertFalse(autograder.refresh())
+
+        self.touch('reload_solution.py', 'def double(x):\n    return x * x\n')
+
+        self.assertEqual(1, autograder.grade(TEST_FILES / 'good')['score'])
+        self.assertEqual(3, autograder.grade(TEST_FILES / 'bad')['score'])
+
+    def test_reload_autograder(self):
+        autograder = self.load()
+        self.assertEqual(3, autograder.grade(TEST_FILES / 'good')['score'])
+
+        text = (self.directory / 'reload_autograder.py').read_text()
+        self.touch('reload_autograder.py',
+                   text.replace('@weight(2)', '@weight(5)'))
+
+        self.assertEqual(6, autograder.grade(TEST_FILES / 'good')['score'])
+
+    def test_reload_only_changed(self):
+        self.touch('reload_other.py', 'VALUE = 1\n')
+        self.touch('reload_user.py', 'import reload_solution\n')
+        text = (self.directory / 'reload_autograder.py').read_text()
+        self.touch('reload_autograder.py',
+                   'import reload_other\nimport reload_user\n' + text)
+
+        autograder = self.load()
+        other = sys.modules['reload_other']
+        solution = sys.modules['reload_solution']
+        user = sys.modules['reload_user']
+
+        self.touch('reload_solution.py', 'def double(x):\n    return x * x\n')
+        self.assertTrue(autograder.refresh())
+
+        self.assertIs(other, sys.modules['reload_other'])
+        self.assertIsNot(solution, sys.modules['reload_solution'])
+
+        # it refers to the old reload_solution
+        self.assertIsNot(user, sys.modules['reload_user'])
+
+
+class TestServer(TestCase):
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = Path(tmp_dir) / 'grader.sock'
+            server = make_server(TEST_FILES / 'lab_autograder.py',
+                                 socket_path=socket_path, jobs=2)
+
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                good = request_grade(TEST_FILES / 'good', socket_path)
+                bad = request_grade(TEST_FILES / 'bad', socket_path)
+                missing = request_grade(HERE / 'nonexistent', socket_path)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+            self.assertFalse(socket_path.exists())
+
+        self.assertEqual(3, good['score'])
+        self.assertEqual(1, bad['score'])
+        self.assertIn('error', missing)
+
+
+class TestCLI(TestCase):
+    def test_grade(self):
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            status = main(['grade', str(TEST_FILES / 'lab_autograder.py'),
+                           str(TEST_FILES / 'bad')])
+
+        self.assertEqual(0, status)
+        self.assertEqual(1, json.loads(stdout.getvalue())['score'])
+
+
+INCREMENTAL_AUTOGRADER = '''
+from cs9_autograder import Autograder, d_returned, student_import, weight
+
+import incremental_solution
+
+with student_import(lazy=True):
+    import lab
+    import other
+
+
+def call(fn, x):
+    return fn(x)
+
+
+class Grader(Autograder):
+    @weight(1)
+    @d_returned(incremental_solution.double, lab.double)
+    def test_double(self, fn):
+        return fn(21)
+
+    @weight(1)
+    @d_returned(incremental_solution.triple, other.triple)
+    def test_triple(self, fn):
+        return call(fn, 5)
+'''
+
+
+class TestIncremental(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        directory = Path(self.tmp_dir.name)
+
+        self.autograder_dir = directory / 'autograder'
+        self.autograder_dir.mkdir()
+        self.write(self.autograder_dir / 'incremental_autograder.py',
+                   INCREMENTAL_AUTOGRADER)
+        self.write(self.autograder_dir / 'incremental_solution.py',
+                   'def double(x):\n    return 2 * x\n\n\n'
+                   'def triple(x):\n    return 3 * x\n')
+
+        self.submission = directory / 'submission'
+        self.submission.mkdir()
+        self.write(self.submission / 'lab.py',
+                   'def double(x):\n    return x + x\n')
+        self.write(self.submission / 'other.py',
+                   'def triple(x):\n    return x + x + x\n')
+
+        self.autograder = AutograderModule(
+                self.autograder_dir / 'incremental_autograder.py')
+        self.addCleanup(self.autograder.close)
+
+        self.state = IncrementalState()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, text):
+        """Write a file, making sure that its mtime changes."""
+        mtime = path.stat().st_mtime_ns if path.exists() else 0
+        path.write_text(text)
+        if path.stat().st_mtime_ns <= mtime:
+            os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+    def grade(self):
+        results = self.autograder.grade(self.submission, self.state)
+        self.assertEqual(3, len(results['tests']))
+        return results
+
+    def rerun(self, before, after):
+        """The tests which ran again, rather than having their results
+        reused (which includes their durations)."""
+        return {test['name'].rpartition('.')[2] for test in after['tests']
+                if test not in before['tests']}
+
+    def test_unchanged(self):
+        first = self.grade()
+        self.assertEqual(0, first['reused'])
+        self.assertEqual(2, first['score'])
+
+        second = self.grade()
+        self.assertEqual(3, second['reused'])
+        self.assertEqual(2, second['score'])
+
+    def test_student_file_changed(self):
+        before = self.grade()
+        self.write(self.submission / 'other.py',
+                   'def triple(x):\n    return x * x\n')
+
+        results = self.grade()
+
+        # any test may read any of the student's modules
+        self.assertEqual({'test_double', 'test_triple',
+                          'test_student_imports'},
+                         self.rerun(before, results))
+        self.assertEqual('failed', statuses(results)['test_triple'])
+        self.assertEqual('passed', statuses(results)['test_double'])
+
+    def test_test_changed(self):
+        before = self.grade()
+
+        source = INCREMENTAL_AUTOGRADER.replace('call(fn, 5)', 'call(fn, 6)')
+        self.write(self.autograder_dir / 'incremental_autograder.py', source)
+
+        self.assertEqual({'test_triple'}, self.rerun(before, self.grade()))
+
+    def test_helper_changed(self):
+        """test_triple depends on the script's call() helper."""
+        before = self.grade()
+
+        source = INCREMENTAL_AUTOGRADER.replace('return fn(x)',
+                                                'return fn(x) + 1')
+        self.write(self.autograder_dir / 'incremental_autograder.py', source)
+
+        results = self.grade()
+        self.assertEqual(2, results['reused'])
+        self.assertEqual({'test_triple'}, self.rerun(before, results))
+
+    def test_solution_changed(self):
+        self.grade()
+        self.write(self.autograder_dir / 'incremental_solution.py',
+                   'def double(x):\n    return 2 * x\n\n\n'
+                   'def triple(x):\n    return 4 * x\n')
+
+        results = self.grade()
+        self.assertEqual(1, results['reused'])
+        self.assertEqual(1, results['score'])
+
+    def test_state_file(self):
+        state_path = Path(self.tmp_dir.name) / 'state.json'
+        self.grade()
+        self.state.save(state_path)
+
+        self.state = IncrementalState.load(state_path)
+        self.assertEqual(3, self.grade()['reused'])
+
+    def test_other_submission(self):
+        """A state file is only used for the submission it was saved for."""
+        state_path = Path(self.tmp_dir.name) / 'state.json'
+        state = IncrementalState()
+        autograder = AutograderModule(TEST_FILES / 'lab_autograder.py')
+        self.addCleanup(autograder.close)
+
+        self.assertEqual(3, autograder.grade(TEST_FILES / 'good',
+                                             state)['score'])
+        state.save(state_path)
+
+        state = IncrementalState.load(state_path)
+        bad = autograder.grade(TEST_FILES / 'bad', state)
+        self.assertEqual(0, bad['reused'])
+        self.assertEqual(1, bad['score'])
+
+    def test_student_constant_changed(self):
+        """A test which only reads a value from a student module doesn't
+        call any of its code."""
+        self.write(self.autograder_dir / 'incremental_autograder.py',
+                   INCREMENTAL_AUTOGRADER + '''
+    @weight(1)
+    @d_returned(incremental_solution, lab)
+    def test_value(self, module):
+        return module.VALUE
+''')
+        self.write(self.autograder_dir / 'incremental_solution.py',
+                   'VALUE = 3\n\n\ndef double(x):\n    return 2 * x\n\n\n'
+                   'def triple(x):\n    return 3 * x\n')
+        self.write(self.submission / 'lab.py',
+                   'VALUE = 3\n\n\ndef double(x):\n    return x + x\n')
+        results = self.autograder.grade(self.submission, self.state)
+        self.assertEqual('passed', statuses(results)['test_value'])
+
+        self.write(self.submission / 'lab.py',
+                   'VALUE = 4\n\n\ndef double(x):\n    return x + x\n')
+        results = self.autograder.grade(self.submission, self.state)
+        self.assertEqual('failed', statuses(results)['test_value'])
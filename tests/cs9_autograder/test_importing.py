@@ -1,19 +1,25 @@
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import redirect_stdout
 import copy
 import os
 from pathlib import Path
 import sys
+import threading
 from typing import Optional
 
 import unittest
 from unittest import TestCase
 
-from cs9_autograder import (Autograder, ignore_prints, importing,                             imported_modules,
+from cs9_autograder import (Autograder, current_grading_context,
+                            grading_context, ignore_prints, importing,
+                            imported_modules,
                             module_to_path, path_to_module,
                             prepend_import_path,
                             set_submission_path, student_import, submission_path)
 
+from cs9_autograder.timeouts import run_with_timeout, StudentTimeout
+
 from .mixins import (SubmissionPathRestorer, TestTester, restore_submission_path_config,
                     get_submission_path_config)
 
@@ -81,6 +87,114 @@ class TestStudentImport(TestTester, SubmissionPathRestorer, TestCase):
             with self.assertRaises(AttributeError):
                 import value_error
 
+    def test_student_import_records_failure(self):
+        with self.assertRaises(AttributeError):
+            with student_import():
+                import value_error
+
+        failed, = importing.FAILED_IMPORTS
+        self.assertEqual('value_error.py', failed.filename)
+        self.assertFalse(failed.missing)
+
+    def test_student_import_records_missing(self):
+        with self.assertRaises(ImportError):
+            with student_import():
+                import non_existant
+
+        failed, = importing.FAILED_IMPORTS
+        self.assertEqual('non_existant', failed.module_name)
+        self.assertTrue(failed.missing)
+
+
+class TestLazyStudentImport(SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'importing_test_files'
+        set_submission_path(self.test_path)
+
+    def tearDown(self):
+        super().tearDown()
+
+        importing.FAILED_IMPORTS.clear()
+
+    def test_lazy_import_is_not_run(self):
+        with student_import(lazy=True):
+            import working
+
+        module_dict = object.__getattribute__(working, '__dict__')
+        self.assertNotIn('hello_world', module_dict)
+
+        self.assertTrue(working.hello_world())
+
+    def test_lazy_import_exception(self):
+        with student_import(lazy=True):
+            import value_error
+
+        self.assertFalse(importing.FAILED_IMPORTS)
+
+        some_function = value_error.some_function
+        with self.assertRaises(ImportError) as cm:
+            some_function()
+        self.assertIn('AttributeError', str(cm.exception))
+
+        failed, = importing.FAILED_IMPORTS
+        self.assertEqual('value_error.py', failed.filename)
+        self.assertEqual('value_error', failed.module_name)
+        self.assertIsInstance(failed.err, AttributeError)
+
+    def test_lazy_import_is_run_like_student_import(self):
+        with student_import(lazy=True):
+            import noisy
+
+        with redirect_stdout(StringIO()) as f:
+            self.assertTrue(noisy.VALUE)
+        self.assertFalse(f.getvalue())
+
+        with self.assertRaises(ImportError):
+            import working
+
+    def test_lazy_import_file_not_exist(self):
+        with student_import(lazy=True):
+            import non_existant
+
+        failed, = importing.FAILED_IMPORTS
+        self.assertTrue(failed.missing)
+
+        with self.assertRaises(ImportError):
+            non_existant.some_function()
+
+    def test_lazy_import_other_modules(self):
+        """Only missing student modules get placeholders."""
+        with student_import(lazy=True):
+            import json
+
+        self.assertTrue(json.dumps)
+        self.assertFalse(importing.FAILED_IMPORTS)
+
+    def test_load_lazy_modules(self):
+        with student_import(lazy=True):
+            import value_error
+
+        importing.load_lazy_modules()
+        self.assertEqual(1, len(importing.FAILED_IMPORTS))
+
+    def test_lazy_import_timeout_restores_stdout(self):
+        """A lazy module which is abandoned while loading in a watchdog
+        thread doesn't leave stdout redirected."""
+        with student_import(lazy=True):
+            import infinite_loop
+
+        stdout = sys.stdout
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(StudentTimeout):
+                executor.submit(run_with_timeout,
+                                lambda: infinite_loop.VALUE, 0.1).result()
+
+        self.assertIs(stdout, sys.stdout)
+
 
 class TestIgnorePrints(TestCase):
     def test_ignore_prints(self):
@@ -90,6 +204,60 @@ class TestIgnorePrints(TestCase):
         self.assertFalse(f.getvalue())
 
 
+    def test_ignore_prints_other_thread(self):
+        """Only prints in the context which ignores them are ignored."""
+        entered = threading.Event()
+        exit_now = threading.Event()
+
+        def ignore():
+            with ignore_prints():
+                entered.set()
+                exit_now.wait()
+
+        with redirect_stdout(StringIO()) as f:
+            thread = threading.Thread(target=ignore)
+            thread.start()
+            entered.wait()
+
+            print('hello')
+            exit_now.set()
+            thread.join()
+
+        self.assertEqual('hello\n', f.getvalue())
+
+    def test_interleaved_student_imports(self):
+        """Two submissions graded in turn in two threads don't leave stdout
+        closed or redirected."""
+        script_dir = Path(__file__).resolve().parent
+        path = script_dir / 'importing_test_files'
+
+        both_entered = threading.Barrier(2)
+        first_exited = threading.Event()
+
+        def grade(first):
+            with grading_context(path):
+                with student_import():
+                    both_entered.wait()
+                    print('hidden')
+                    if not first:
+                        first_exited.wait()
+
+                if first:
+                    first_exited.set()
+
+        with redirect_stdout(StringIO()) as f:
+            threads = [threading.Thread(target=grade, args=(first,))
+                       for first in (True, False)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            print('shown')
+
+        self.assertEqual('shown\n', f.getvalue())
+
+
 class TestImportedModules(TestCase):
     def search_path(self):
         script_dir = Path(__file__).resolve().parent
@@ -154,3 +322,94 @@ class PrependImportPath(TestCase):
             from good_module import good_function as different_good
 
         self.assertIsNot(good_good, different_good)
+
+
+class TestGradingContext(SubmissionPathRestorer, TestCase):
+    def base_path(self):
+        script_dir = Path(__file__).resolve().parent
+        return script_dir / 'prepend_import_path_test_files'
+
+    def test_grading_context_submission_path(self):
+        set_submission_path('/outer/path')
+
+        with grading_context('/inner/path') as context:
+            self.assertEqual(Path('/inner/path'), submission_path())
+            self.assertIs(context, current_grading_context())
+
+        self.assertEqual(Path('/outer/path'), submission_path())
+
+    def test_grading_context_failed_imports(self):
+        script_dir = Path(__file__).resolve().parent
+
+        with grading_context(script_dir / 'importing_test_files') as context:
+            with student_import(lazy=True):
+                import non_existant
+
+        self.assertEqual(1, len(context.failed_imports))
+        self.assertFalse(importing.FAILED_IMPORTS)
+
+    def test_grading_context_drops_modules(self):
+        with grading_context() as context:
+            with student_import(self.base_path() / 'good'):
+                import good_module
+
+            self.assertEqual(1, len(context.module_names))
+            self.assertIn(context.module_names[0], sys.modules)
+
+        self.assertNotIn(context.module_names[0], sys.modules)
+        self.assertEqual('good', good_module.NAME)
+
+    def test_import_path_is_not_shared(self):
+        """A thread in the default context doesn't see the import path of
+        another context."""
+        def import_in_thread():
+            import good_module
+
+        with grading_context(), \
+                prepend_import_path(self.base_path() / 'good'):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(import_in_thread)
+                with self.assertRaises(ImportError):
+                    future.result()
+
+    def test_concurrent_contexts(self):
+        barrier = threading.Barrier(2)
+
+        def grade(name):
+            with grading_context(self.base_path() / name):
+                # both contexts are inside student_import at the same time
+                with student_import():
+                    barrier.wait(timeout=5)
+                    import good_module
+                    barrier.wait(timeout=5)
+
+                return good_module.NAME, submission_path().name
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            names = list(executor.map(grade, ['good', 'different']))
+
+        self.assertEqual([('good', 'good'), ('different', 'different')],
+                         names)
+
+    def test_timed_out_lazy_module(self):
+        """A lazy module which never finishes loading doesn't stop other
+        contexts from importing."""
+        script_dir = Path(__file__).resolve().parent
+
+        with student_import(script_dir / 'importing_test_files', lazy=True):
+            import infinite_loop
+
+        def load():
+            return infinite_loop.VALUE
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(StudentTimeout):
+                executor.submit(run_with_timeout, load, 0.1).result()
+
+            def grade():
+                with grading_context(self.base_path() / 'good'):
+                    with student_import():
+                        import good_module
+                    return good_module.NAME
+
+            self.assertEqual('good', executor.submit(grade).result(timeout=5))
@@ -0,0 +1,99 @@
+"""Test the memory usage tests"""
+from pathlib import Path
+import unittest
+from unittest import TestCase
+
+from cs9_autograder import Autograder, d_memory, set_submission_path
+from cs9_autograder.memory import measure_memory
+
+from .mixins import SubmissionPathRestorer, TestTester
+
+
+SIZE = 100_000
+
+
+def squares_generator(n):
+    return (i * i for i in range(n))
+
+
+def squares_list(n):
+    return [i * i for i in range(n)]
+
+
+class TestMeasureMemory(TestCase):
+    def test_measure_memory(self):
+        _, small = measure_memory(lambda: sum(squares_generator(SIZE)))
+        _, large = measure_memory(lambda: sum(squares_list(SIZE)))
+
+        self.assertGreater(large.peak, 10 * small.peak)
+
+    def test_retained(self):
+        result, usage = measure_memory(lambda: squares_list(SIZE))
+
+        self.assertEqual(SIZE, len(result))
+        self.assertGreater(usage.retained, SIZE * 8)
+
+
+class TestDMemory(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        # the "student" functions are in this file
+        set_submission_path(Path(__file__).resolve().parent)
+
+    def test_d_memory_passing(self):
+        class Grader(Autograder):
+            @d_memory(squares_generator, squares_generator)
+            def test_0(self, fn):
+                return sum(fn(SIZE))
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_memory_peak(self):
+        class Grader(Autograder):
+            @d_memory(squares_generator, squares_list)
+            def test_0(self, fn):
+                return sum(fn(SIZE))
+
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(Grader).run(result)
+
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+        self.assertIn('peak', message)
+
+        # nothing is left over, so there are no lines to blame
+        self.assertNotIn('test_memory.py, line', message)
+
+    def test_d_memory_peak_disabled(self):
+        class Grader(Autograder):
+            @d_memory(squares_generator, squares_list, peak_ratio=None)
+            def test_0(self, fn):
+                return sum(fn(SIZE))
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_memory_retained(self):
+        class Grader(Autograder):
+            @d_memory(squares_list, squares_list)
+            def test_0(self, fn):
+                return fn(SIZE)
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_d_memory_retained_failing(self):
+        class Grader(Autograder):
+            @d_memory(squares_generator, squares_list, peak_ratio=None)
+            def test_0(self, fn):
+                return fn(SIZE)
+
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(Grader).run(result)
+
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+        self.assertIn('retained', message)
+        self.assertNotIn('peak', message)
+        self.assertIn('test_memory.py, line', message)
@@ -0,0 +1,103 @@
+import ast
+from pathlib import Path
+from unittest import TestCase
+
+from .mixins import (SubmissionPathRestorer, TestTester)
+
+from cs9_autograder import Autograder, set_submission_path, t_mutation
+from cs9_autograder.mutation import generate_mutants, run_mutation_tests
+
+
+TEST_FILES = Path(__file__).resolve().parent / 'mutation_test_files'
+SOLUTION = TEST_FILES / 'tally_solution.py'
+BUGGY = TEST_FILES / 'tally_buggy.py'
+
+
+class TestGenerateMutants(TestCase):
+    def test_mutants(self):
+        source = ('LIMIT = 3\n'
+                  '\n'
+                  'def f(x):\n'
+                  '    """Docstring."""\n'
+                  '    if x < LIMIT and (\n'
+                  '            x != 0):\n'
+                  '        return x + 1\n')
+
+        mutants = generate_mutants(source)
+        descriptions = {mutant.description for mutant in mutants}
+
+        self.assertEqual({
+            'line 5 (in `f`): statement removed',
+            'line 7 (in `f`): statement removed',
+            'line 5 (in `f`): `and` replaced with `or`',
+            'line 5 (in `f`): `<` replaced with `<=`',
+            'line 5 (in `f`): `!=` replaced with `==`',
+            'line 5 (in `f`): `0` replaced with `1`',
+            'line 5 (in `f`): `0` replaced with `-1`',
+            'line 7 (in `f`): `+` replaced with `-`',
+            'line 7 (in `f`): `1` replaced with `2`',
+            'line 7 (in `f`): `1` replaced with `0`'}, descriptions)
+
+        for mutant in mutants:
+            self.assertNotEqual(ast.dump(ast.parse(source)),
+                                ast.dump(ast.parse(mutant.source)))
+
+    def test_max_mutants(self):
+        source = SOLUTION.read_text()
+        mutants = generate_mutants(source, max_mutants=4)
+
+        self.assertEqual(4, len(mutants))
+        self.assertEqual(
+                {'total', 'count_above'},
+                {mutant.description.split('`')[1] for mutant in mutants})
+
+
+class TestRunMutationTests(TestCase):
+    def test_only_covering_tests_run(self):
+        report = run_mutation_tests('thoroughTests', 'tally', SOLUTION,
+                                    TEST_FILES, max_mutants=6)
+
+        self.assertTrue(report.baseline.success)
+        self.assertEqual(6, len(report.results))
+        self.assertEqual(1.0, report.score)
+
+        for result in report.results:
+            function = result.mutant.description.split('`')[1]
+            self.assertEqual([f'thoroughTests.py::test_{function}'],
+                             result.tests)
+
+    def test_weak_tests(self):
+        report = run_mutation_tests('weakTests', 'tally', SOLUTION,
+                                    TEST_FILES, variants=[BUGGY],
+                                    max_mutants=6)
+
+        self.assertLess(report.score, 0.5)
+        self.assertIn('`tally_buggy.py`',
+                      [mutant.description for mutant in report.survived])
+
+
+class TestTMutation(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+        set_submission_path(TEST_FILES)
+
+    def test_variants_caught(self):
+        class Grader(Autograder):
+            test_mutation = t_mutation('thoroughTests', 'tally', SOLUTION,
+                                       variants=[BUGGY], generate=False)
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_variants_not_caught(self):
+        class Grader(Autograder):
+            test_mutation = t_mutation('weakTests', 'tally', SOLUTION,
+                                       variants=[BUGGY], generate=False)
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_tests_fail_on_solution(self):
+        class Grader(Autograder):
+            test_mutation = t_mutation('wrongTests', 'tally', SOLUTION,
+                                       variants=[BUGGY])
+
+        self.assertTestCaseFailure(Grader)
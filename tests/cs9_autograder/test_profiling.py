@@ -0,0 +1,144 @@
+"""Test profiling the student's code"""
+from pathlib import Path
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+
+from cs9_autograder import Autograder, d_method, d_returned, set_submission_path
+from cs9_autograder.profiling import CProfiler, make_profiler, SamplingProfiler
+
+from .mixins import SubmissionPathRestorer
+
+
+HERE = Path(__file__).resolve().parent
+
+
+def fast_sum(n):
+    return n * (n - 1) // 2
+
+
+def slow_sum(n):
+    total = 0
+    for i in range(n):
+        total += add_slowly(i)
+    return total + 1
+
+
+def add_slowly(i):
+    return i
+
+
+def sleepy_sum(n):
+    time.sleep(0.2)
+    return fast_sum(n) + 1
+
+
+class TestProfilers(TestCase):
+    def test_cprofile_hotspots(self):
+        profiler = CProfiler(HERE)
+        self.assertEqual(fast_sum(1000), profiler.run(lambda: fast_sum(1000)))
+
+        profiler = CProfiler(HERE)
+        profiler.run(lambda: slow_sum(10_000))
+        hotspots = profiler.hotspots()
+        self.assertTrue(any('add_slowly' in line for line in hotspots))
+        self.assertIn('test_profiling.py', hotspots[0])
+
+    def test_cprofile_filters_to_root(self):
+        with tempfile.TemporaryDirectory() as root:
+            profiler = CProfiler(root)
+            profiler.run(lambda: slow_sum(1000))
+            self.assertEqual([], profiler.hotspots())
+
+    def test_sampling_hotspots(self):
+        profiler = SamplingProfiler(HERE)
+        profiler.run(lambda: sleepy_sum(10))
+
+        hotspots = profiler.hotspots()
+        self.assertEqual(1, len(hotspots))
+        self.assertIn('sleepy_sum', hotspots[0])
+
+    def test_unknown_profiler(self):
+        self.assertIsNone(make_profiler(None, HERE))
+        self.assertIsInstance(make_profiler(True, HERE), CProfiler)
+
+        with self.assertRaises(ValueError):
+            make_profiler('nonsense', HERE)
+
+
+class TestProfiledTests(SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        # the "student" functions are in this file
+        set_submission_path(HERE)
+
+        self.profile_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.profile_dir.cleanup()
+
+    def run_grader(self, grader):
+        loader = unittest.TestLoader()
+        result = unittest.TestResult()
+        loader.loadTestsFromTestCase(grader).run(result)
+        return result
+
+    def test_d_returned_hotspots(self):
+        class Grader(Autograder, profile=True,
+                     profile_dir=self.profile_dir.name):
+            @d_returned(fast_sum, slow_sum)
+            def test_0(self, fn):
+                return fn(10_000)
+
+        result = self.run_grader(Grader)
+
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+        self.assertIn('Where your code spent the most time', message)
+        self.assertIn('add_slowly', message)
+
+        profiles = list(Path(self.profile_dir.name).glob('*.prof'))
+        self.assertEqual(1, len(profiles))
+        self.assertIn('test_0', profiles[0].name)
+
+    def test_timeout_hotspots(self):
+        class Grader(Autograder):
+            @d_returned(fast_sum, sleepy_sum, profile='sample',
+                        profile_dir=self.profile_dir.name, timeout=0.05)
+            def test_0(self, fn):
+                return fn(10)
+
+        result = self.run_grader(Grader)
+
+        message = result.failures[0][1]
+        self.assertIn('Timed out', message)
+        self.assertIn('sleepy_sum', message)
+
+    def test_d_method_profile(self):
+        class Correct:
+            def total(self):
+                return fast_sum(1000)
+
+        class Student:
+            def total(self):
+                return slow_sum(1000)
+
+        class Grader(Autograder, correct=Correct, student=Student,
+                     method='total'):
+            test_0 = d_method(profile=True, profile_dir=self.profile_dir.name)
+
+        message = self.run_grader(Grader).failures[0][1]
+        self.assertIn('slow_sum', message)
+
+    def test_passing_has_no_message(self):
+        class Grader(Autograder, profile=True,
+                     profile_dir=self.profile_dir.name):
+            @d_returned(fast_sum, fast_sum)
+            def test_0(self, fn):
+                return fn(1000)
+
+        result = self.run_grader(Grader)
+        self.assertTrue(result.wasSuccessful())
@@ -0,0 +1,136 @@
+"""Test recording grading results in a SQLite database"""
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+from unittest import TestCase
+
+from cs9_autograder.cli import main
+from cs9_autograder.grading import AutograderModule
+from cs9_autograder.results_db import ResultsDatabase
+from cs9_autograder.server import make_server, request_grade
+
+
+HERE = Path(__file__).resolve().parent
+TEST_FILES = HERE / 'grading_test_files'
+
+
+def make_results(passed, slow=0.0):
+    return {
+        'score': 2 if passed else 0,
+        'max_score': 2,
+        'tests': [
+            {'name': 'Grader.test_a', 'status': 'passed', 'score': 1,
+             'max_score': 1, 'duration': 0.1, 'output': ''},
+            {'name': 'Grader.test_b',
+             'status': 'passed' if passed else 'failed',
+             'score': 1 if passed else 0, 'max_score': 1, 'duration': 0.2,
+             'output': ''}],
+        'phases': {'load': 0.01, 'tests': 0.3},
+        'student_tests': {'tests': [
+            {'name': 'tests.py::test_x', 'phase': 'call',
+             'outcome': 'passed', 'duration': slow}]},
+        'coverage': {'lab': [3, 4], 'other': None}}
+
+
+class TestResultsDatabase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / 'results.sqlite'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_wal_mode(self):
+        ResultsDatabase(self.db_path).close()
+
+        with sqlite3.connect(self.db_path) as connection:
+            mode, = connection.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual('wal', mode)
+
+    def test_batches(self):
+        with ResultsDatabase(self.db_path, batch_size=2) as results_db:
+            results_db.add('first', make_results(True))
+
+            with sqlite3.connect(self.db_path) as connection:
+                count, = connection.execute(
+                        'SELECT COUNT(*) FROM submissions').fetchone()
+            self.assertEqual(0, count)
+
+            results_db.add('second', make_results(False))
+
+            with sqlite3.connect(self.db_path) as connection:
+                count, = connection.execute(
+                        'SELECT COUNT(*) FROM submissions').fetchone()
+            self.assertEqual(2, count)
+
+    def test_queries(self):
+        with ResultsDatabase(self.db_path) as results_db:
+            results_db.add('fast', make_results(True, slow=0.5))
+            results_db.add('slow', make_results(False, slow=3.0))
+            results_db.add('failing', make_results(False))
+
+            self.assertEqual([('Grader.test_b', 2, 3),
+                              ('Grader.test_a', 0, 3)],
+                             results_db.most_failed_tests())
+            self.assertEqual([('slow', 3.0), ('fast', 0.5)],
+                             results_db.slowest_student_suites(2))
+            self.assertEqual(
+                    [('Grader.test_a', 'passed', 1, 1, 0.1),
+                     ('Grader.test_b', 'failed', 0, 1, 0.2)],
+                    results_db.submission_results('slow'))
+
+            missing = results_db.query(
+                    'SELECT module, line FROM coverage_missing '
+                    'JOIN submissions ON id = submission_id '
+                    "WHERE name = 'fast' ORDER BY module, line")
+            self.assertEqual([('lab', 3), ('lab', 4), ('other', None)],
+                             missing)
+
+    def test_regrade_replaces(self):
+        with ResultsDatabase(self.db_path) as results_db:
+            results_db.add('student', make_results(False))
+            results_db.flush()
+            results_db.add('student', make_results(True))
+
+            self.assertEqual([('student', 2)], results_db.query(
+                    'SELECT name, score FROM submissions'))
+            self.assertEqual(2, len(results_db.query(
+                    'SELECT * FROM test_results')))
+
+    def test_grade_batch(self):
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            main(['grade-batch', str(TEST_FILES / 'lab_autograder.py'),
+                  str(TEST_FILES), '--db', str(self.db_path)])
+
+        self.assertIn('good\t3\t3', stdout.getvalue())
+
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            main(['query', str(self.db_path), '--failing', '--limit', '1'])
+
+        self.assertTrue(stdout.getvalue().startswith(
+                'lab_autograder.Grader.test_double\t1\t2'))
+
+    def test_server_writes_each_submission(self):
+        socket_path = Path(self.tmp_dir.name) / 'grader.sock'
+        server = make_server(TEST_FILES / 'lab_autograder.py',
+                             socket_path=socket_path,
+                             results_db=ResultsDatabase(self.db_path))
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            request_grade(TEST_FILES / 'good', socket_path)
+
+            # visible to other connections before the server is closed
+            with sqlite3.connect(self.db_path) as connection:
+                self.assertEqual([('good', 3.0)], connection.execute(
+                        'SELECT name, score FROM submissions').fetchall())
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
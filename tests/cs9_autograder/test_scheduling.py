@@ -0,0 +1,134 @@
+"""Test the budgeted test scheduler"""
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+import unittest
+from unittest import TestCase
+
+from cs9_autograder import Autograder, ScheduledTestSuite, weight
+from cs9_autograder.scheduling import class_setup_id, OUT_OF_TIME
+
+
+def load_suite(test_case_class, **kwargs) -> ScheduledTestSuite:
+    loader = unittest.TestLoader()
+    return ScheduledTestSuite(loader.loadTestsFromTestCase(test_case_class),
+                              **kwargs)
+
+
+class TestScheduledTestSuite(TestCase):
+    def test_weight_order(self):
+        order = []
+
+        class Grader(Autograder):
+            @weight(1)
+            def test_a(self):
+                order.append('a')
+
+            @weight(5)
+            def test_b(self):
+                order.append('b')
+
+            @weight(3)
+            def test_c(self):
+                order.append('c')
+
+        load_suite(Grader).run(unittest.TestResult())
+        self.assertEqual(['b', 'c', 'a'], order)
+
+    def test_runtime_order(self):
+        """A cheap test should go before an expensive test worth the same."""
+        order = []
+
+        class Grader(Autograder):
+            @weight(1)
+            def test_slow(self):
+                order.append('slow')
+
+            @weight(1)
+            def test_fast(self):
+                order.append('fast')
+
+        with TemporaryDirectory() as tmp_dir:
+            stats_path = Path(tmp_dir) / 'stats.json'
+            stats_path.write_text(json.dumps({
+                Grader('test_slow').id(): 10.0,
+                Grader('test_fast').id(): 0.1}))
+
+            load_suite(Grader, stats_path=stats_path).run(
+                    unittest.TestResult())
+
+        self.assertEqual(['fast', 'slow'], order)
+
+    def test_out_of_time(self):
+        ran = []
+
+        class Grader(Autograder):
+            @weight(1)
+            def test_slow(self):
+                ran.append('slow')
+
+            @weight(1)
+            def test_fast(self):
+                ran.append('fast')
+
+        with TemporaryDirectory() as tmp_dir:
+            stats_path = Path(tmp_dir) / 'stats.json'
+            slow_id = Grader('test_slow').id()
+            fast_id = Grader('test_fast').id()
+            stats_path.write_text(json.dumps({slow_id: 100.0, fast_id: 0.1}))
+
+            result = unittest.TestResult()
+            load_suite(Grader, budget=10,
+                       stats_path=stats_path).run(result)
+
+            skipped = [(test.id(), reason) for test, reason in result.skipped]
+            self.assertEqual([(slow_id, OUT_OF_TIME)], skipped)
+            self.assertEqual(['fast'], ran)
+
+            # only the test that ran gets a new runtime
+            stats = json.loads(stats_path.read_text())
+            self.assertEqual(100.0, stats[slow_id])
+            self.assertLess(stats[fast_id], 0.1)
+
+    def test_class_setup_is_not_charged_to_a_test(self):
+        class Grader(Autograder):
+            @classmethod
+            def setUpClass(cls):
+                super().setUpClass()
+                time.sleep(0.2)
+
+            @weight(1)
+            def test_a(self):
+                pass
+
+            @weight(1)
+            def test_b(self):
+                pass
+
+        with TemporaryDirectory() as tmp_dir:
+            stats_path = Path(tmp_dir) / 'stats.json'
+            load_suite(Grader, stats_path=stats_path).run(
+                    unittest.TestResult())
+
+            stats = json.loads(stats_path.read_text())
+            self.assertLess(stats[Grader('test_a').id()], 0.1)
+            self.assertLess(stats[Grader('test_b').id()], 0.1)
+            self.assertGreater(stats[class_setup_id(Grader('test_a'))], 0.2)
+
+    def test_count_test_cases(self):
+        """Counting the tests doesn't run them or touch the stats."""
+        class Grader(Autograder):
+            def test_a(self):
+                pass
+
+        with TemporaryDirectory() as tmp_dir:
+            stats_path = Path(tmp_dir) / 'stats.json'
+            test_id = Grader('test_a').id()
+            stats_path.write_text(json.dumps({test_id: 100.0}))
+
+            suite = load_suite(Grader, budget=10, stats_path=stats_path)
+            self.assertEqual(2, suite.countTestCases())
+
+            stats = json.loads(stats_path.read_text())
+            self.assertEqual(100.0, stats[test_id])
@@ -6,9 +6,14 @@ from unittest import TestCase
 
 from .mixins import (SubmissionPathRestorer, TestTester)
 
-from cs9_autograder import (Autograder, t_coverage, set_submission_path,
-                            t_module,
+from cs9_autograder import (Autograder, CoveragePolicy, t_coverage,
+                            set_submission_path,
+                            t_module, t_time_budget,
                             Autograder, TestingReport)
+from cs9_autograder.testing import (OUTPUT_LIMIT, OutputBuffer, run_pytest,
+                                   run_unit_tests_and_coverage)
+from cs9_autograder.testing_report import (_missing_lines, CoverageReport,
+                                          ModuleCoverage)
 
 
 class TestAutograder(TestTester, SubmissionPathRestorer, TestCase):
@@ -66,6 +71,344 @@ class TestTModule(TestTester, SubmissionPathRestorer, TestCase):
         self.assertTestCaseFailure(Grader)
 
 
+class TestMultipleTModules(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'multiple_t_module_test_files'
+        set_submission_path(self.test_path)
+
+    def test_multiple_t_modules_passing(self):
+        class Grader(Autograder):
+            test_first = t_module('firstTests')
+            test_second = t_module('secondTests')
+
+        self.assertTestCaseNoFailure(Grader)
+        self.assertEqual({'firstTests', 'secondTests'},
+                         set(Grader.testing_reports))
+
+    def test_multiple_t_modules_one_failing(self):
+        class Grader(Autograder):
+            test_first = t_module('firstTests')
+            test_failing = t_module('failingTests')
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_multiple_t_modules_merged_coverage(self):
+        """Each test file only covers half of the module, but together they
+        cover all of it."""
+        class Grader(Autograder):
+            test_first = t_module('firstTests')
+            test_second = t_module('secondTests')
+            test_coverage = t_coverage('two_functions')
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_single_t_module_partial_coverage(self):
+        class Grader(Autograder):
+            test_first = t_module('firstTests')
+            test_coverage = t_coverage('two_functions')
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_t_modules_only_run_when_needed(self):
+        class Grader(Autograder):
+            test_first = t_module('firstTests')
+            test_coverage = t_coverage('two_functions')
+
+            def test_other(self):
+                pass
+
+        result = unittest.TestResult()
+        unittest.TestSuite([Grader('test_other')]).run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertIsNone(Grader._tests_future)
+
+    def test_coverage_without_t_module(self):
+        class Grader(Autograder):
+            test_coverage = t_coverage('two_functions')
+
+        result = unittest.TestResult()
+        unittest.TestLoader().loadTestsFromTestCase(Grader).run(result)
+
+        (_, error), = result.errors
+        self.assertIn('Cannot check coverage', error)
+
+
+class TestBackgroundTests(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'multiple_t_module_test_files'
+        set_submission_path(self.test_path)
+
+    def test_background_tests_start_on_definition(self):
+        class Grader(Autograder, background_tests=True):
+            test_first = t_module('firstTests')
+
+        self.assertIsNotNone(Grader._tests_future)
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_background_tests_failing(self):
+        class Grader(Autograder, background_tests=True):
+            test_first = t_module('firstTests')
+            test_failing = t_module('failingTests')
+            test_coverage = t_coverage('two_functions')
+
+        self.assertTestCaseFailure(Grader, 2)
+
+    def test_background_tests_coverage_without_module(self):
+        with self.assertRaises(ValueError):
+            class Grader(Autograder, background_tests=True):
+                test_coverage = t_coverage('two_functions')
+
+
+class TestCoveragePolicy(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'multiple_t_module_test_files'
+        set_submission_path(self.test_path)
+
+    def run_tests(self, test_module, policy):
+        testing_reports, cov_report = run_unit_tests_and_coverage(
+                [test_module], ['two_functions'], self.test_path,
+                coverage_policy=policy)
+        return (testing_reports[test_module],
+                cov_report.modules['two_functions'])
+
+    def test_always(self):
+        report, cov = self.run_tests('wrongSecondTests', CoveragePolicy.ALWAYS)
+
+        self.assertFalse(report.success)
+        self.assertEqual(set(), cov.missing_lines)
+
+    def test_if_passed_failing(self):
+        report, cov = self.run_tests('wrongSecondTests',
+                                     CoveragePolicy.IF_PASSED)
+
+        self.assertFalse(report.success)
+        self.assertFalse(cov.imported)
+
+    def test_if_passed_passing(self):
+        report, cov = self.run_tests('firstTests', CoveragePolicy.IF_PASSED)
+
+        self.assertTrue(report.success)
+        self.assertEqual({6}, cov.missing_lines)
+
+    def test_parallel(self):
+        report, cov = self.run_tests('wrongSecondTests',
+                                     CoveragePolicy.PARALLEL)
+
+        self.assertFalse(report.success)
+        self.assertEqual(set(), cov.missing_lines)
+
+    def test_if_passed_autograder(self):
+        class Grader(Autograder, coverage_policy=CoveragePolicy.IF_PASSED):
+            test_first = t_module('firstTests')
+            test_second = t_module('secondTests')
+            test_coverage = t_coverage('two_functions')
+
+        self.assertTestCaseNoFailure(Grader)
+
+    def test_if_passed_autograder_failing(self):
+        class Grader(Autograder, coverage_policy=CoveragePolicy.IF_PASSED):
+            test_tests = t_module('wrongSecondTests')
+            test_coverage = t_coverage('two_functions')
+
+        self.assertTestCaseFailure(Grader, 2)
+
+
+class TestTimeBudget(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'time_budget_test_files'
+        set_submission_path(self.test_path)
+
+    def test_within_budget(self):
+        class Grader(Autograder):
+            test_budget = t_time_budget('slowTests', 60)
+
+        self.assertTestCaseNoFailure(Grader)
+        report = Grader.testing_reports['slowTests']
+        self.assertEqual('slowTests.py::test_slow',
+                         Path(report.slowest(1)[0].node_id).name)
+
+    def test_over_budget(self):
+        class Grader(Autograder):
+            test_budget = t_time_budget('slowTests', 0.1)
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_over_budget_warning(self):
+        class Grader(Autograder):
+            test_budget = t_time_budget('slowTests', 0.1, warn=True)
+
+        self.assertTestCaseNoFailure(Grader)
+
+
+class TestReference(TestTester, SubmissionPathRestorer, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'reference_test_files'
+        self.solution = self.test_path / 'area_solution.py'
+        set_submission_path(self.test_path)
+
+    def test_reference_report(self):
+        testing_reports, _ = run_unit_tests_and_coverage(
+                ['sameBugTests', 'rectangleTests'], None, self.test_path,
+                references={'sameBugTests': {'area': self.solution}})
+
+        report = testing_reports['sameBugTests']
+        self.assertTrue(report.success)
+        self.assertEqual({'sameBugTests.py::test_triangle'},
+                         {Path(test).name
+                          for test in report.reference.failed_tests})
+
+        self.assertIsNone(testing_reports['rectangleTests'].reference)
+
+    def test_tests_fail_on_reference(self):
+        class Grader(Autograder):
+            test_tests = t_module('sameBugTests',
+                                  reference={'area': self.solution})
+
+        self.assertTestCaseFailure(Grader)
+
+    def test_tests_pass_on_reference(self):
+        class Grader(Autograder):
+            test_tests = t_module('rectangleTests',
+                                  reference={'area': self.solution})
+
+        self.assertTestCaseNoFailure(Grader)
+
+
+class TestOutputBuffer(TestCase):
+    def test_short(self):
+        output = OutputBuffer(limit=10)
+        output.write('abc')
+        output.write('def')
+
+        self.assertEqual('abcdef', output.getvalue())
+        self.assertEqual(0, output.skipped)
+
+    def test_long(self):
+        output = OutputBuffer(limit=4)
+        for chunk in ['ab', 'cdefg', 'hij', 'k', 'lmnopqrs', 't']:
+            output.write(chunk)
+
+        self.assertEqual(12, output.skipped)
+        self.assertEqual('abcd\n[... 12 characters skipped ...]\nqrst',
+                         output.getvalue())
+
+
+class TestRunPytest(TestCase):
+    def setUp(self):
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'output_test_files'
+        self.test_file = self.test_path / 'loudTests.py'
+
+    def test_output_limited(self):
+        report, _ = run_pytest(self.test_file, cwd=self.test_path)
+
+        self.assertFalse(report.success)
+        self.assertLess(len(report.pretty), 2 * OUTPUT_LIMIT + 100)
+        self.assertIn('line 0\n', report.pretty)
+        self.assertIn('line 99999\n', report.pretty)
+        self.assertIn('characters skipped', report.pretty)
+
+        self.assertIsNone(report.raw_report)
+        test, = report.tests.values()
+        self.assertEqual('failed', test.outcome)
+
+    def test_keep_raw(self):
+        report, _ = run_pytest(self.test_file, cwd=self.test_path,
+                               keep_raw=True)
+
+        self.assertEqual('SessionStart', report.raw_report[0]['$report_type'])
+        self.assertEqual(report.failed_tests,
+                         {record['nodeid'] for record in report.raw_report
+                          if record.get('nodeid')
+                          and record.get('outcome') == 'failed'})
+
+    def test_output_not_logged(self):
+        """The log only holds the outcomes, however much a test prints."""
+        report, _ = run_pytest(self.test_file, cwd=self.test_path,
+                               keep_raw=True)
+
+        self.assertIn('line 99999\n', report.pretty)
+        self.assertFalse(any('line 99999' in str(record)
+                             for record in report.raw_report))
+
+
+class TestCoverageReportFromData(TestCase):
+    def setUp(self):
+        script_dir = Path(__file__).resolve().parent
+        self.test_path = script_dir / 'multiple_t_module_test_files'
+
+    def test_from_data(self):
+        _, cov_report = run_pytest(self.test_path / 'firstTests.py',
+                                   ['two_functions', 'not_imported'],
+                                   cwd=self.test_path)
+
+        self.assertEqual({6},
+                         cov_report.modules['two_functions'].missing_lines)
+        self.assertFalse(cov_report.modules['not_imported'].imported)
+
+    def test_analysis_cached(self):
+        run_pytest(self.test_path / 'firstTests.py', ['two_functions'],
+                   cwd=self.test_path)
+        hits = _missing_lines.cache_info().hits
+
+        _, cov_report = run_pytest(self.test_path / 'firstTests.py',
+                                   ['two_functions'], cwd=self.test_path)
+
+        self.assertEqual(hits + 1, _missing_lines.cache_info().hits)
+        self.assertEqual({6},
+                         cov_report.modules['two_functions'].missing_lines)
+
+    def test_relative_search_path(self):
+        _, cov_report = run_pytest(self.test_path / 'firstTests.py',
+                                   ['two_functions'],
+                                   cwd=os.path.relpath(self.test_path))
+
+        self.assertEqual({6},
+                         cov_report.modules['two_functions'].missing_lines)
+
+    def test_coveragerc(self):
+        """The project's configuration applies, as it does for pytest-cov's
+        reports."""
+        test_path = self.test_path.parent / 'coveragerc_test_files'
+        _, cov_report = run_pytest(test_path / 'unfinishedTests.py',
+                                   ['unfinished'], cwd=test_path)
+
+        # raise NotImplementedError is excluded
+        self.assertEqual(set(), cov_report.modules['unfinished'].missing_lines)
+
+
+class TestCoverageReportMerge(TestCase):
+    def test_merge(self):
+        lhs = CoverageReport({
+            'a': ModuleCoverage(imported=True, missing_lines={1, 2}),
+            'b': ModuleCoverage(imported=False, missing_lines=None)})
+        rhs = CoverageReport({
+            'a': ModuleCoverage(imported=True, missing_lines={2, 3}),
+            'b': ModuleCoverage(imported=True, missing_lines={4})})
+
+        merged = CoverageReport.merge([lhs, rhs])
+
+        self.assertEqual({2}, merged.modules['a'].missing_lines)
+        self.assertTrue(merged.modules['b'].imported)
+        self.assertEqual({4}, merged.modules['b'].missing_lines)
+
+
 class TestTestingReport(TestCase):
     def test_from_run(self):
         raw = [
@@ -244,3 +587,16 @@ class TestTestingReport(TestCase):
 
         expected_failed = {'test_report_example.py::test_fail'}
         self.assertEqual(expected_failed, test_report.failed_tests)
+
+        test_ok = test_report.tests['test_report_example.py::test_ok']
+        test_fail = test_report.tests['test_report_example.py::test_fail']
+        self.assertEqual('passed', test_ok.outcome)
+        self.assertEqual('failed', test_fail.outcome)
+        self.assertEqual({'setup': 'passed', 'call': 'failed',
+                          'teardown': 'passed'}, test_fail.outcomes)
+
+        self.assertAlmostEqual(0.0009992122650146484, test_fail.duration)
+        self.assertAlmostEqual(0.00099945068359375 + 0.0009992122650146484,
+                               test_report.duration)
+        self.assertEqual([test_ok, test_fail], test_report.slowest(5))
+        self.assertEqual([test_ok], test_report.slowest(1))
@@ -0,0 +1,105 @@
+"""Test regrading a submission when files change"""
+from io import StringIO
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import TestCase
+
+from cs9_autograder.watch import (InotifyWatcher, make_watcher,
+                                  PollingWatcher, WatchSession)
+
+
+HERE = Path(__file__).resolve().parent
+TEST_FILES = HERE / 'grading_test_files'
+
+
+class WatcherTests:
+    def make_watcher(self, roots):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        (self.root / 'sub').mkdir()
+        (self.root / 'module.py').write_text('A = 1\n')
+
+        self.watcher = self.make_watcher([self.root])
+
+    def tearDown(self):
+        super().tearDown()
+        self.watcher.close()
+        self.tmp_dir.cleanup()
+
+    def write(self, path, text):
+        mtime = path.stat().st_mtime_ns if path.exists() else 0
+        path.write_text(text)
+        if path.stat().st_mtime_ns <= mtime:
+            os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+    def test_timeout(self):
+        self.assertEqual(set(), self.watcher.wait(0.05))
+
+    def test_change(self):
+        self.write(self.root / 'module.py', 'A = 2\n')
+        self.assertEqual({str(self.root / 'module.py')},
+                         self.watcher.wait(5))
+
+    def test_new_file_in_subdirectory(self):
+        self.write(self.root / 'sub' / 'new.py', 'B = 1\n')
+        self.assertEqual({str(self.root / 'sub' / 'new.py')},
+                         self.watcher.wait(5))
+
+    def test_other_files_ignored(self):
+        self.write(self.root / 'notes.txt', 'hello\n')
+        self.assertEqual(set(), self.watcher.wait(0.3))
+
+
+class TestPollingWatcher(WatcherTests, TestCase):
+    def make_watcher(self, roots):
+        return PollingWatcher(roots, interval=0.01)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TestInotifyWatcher(WatcherTests, TestCase):
+    def make_watcher(self, roots):
+        return InotifyWatcher(roots)
+
+    def test_make_watcher(self):
+        watcher = make_watcher([self.root])
+        self.addCleanup(watcher.close)
+        self.assertIsInstance(watcher, InotifyWatcher)
+
+
+class TestWatchSession(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.submission = Path(self.tmp_dir.name)
+        shutil.copy(TEST_FILES / 'good' / 'lab.py', self.submission)
+
+        self.out = StringIO()
+        self.session = WatchSession(TEST_FILES / 'lab_autograder.py',
+                                    self.submission, out=self.out)
+        self.addCleanup(self.session.autograder.close)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_regrade(self):
+        self.assertEqual(3, self.session.grade()['score'])
+        self.assertIn('Score: 3/3 (3 tests run', self.out.getvalue())
+
+        lab = self.submission / 'lab.py'
+        mtime = lab.stat().st_mtime_ns
+        shutil.copy(TEST_FILES / 'bad' / 'lab.py', lab)
+        os.utime(lab, ns=(mtime + 10**9, mtime + 10**9))
+
+        self.assertEqual(1, self.session.grade()['score'])
+        self.assertIn('FAILED  lab_autograder.Grader.test_double',
+                      self.out.getvalue())
+
+        self.session.grade()
+        self.assertIn('Score: 1/3 (0 tests run', self.out.getvalue())